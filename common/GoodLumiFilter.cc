@@ -1,5 +1,93 @@
 #include "GoodLumiFilter.h"
 
+#include <fstream>
+#include <sstream>
+#include <algorithm>
+#include <stdexcept>
+#include <cctype>
+#include <cstdlib>
+
+void
+GoodLumiFilter::addLumiRange(unsigned _run, unsigned _first, unsigned _last)
+{
+  if (_last < _first)
+    return;
+
+  auto& ranges(goodLumiList_[_run]);
+
+  // first range that can touch [_first, _last]
+  auto itr(std::lower_bound(ranges.begin(), ranges.end(), _first, [](std::pair<unsigned, unsigned> const& r, unsigned l) { return r.second + 1 < l; }));
+
+  // merge all ranges that overlap or are adjacent
+  auto end(itr);
+  while (end != ranges.end() && end->first <= _last + 1) {
+    _first = std::min(_first, end->first);
+    _last = std::max(_last, end->second);
+    ++end;
+  }
+
+  itr = ranges.erase(itr, end);
+  ranges.emplace(itr, _first, _last);
+
+  // invalidate the lookup cache
+  currentRun_ = 0;
+  currentRanges_ = 0;
+  currentLumi_ = 0;
+}
+
+unsigned
+GoodLumiFilter::readJSON(char const* _path)
+{
+  // Minimal reader for the certification format {"run": [[first, last], ...], ...}
+  std::ifstream source(_path);
+  if (!source.is_open())
+    throw std::runtime_error(std::string("Cannot open ") + _path);
+
+  std::stringstream buffer;
+  buffer << source.rdbuf();
+  std::string content(buffer.str());
+
+  unsigned nRanges(0);
+  unsigned run(0);
+  int depth(0);
+  std::vector<unsigned> bounds;
+
+  for (unsigned pos(0); pos < content.size(); ++pos) {
+    char c(content[pos]);
+
+    if (c == '"') {
+      auto close(content.find('"', pos + 1));
+      if (close == std::string::npos)
+        throw std::runtime_error(std::string("Malformed JSON ") + _path);
+
+      run = std::strtoul(content.substr(pos + 1, close - pos - 1).c_str(), 0, 10);
+      pos = close;
+    }
+    else if (c == '{' || c == '[') {
+      ++depth;
+    }
+    else if (c == '}' || c == ']') {
+      if (depth == 3) {
+        // end of one [first, last] pair
+        if (bounds.size() != 2)
+          throw std::runtime_error(std::string("Malformed lumi range in ") + _path);
+
+        addLumiRange(run, bounds[0], bounds[1]);
+        bounds.clear();
+        ++nRanges;
+      }
+      --depth;
+    }
+    else if (std::isdigit(c) && depth == 3) {
+      char* end(0);
+      bounds.push_back(std::strtoul(content.c_str() + pos, &end, 10));
+      pos = end - content.c_str() - 1;
+    }
+  }
+
+  return nRanges;
+}
+
 bool
 GoodLumiFilter::isGoodLumi(unsigned run, unsigned lumi) const
 {
@@ -9,19 +97,26 @@ GoodLumiFilter::isGoodLumi(unsigned run, unsigned lumi) const
   if (run == currentRun_ && lumi == currentLumi_)
     return currentStatus_;
 
-  currentRun_ = run;
-  currentLumi_ = lumi;
+  if (run != currentRun_) {
+    currentRun_ = run;
 
-  auto rItr(goodLumiList_.find(run));
-  if (rItr != goodLumiList_.end()) {
-    auto lItr(rItr->second.find(lumi));
-    if (lItr != rItr->second.end()) {
-      currentStatus_ = true;
-      return currentStatus_;
-    }
+    auto rItr(goodLumiList_.find(run));
+    if (rItr != goodLumiList_.end())
+      currentRanges_ = &rItr->second;
+    else
+      currentRanges_ = 0;
   }
 
+  currentLumi_ = lumi;
   currentStatus_ = false;
+
+  if (currentRanges_) {
+    // first range starting after lumi; the one before it is the only candidate
+    auto itr(std::upper_bound(currentRanges_->begin(), currentRanges_->end(), lumi, [](unsigned l, std::pair<unsigned, unsigned> const& r) { return l < r.first; }));
+    if (itr != currentRanges_->begin())
+      currentStatus_ = lumi <= (--itr)->second;
+  }
+
   return currentStatus_;
 }
 
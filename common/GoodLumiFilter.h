@@ -2,20 +2,28 @@
 #define GoodLumiFilter_h
 
 #include <map>
-#include <set>
+#include <vector>
+#include <utility>
 
 class GoodLumiFilter {
 public:
   GoodLumiFilter() {}
   ~GoodLumiFilter() {}
 
-  void addLumi(unsigned run, unsigned lumi) { goodLumiList_[run].insert(lumi); }
+  void addLumi(unsigned run, unsigned lumi) { addLumiRange(run, lumi, lumi); }
+  // Add lumis [first, last] (inclusive, as in the certification JSON)
+  void addLumiRange(unsigned run, unsigned first, unsigned last);
+  // Add all ranges from a certification JSON file; returns the number of ranges read
+  unsigned readJSON(char const* path);
   bool isGoodLumi(unsigned run, unsigned lumi) const;
   bool hasGoodLumi(unsigned run) const;
 
 private:
-  std::map<unsigned, std::set<unsigned>> goodLumiList_;
+  typedef std::vector<std::pair<unsigned, unsigned>> LumiRanges; // sorted, non-overlapping [first, last]
+
+  std::map<unsigned, LumiRanges> goodLumiList_;
   mutable unsigned currentRun_{0};
+  mutable LumiRanges const* currentRanges_{0};
   mutable unsigned currentLumi_{0};
   mutable bool currentStatus_{false};
 };
@@ -8,11 +8,12 @@
 #include <sstream>
 #include <string>
 #include <iostream>
+#include <vector>
 
 typedef std::map<unsigned, std::set<unsigned>> LumiList;
 
 void
-makeJson(TTree* _input, char const* _outName, GoodLumiFilter* _mask = 0, char const* _runBranchName = "runNum", char const* _lumiBranchName = "lumiNum")
+fillLumiList(TTree* _input, LumiList& _lumiList, GoodLumiFilter* _mask, char const* _runBranchName, char const* _lumiBranchName)
 {
   // unsigned can take signed run numbers too (highest bit is never used anyway)
   unsigned run;
@@ -24,19 +25,74 @@ makeJson(TTree* _input, char const* _outName, GoodLumiFilter* _mask = 0, char co
   _input->SetBranchAddress(_runBranchName, &run);
   _input->SetBranchAddress(_lumiBranchName, &lumi);
 
-  LumiList lumiList;
+  // read the two branches in large chunks
+  _input->SetCacheSize(16 * 1024 * 1024);
+  _input->AddBranchToCache(_runBranchName, true);
+  _input->AddBranchToCache(_lumiBranchName, true);
+
+  // entries come in lumi blocks; only insert when the lumi changes
+  unsigned lastRun(-1);
+  unsigned lastLumi(-1);
 
   long iEntry(0);
   while (_input->GetEntry(iEntry++) > 0) {
     if (iEntry % 10000000 == 1)
       std::cout << iEntry << std::endl;
 
+    if (run == lastRun && lumi == lastLumi)
+      continue;
+
+    lastRun = run;
+    lastLumi = lumi;
+
     if (_mask && !_mask->isGoodLumi(run, lumi))
       continue;
 
-    lumiList[run].insert(lumi);
+    _lumiList[run].insert(lumi);
   }
 
+  _input->SetCacheSize(0);
+}
+
+std::vector<unsigned>
+readLumis(TTree* _input, GoodLumiFilter* _mask = 0, char const* _runBranchName = "runNum", char const* _lumiBranchName = "lumiNum")
+{
+  // Returns the lumi intervals as a flat list (run, first, last, run, first, last, ...)
+
+  LumiList lumiList;
+  fillLumiList(_input, lumiList, _mask, _runBranchName, _lumiBranchName);
+
+  std::vector<unsigned> intervals;
+
+  for (auto&& runAndList : lumiList) {
+    unsigned current(-1);
+    for (unsigned lumi : runAndList.second) {
+      if (lumi == current + 1) {
+        current = lumi;
+        continue;
+      }
+
+      if (current != unsigned(-1))
+        intervals.push_back(current);
+
+      current = lumi;
+      intervals.push_back(runAndList.first);
+      intervals.push_back(current);
+    }
+
+    if (current != unsigned(-1))
+      intervals.push_back(current);
+  }
+
+  return intervals;
+}
+
+void
+makeJson(TTree* _input, char const* _outName, GoodLumiFilter* _mask = 0, char const* _runBranchName = "runNum", char const* _lumiBranchName = "lumiNum")
+{
+  LumiList lumiList;
+  fillLumiList(_input, lumiList, _mask, _runBranchName, _lumiBranchName);
+
   std::stringstream ss;
 
   for (auto&& runAndList : lumiList) {
@@ -7,10 +7,23 @@
 #include "TError.h"
 #include "TLeafF.h"
 #include "TLeafD.h"
+#include "TChainElement.h"
+#include "TROOT.h"
+#include "TInterpreter.h"
+#include "TLeafElement.h"
+#include "TLeafC.h"
 
 #include <stdexcept>
 #include <cstring>
 #include <iostream>
+#include <thread>
+#include <exception>
+#include <algorithm>
+#include <memory>
+#include <mutex>
+#include <cctype>
+#include <cstdlib>
+#include <string>
 
 /*
   TFormula has no foolproof mechanism to signal a failure of expression compilation.
@@ -94,6 +107,305 @@ TTreeFormulaCached::EvalInstance(Int_t _i, char const* _stringStack[]/* = nullpt
 }
 
 
+//! A wrapper for CompiledFormula creation
+CompiledFormula*
+NewCompiledFormula(char const* _name, char const* _expr, TTree* _tree)
+{
+  gLastErrorLevel = 0;
+  auto* errh(SetErrorHandler(MyErrorHandler));
+
+  auto* formula(new CompiledFormula(_name, _expr, _tree));
+
+  SetErrorHandler(errh);
+
+  if (formula->GetTree() == nullptr || gLastErrorLevel == kError) {
+    // compilation failed
+    delete formula;
+    return nullptr;
+  }
+
+  return formula;
+}
+
+TLeaf*
+FormulaColumns::findLeaf_(TTree& _tree, char const* _name)
+{
+  auto* leaf(_tree.GetLeaf(_name));
+  if (leaf == nullptr)
+    leaf = _tree.FindLeaf(_name);
+
+  return leaf;
+}
+
+int
+FormulaColumns::addColumn(TTree& _tree, char const* _leafName, int _index)
+{
+  for (unsigned iC(0); iC != columns_.size(); ++iC) {
+    if (columns_[iC].name == _leafName && columns_[iC].index == _index)
+      return iC;
+  }
+
+  auto* leaf(findLeaf_(_tree, _leafName));
+  if (leaf == nullptr || leaf->InheritsFrom(TLeafElement::Class()) || leaf->InheritsFrom(TLeafC::Class()))
+    return -1;
+
+  columns_.push_back({_leafName, _index, leaf, -1, 0., false});
+
+  return columns_.size() - 1;
+}
+
+void
+FormulaColumns::updateTree(TTree& _tree)
+{
+  for (auto& column : columns_) {
+    column.leaf = findLeaf_(_tree, column.name);
+    if (column.leaf == nullptr)
+      throw std::runtime_error(("Leaf " + column.name + " not found").Data());
+
+    column.entry = -1;
+  }
+}
+
+bool
+FormulaColumns::load(unsigned _iC)
+{
+  auto& column(columns_[_iC]);
+
+  Long64_t entry(column.leaf->GetBranch()->GetTree()->GetReadEntry());
+  if (entry != column.entry) {
+    column.entry = entry;
+
+    auto* count(column.leaf->GetLeafCount());
+    if (count != nullptr)
+      count->GetBranch()->GetEntry(entry);
+
+    column.leaf->GetBranch()->GetEntry(entry);
+
+    int index(column.index < 0 ? 0 : column.index);
+    column.inRange = index < column.leaf->GetLen();
+    column.value = column.inRange ? column.leaf->GetValue(index) : 0.;
+  }
+
+  return column.inRange;
+}
+
+namespace {
+
+  //! Translate a TTreeFormula expression into a C++ expression.
+  /*!
+   * Leaves are replaced by _v[i], where i is the position of the (leaf name, index) pair in _leaves.
+   * Integer literals are turned into floating point numbers to avoid integer division. Returns false
+   * if the expression uses features that have no direct C++ equivalent.
+   */
+  bool
+  translateExpression(TString const& _expr, TString& _code, std::vector<std::pair<TString, int>>& _leaves)
+  {
+    std::string expr(_expr.Data());
+    unsigned n(expr.size());
+    std::string code;
+
+    unsigned i(0);
+    while (i != n) {
+      char c(expr[i]);
+
+      if (std::isalpha(c) || c == '_') {
+        unsigned j(i);
+        while (j != n) {
+          if (std::isalnum(expr[j]) || expr[j] == '_' || expr[j] == '.')
+            ++j;
+          else if (expr[j] == ':' && j + 1 != n && expr[j + 1] == ':')
+            j += 2;
+          else
+            break;
+        }
+
+        std::string name(expr.substr(i, j - i));
+        i = j;
+
+        unsigned k(j);
+        while (k != n && expr[k] == ' ')
+          ++k;
+
+        // TFormula abs/min/max are floating point functions; the unqualified C++ names would resolve to
+        // the integer std::abs or not at all
+        if (k != n && expr[k] == '(') {
+          if (name == "abs")
+            name = "TMath::Abs";
+          else if (name == "min")
+            name = "TMath::Min";
+          else if (name == "max")
+            name = "TMath::Max";
+        }
+
+        // function calls, namespaced constants, and booleans are passed through
+        if ((k != n && expr[k] == '(') || name.find("::") != std::string::npos || name == "true" || name == "false") {
+          code += name;
+          continue;
+        }
+
+        int index(-1);
+        if (k != n && expr[k] == '[') {
+          unsigned l(k + 1);
+          while (l != n && std::isdigit(expr[l]))
+            ++l;
+
+          if (l == k + 1 || l == n || expr[l] != ']')
+            return false;
+
+          index = std::atoi(expr.substr(k + 1, l - k - 1).c_str());
+          i = l + 1;
+        }
+
+        std::pair<TString, int> leaf(name.c_str(), index);
+        auto lItr(std::find(_leaves.begin(), _leaves.end(), leaf));
+        unsigned iL(lItr - _leaves.begin());
+        if (lItr == _leaves.end())
+          _leaves.push_back(leaf);
+
+        code += "_v[" + std::to_string(iL) + "]";
+      }
+      else if (std::isdigit(c) || (c == '.' && i + 1 != n && std::isdigit(expr[i + 1]))) {
+        unsigned j(i);
+        bool isFloat(false);
+        while (j != n) {
+          if (std::isdigit(expr[j]))
+            ++j;
+          else if (expr[j] == '.') {
+            isFloat = true;
+            ++j;
+          }
+          else if (expr[j] == 'e' || expr[j] == 'E') {
+            isFloat = true;
+            ++j;
+            if (j != n && (expr[j] == '+' || expr[j] == '-'))
+              ++j;
+          }
+          else
+            break;
+        }
+
+        code += expr.substr(i, j - i);
+        if (!isFloat)
+          code += ".";
+
+        i = j;
+      }
+      else if (std::strchr("$@\"'^[]?:#", c) != nullptr)
+        return false;
+      else if (c == '*' && i + 1 != n && expr[i + 1] == '*')
+        return false;
+      else {
+        code += c;
+        ++i;
+      }
+    }
+
+    _code = code.c_str();
+    return true;
+  }
+
+}
+
+Bool_t
+CompiledFormula::Compile(FormulaColumns& _columns)
+{
+  // functions declared to the interpreter, keyed by the translated expression
+  static std::map<TString, Function> functions;
+  static std::mutex functionsMutex;
+
+  if (GetMultiplicity() != 0)
+    return false;
+
+  TString code;
+  std::vector<std::pair<TString, int>> leaves;
+  if (!translateExpression(GetTitle(), code, leaves))
+    return false;
+
+  std::vector<unsigned> columnIds;
+  for (auto& leaf : leaves) {
+    int iC(_columns.addColumn(*GetTree(), leaf.first, leaf.second));
+    if (iC < 0)
+      return false;
+
+    columnIds.push_back(iC);
+  }
+
+  std::lock_guard<std::mutex> lock(functionsMutex);
+
+  auto fItr(functions.find(code));
+  if (fItr == functions.end()) {
+    TString fname(TString::Format("MultiDraw_compiled_%d", int(functions.size())));
+
+    Function function(nullptr);
+
+    gLastErrorLevel = 0;
+    auto* errh(SetErrorHandler(MyErrorHandler));
+
+    if (gInterpreter->Declare("#include \"TMath.h\"\ndouble " + fname + "(double const* _v) { return (" + code + "); }"))
+      function = reinterpret_cast<Function>(gInterpreter->Calc("(long)&" + fname));
+
+    SetErrorHandler(errh);
+
+    if (gLastErrorLevel == kError)
+      function = nullptr;
+
+    // failures are recorded too so that they are not retried
+    fItr = functions.emplace(code, function).first;
+  }
+
+  if (fItr->second == nullptr)
+    return false;
+
+  fFunction = fItr->second;
+  fColumns = &_columns;
+  fColumnIds = columnIds;
+  fArgs.assign(columnIds.size(), 0.);
+
+  return true;
+}
+
+Int_t
+CompiledFormula::GetNdata()
+{
+  if (fFunction == nullptr)
+    return TTreeFormulaCached::GetNdata();
+
+  if (fNdataCache < 0) {
+    // a fixed index beyond the array size results in no instance, as in TTreeFormula
+    fNdataCache = 1;
+    for (unsigned iC : fColumnIds) {
+      if (!fColumns->load(iC))
+        fNdataCache = 0;
+    }
+
+    fCache.assign(fNdataCache, std::pair<Bool_t, Double_t>(false, 0.));
+  }
+
+  return fNdataCache;
+}
+
+Double_t
+CompiledFormula::EvalInstance(Int_t _i, char const* _stringStack[]/* = nullptr*/)
+{
+  if (fFunction == nullptr)
+    return TTreeFormulaCached::EvalInstance(_i, _stringStack);
+
+  if (_i >= int(fCache.size()))
+    return 0.;
+
+  if (!fCache[_i].first) {
+    fCache[_i].first = true;
+
+    for (unsigned iA(0); iA != fColumnIds.size(); ++iA)
+      fArgs[iA] = fColumns->getValue(fColumnIds[iA]);
+
+    fCache[_i].second = fFunction(fArgs.data());
+  }
+
+  return fCache[_i].second;
+}
+
+
 ExprFiller::ExprFiller(TTreeFormula* _cuts/* = nullptr*/, TTreeFormula* _reweight/* = nullptr*/) :
   cuts_(_cuts),
   reweight_(_reweight)
@@ -201,6 +513,8 @@ ExprFiller::fill(std::vector<double> const& _eventWeights, std::vector<bool> con
         if (iD != 0)
           reweight_->EvalInstance(0);
       }
+
+      loadFormulas_(iD);
     }
 
     loaded = true;
@@ -231,6 +545,37 @@ Plot::Plot(Plot const& _orig) :
   hist_(_orig.hist_),
   overflowMode_(_orig.overflowMode_)
 {
+  for (auto& variation : _orig.variations_) {
+    TTreeFormula* reweight(variation.second);
+    if (ownFormulas_ && reweight != nullptr) {
+      reweight = NewTTreeFormula(reweight->GetName(), reweight->GetTitle(), reweight->GetTree());
+      if (reweight == nullptr)
+        throw std::runtime_error("Failed to compile reweight.");
+    }
+
+    variations_.emplace_back(variation.first, reweight);
+  }
+}
+
+Plot::~Plot()
+{
+  if (ownFormulas_) {
+    for (auto& variation : variations_)
+      delete variation.second;
+  }
+}
+
+void
+Plot::loadFormulas_(unsigned _iD)
+{
+  for (auto& variation : variations_) {
+    if (variation.second == nullptr)
+      continue;
+
+    variation.second->GetNdata();
+    if (_iD != 0)
+      variation.second->EvalInstance(0);
+  }
 }
 
 void
@@ -255,6 +600,17 @@ Plot::doFill_(unsigned _iD)
   }
 
   hist_->Fill(x, entryWeight_);
+
+  for (auto& variation : variations_) {
+    double weight(entryWeight_);
+    if (variation.second != nullptr)
+      weight *= variation.second->EvalInstance(_iD);
+
+    if (printLevel_ > 3)
+      std::cout << "            Fill variation " << variation.first->GetName() << "(" << x << "; " << weight << ")" << std::endl;
+
+    variation.first->Fill(x, weight);
+  }
 }
 
 
@@ -374,6 +730,7 @@ MultiDraw::setReweight(char const* _expr, TObject const* _source/* = nullptr*/)
   }
 
   reweight_ = nullptr;
+  reweightSource_ = nullptr;
 
   if (!_expr || std::strlen(_expr) == 0)
     return;
@@ -384,6 +741,8 @@ MultiDraw::setReweight(char const* _expr, TObject const* _source/* = nullptr*/)
     return;
   }
 
+  reweightSource_ = _source;
+
   if (_source != nullptr) {
     if (_source->InheritsFrom(TH1::Class())) {
       auto* source(static_cast<TH1 const*>(_source));
@@ -497,6 +856,42 @@ MultiDraw::addPlot(TH1* _hist, char const* _expr, char const* _cuts/* = ""*/, bo
   addObj_(_cuts, _applyBaseline, _applyFullSelection, _reweight, newPlot);
 }
 
+void
+MultiDraw::addWeightVariation(TH1* _nominal, TH1* _hist, char const* _reweight/* = ""*/)
+{
+  Plot* plot(nullptr);
+  for (auto* plots : {&postFull_, &postBase_, &unconditional_}) {
+    for (auto* filler : *plots) {
+      if (filler->getObj() == _nominal) {
+        plot = static_cast<Plot*>(filler);
+        break;
+      }
+    }
+  }
+
+  if (plot == nullptr) {
+    std::cerr << "Variation " << _hist->GetName() << " cannot be added (plot " << _nominal->GetName() << " not found)" << std::endl;
+    return;
+  }
+
+  TTreeFormulaCached* reweightFormula(nullptr);
+  if (_reweight != nullptr && std::strlen(_reweight) != 0) {
+    reweightFormula = getFormula_(_reweight);
+    if (reweightFormula == nullptr) {
+      std::cerr << "Failed to compile reweight " << _reweight << std::endl;
+      return;
+    }
+  }
+
+  if (printLevel_ > 1) {
+    std::cout << "\nAdding variation " << _hist->GetName() << " to Plot " << _nominal->GetName() << std::endl;
+    if (reweightFormula != nullptr)
+      std::cout << " Reweight: " << _reweight << std::endl;
+  }
+
+  plot->addVariation(*_hist, reweightFormula);
+}
+
 void
 MultiDraw::addTree(TTree* _tree, char const* _cuts/* = ""*/, bool _applyBaseline/* = true*/, bool _applyFullSelection/* = false*/, char const* _reweight/* = ""*/)
 {
@@ -579,9 +974,23 @@ MultiDraw::getFormula_(char const* _expr)
     return fItr->second;
   }
 
-  auto* f(NewTTreeFormulaCached("formula", _expr, &tree_));
-  if (f == nullptr)
-    return nullptr;
+  TTreeFormulaCached* f(nullptr);
+  if (compileFormulas_) {
+    auto* cf(NewCompiledFormula("formula", _expr, &tree_));
+    if (cf == nullptr)
+      return nullptr;
+
+    bool compiled(cf->Compile(columns_));
+    if (printLevel_ > 1)
+      std::cout << "  Formula " << _expr << (compiled ? " compiled" : " is interpreted") << std::endl;
+
+    f = cf;
+  }
+  else {
+    f = NewTTreeFormulaCached("formula", _expr, &tree_);
+    if (f == nullptr)
+      return nullptr;
+  }
 
   library_.emplace(_expr, f);
 
@@ -600,6 +1009,11 @@ MultiDraw::deleteFormula_(TTreeFormulaCached* _formula)
 void
 MultiDraw::fillPlots(long _nEntries/* = -1*/, long _firstEntry/* = 0*/)
 {
+  if (nThreads_ > 1) {
+    fillPlotsParallel_(_nEntries, _firstEntry);
+    return;
+  }
+
   float* weightF(nullptr);
   double weight(1.);
   unsigned eventNumber;
@@ -693,6 +1107,8 @@ MultiDraw::fillPlots(long _nEntries/* = -1*/, long _firstEntry/* = 0*/)
         eventNumberBranch->SetAddress(&eventNumber);
       }
 
+      columns_.updateTree(tree_);
+
       for (auto& ff : library_)
         ff.second->UpdateFormulaLeaves();
     }
@@ -859,3 +1275,202 @@ MultiDraw::fillPlots(long _nEntries/* = -1*/, long _firstEntry/* = 0*/)
     }
   }
 }
+
+void
+MultiDraw::fillPlotsParallel_(long _nEntries, long _firstEntry)
+{
+  long nTotal(tree_.GetEntries());
+  long lastEntry(nTotal);
+  if (_nEntries >= 0 && _firstEntry + _nEntries < nTotal)
+    lastEntry = _firstEntry + _nEntries;
+
+  if (lastEntry <= _firstEntry) {
+    totalEvents_ = 0;
+    return;
+  }
+
+  unsigned nThreads(nThreads_);
+  if (lastEntry - _firstEntry < nThreads)
+    nThreads = lastEntry - _firstEntry;
+
+  // entry range boundaries; snap to file boundaries if each thread can get at least one file
+  std::vector<long> boundaries(1, _firstEntry);
+  for (unsigned iT(1); iT != nThreads; ++iT)
+    boundaries.push_back(_firstEntry + (lastEntry - _firstEntry) * iT / nThreads);
+  boundaries.push_back(lastEntry);
+
+  int nTrees(tree_.GetNtrees());
+  if (nTrees >= int(nThreads)) {
+    Long64_t const* offsets(tree_.GetTreeOffset());
+    for (unsigned iT(1); iT != nThreads; ++iT) {
+      long& boundary(boundaries[iT]);
+      auto* closest(std::lower_bound(offsets, offsets + nTrees, boundary));
+      if (closest != offsets && (closest == offsets + nTrees || boundary - *(closest - 1) < *closest - boundary))
+        --closest;
+      if (*closest > boundaries[iT - 1] && *closest < lastEntry)
+        boundary = *closest;
+    }
+  }
+
+  if (printLevel_ > 1) {
+    std::cout << "      Processing entries " << _firstEntry << " - " << lastEntry << " in " << nThreads << " threads" << std::endl;
+    for (unsigned iT(0); iT != nThreads; ++iT)
+      std::cout << "        [" << boundaries[iT] << ", " << boundaries[iT + 1] << ")" << std::endl;
+  }
+
+  ROOT::EnableThreadSafety();
+
+  // Set up the workers in the main thread (formula compilation is not thread safe)
+  std::vector<std::unique_ptr<MultiDraw>> workers;
+  std::vector<std::unique_ptr<TObject>> workerObjs;
+
+  std::vector<ExprFiller*> fillers;
+  for (auto* plots : {&unconditional_, &postBase_, &postFull_})
+    fillers.insert(fillers.end(), plots->begin(), plots->end());
+
+  for (unsigned iT(0); iT != nThreads; ++iT) {
+    workers.emplace_back(new MultiDraw(tree_.GetName()));
+    auto& worker(*workers.back());
+
+    for (auto* obj : *tree_.GetListOfFiles()) {
+      auto& element(static_cast<TChainElement&>(*obj));
+      worker.tree_.AddFile(element.GetTitle(), element.GetEntries());
+    }
+
+    worker.weightBranchName_ = weightBranchName_;
+    worker.constWeight_ = constWeight_;
+    worker.prescale_ = prescale_;
+    worker.printLevel_ = -1;
+    worker.compileFormulas_ = compileFormulas_;
+
+    if (baseSelection_ != nullptr)
+      worker.setBaseSelection(baseSelection_->GetTitle());
+    if (fullSelection_ != nullptr)
+      worker.setFullSelection(fullSelection_->GetTitle());
+
+    if (reweightExpr_ != nullptr) {
+      TObject* source(nullptr);
+      if (reweightSource_ != nullptr) {
+        source = reweightSource_->Clone();
+        if (source->InheritsFrom(TH1::Class()))
+          static_cast<TH1*>(source)->SetDirectory(nullptr);
+        workerObjs.emplace_back(source);
+      }
+      worker.setReweight(reweightExpr_->GetTitle(), source);
+    }
+
+    for (auto* plots : {&unconditional_, &postBase_, &postFull_}) {
+      bool applyBaseline(plots != &unconditional_);
+      bool applyFullSelection(plots == &postFull_);
+
+      for (auto* filler : *plots) {
+        char const* cuts(filler->getCuts() == nullptr ? "" : filler->getCuts()->GetTitle());
+        char const* reweight(filler->getReweight() == nullptr ? "" : filler->getReweight()->GetTitle());
+
+        if (dynamic_cast<Plot*>(filler) != nullptr) {
+          auto& plot(static_cast<Plot&>(*filler));
+
+          auto* hist(static_cast<TH1*>(plot.getHist()->Clone()));
+          hist->SetDirectory(nullptr);
+          hist->Reset();
+          workerObjs.emplace_back(hist);
+
+          worker.addPlot(hist, plot.getExpr()->GetTitle(), cuts, applyBaseline, applyFullSelection, reweight, plot.getOverflowMode());
+
+          for (unsigned iV(0); iV != plot.getNVariations(); ++iV) {
+            auto* vhist(static_cast<TH1*>(plot.getVariationHist(iV)->Clone()));
+            vhist->SetDirectory(nullptr);
+            vhist->Reset();
+            workerObjs.emplace_back(vhist);
+
+            auto* vreweight(plot.getVariationReweight(iV));
+            worker.addWeightVariation(hist, vhist, vreweight == nullptr ? "" : vreweight->GetTitle());
+          }
+        }
+        else {
+          auto& tree(static_cast<Tree&>(*filler));
+
+          auto* clone(new TTree(tree.getTree()->GetName(), tree.getTree()->GetTitle()));
+          clone->SetDirectory(nullptr);
+          workerObjs.emplace_back(clone);
+
+          worker.addTree(clone, cuts, applyBaseline, applyFullSelection, reweight);
+
+          // branch 0 is the weight
+          auto* branches(tree.getTree()->GetListOfBranches());
+          for (unsigned iE(0); iE != tree.getNdim(); ++iE)
+            worker.addTreeBranch(clone, branches->At(iE + 1)->GetName(), tree.getExpr(iE)->GetTitle());
+        }
+      }
+    }
+
+    if (worker.numObjs() != numObjs())
+      throw std::runtime_error("Failed to replicate the plot configuration in a worker thread");
+  }
+
+  std::vector<std::exception_ptr> exceptions(nThreads);
+  std::vector<std::thread> threads;
+
+  for (unsigned iT(0); iT != nThreads; ++iT) {
+    threads.emplace_back([&workers, &boundaries, &exceptions, iT]() {
+        try {
+          workers[iT]->fillPlots(boundaries[iT + 1] - boundaries[iT], boundaries[iT]);
+        }
+        catch (...) {
+          exceptions[iT] = std::current_exception();
+        }
+      });
+  }
+
+  for (auto& thread : threads)
+    thread.join();
+
+  for (auto& ex : exceptions) {
+    if (ex)
+      std::rethrow_exception(ex);
+  }
+
+  // Merge the thread-local objects into the user objects
+  for (auto* filler : fillers)
+    filler->resetCount();
+
+  for (auto& worker : workers) {
+    std::vector<ExprFiller*> workerFillers;
+    for (auto* plots : {&worker->unconditional_, &worker->postBase_, &worker->postFull_})
+      workerFillers.insert(workerFillers.end(), plots->begin(), plots->end());
+
+    for (unsigned iF(0); iF != fillers.size(); ++iF) {
+      auto* filler(fillers[iF]);
+      auto* workerFiller(workerFillers[iF]);
+
+      if (dynamic_cast<Plot*>(filler) != nullptr) {
+        auto* plot(static_cast<Plot*>(filler));
+        auto* workerPlot(static_cast<Plot*>(workerFiller));
+
+        plot->getHist()->Add(workerPlot->getHist());
+        for (unsigned iV(0); iV != plot->getNVariations(); ++iV)
+          plot->getVariationHist(iV)->Add(workerPlot->getVariationHist(iV));
+      }
+      else if (workerFiller->getCount() != 0)
+        static_cast<Tree*>(filler)->getTree()->CopyEntries(static_cast<Tree*>(workerFiller)->getTree());
+
+      filler->addCount(workerFiller->getCount());
+    }
+  }
+
+  // fillers must be deleted before the cloned objects
+  workers.clear();
+  workerObjs.clear();
+
+  totalEvents_ = lastEntry;
+
+  if (printLevel_ >= 0)
+    std::cout << "      " << lastEntry << " events" << std::endl;
+
+  if (printLevel_ > 0) {
+    for (auto* plots : {&postFull_, &postBase_, &unconditional_}) {
+      for (auto* plot : *plots)
+        std::cout << "        " << plot->getObj()->GetName() << ": " << plot->getCount() << std::endl;
+    }
+  }
+}
@@ -5,6 +5,7 @@
 #include "TTreeFormula.h"
 #include "TH1.h"
 #include "TString.h"
+#include "TLeaf.h"
 
 #include <map>
 #include <vector>
@@ -33,12 +34,73 @@ public:
   void SetNRef(UInt_t n) { fNRef = n; }
   UInt_t GetNRef() const { return fNRef; }
 
-private:
+protected:
   Int_t fNdataCache{-1};
   UInt_t fNRef{1};
   std::vector<std::pair<Bool_t, Double_t>> fCache{};
 };
 
+//! Leaf values shared among CompiledFormulas.
+/*!
+ * Each column is a (leaf, fixed array index) pair. The branch of a column is read at most once
+ * per entry no matter how many formulas refer to it. updateTree() must be called whenever the
+ * current tree of the input chain changes.
+ */
+class FormulaColumns {
+public:
+  FormulaColumns() {}
+  ~FormulaColumns() {}
+
+  //! Returns the column index, or -1 if the leaf is not found or is not a plain numeric leaf.
+  int addColumn(TTree&, char const* leafName, int index);
+  void updateTree(TTree&);
+  //! Read the column for the current entry. Returns false if the index is out of range.
+  bool load(unsigned);
+  double getValue(unsigned iC) const { return columns_[iC].value; }
+
+private:
+  struct Column {
+    TString name;
+    int index;
+    TLeaf* leaf;
+    Long64_t entry;
+    Double_t value;
+    Bool_t inRange;
+  };
+
+  static TLeaf* findLeaf_(TTree&, char const*);
+
+  std::vector<Column> columns_{};
+};
+
+//! TTreeFormulaCached backed by a JIT-compiled C++ function.
+/*!
+ * Compile() translates the expression into C++, with leaves replaced by references to
+ * FormulaColumns, and declares it to the interpreter. Identical translated expressions share
+ * one function across all formulas and MultiDraw instances. Only expressions with multiplicity
+ * 0 and without TTreeFormula-specific syntax ($ functions, @, strings, ^ and ** powers) can be
+ * compiled; for the others Compile() returns false and the formula is evaluated by TTreeFormula.
+ */
+class CompiledFormula : public TTreeFormulaCached {
+public:
+  CompiledFormula(char const* name, char const* formula, TTree* tree) : TTreeFormulaCached(name, formula, tree) {}
+  ~CompiledFormula() {}
+
+  Int_t GetNdata() override;
+  Double_t EvalInstance(Int_t, char const* [] = nullptr) override;
+
+  Bool_t Compile(FormulaColumns&);
+  Bool_t IsCompiled() const { return fFunction != nullptr; }
+
+private:
+  typedef Double_t (*Function)(Double_t const*);
+
+  Function fFunction{nullptr};
+  FormulaColumns* fColumns{nullptr};
+  std::vector<unsigned> fColumnIds{};
+  std::vector<Double_t> fArgs{};
+};
+
 //! Filler object base class with expressions, a cut, and a reweight.
 /*!
  * Inherited by Plot (histogram) and Tree (tree). Does not own any of
@@ -64,12 +126,15 @@ public:
   virtual TObject const* getObj() const = 0;
 
   void resetCount() { counter_ = 0; }
+  void addCount(unsigned c) { counter_ += c; }
   unsigned getCount() const { return counter_; }
 
   void setPrintLevel(int l) { printLevel_ = l; }
 
 protected:
   virtual void doFill_(unsigned) = 0;
+  //! Called once per event before the first doFill_, for subclasses evaluating additional formulas.
+  virtual void loadFormulas_(unsigned) {}
 
   std::vector<TTreeFormula*> exprs_{};
   TTreeFormula* cuts_{nullptr};
@@ -92,6 +157,8 @@ protected:
  *  double overflowBinSize  If 0, overflow is not handled explicitly (i.e. TH1 fills the n+1-st bin)
  *                          If >0, an overflow bin with size (original width)*overflowBinSize is created
  *                          If <0, the ove
+ * Weight variations (addVariation) are additional histograms filled with the same expression
+ * value and cut decision as the main histogram, with the weight multiplied by their own reweight.
  */
 class Plot : public ExprFiller {
 public:
@@ -104,16 +171,25 @@ public:
   Plot() {}
   Plot(TH1& hist, TTreeFormula& expr, TTreeFormula* cuts = nullptr, TTreeFormula* reweight = nullptr, OverflowMode mode = kNoOverflowBin);
   Plot(Plot const&);
-  ~Plot() {}
+  ~Plot();
 
   TObject const* getObj() const override { return hist_; }
   TH1 const* getHist() const { return hist_; }
+  TH1* getHist() { return hist_; }
+  OverflowMode getOverflowMode() const { return overflowMode_; }
+
+  void addVariation(TH1& hist, TTreeFormula* reweight = nullptr) { variations_.emplace_back(&hist, reweight); }
+  unsigned getNVariations() const { return variations_.size(); }
+  TH1* getVariationHist(unsigned iV) { return variations_.at(iV).first; }
+  TTreeFormula const* getVariationReweight(unsigned iV) const { return variations_.at(iV).second; }
 
 private:
   void doFill_(unsigned) override;
+  void loadFormulas_(unsigned) override;
 
   TH1* hist_{nullptr};
   OverflowMode overflowMode_{kNoOverflowBin};
+  std::vector<std::pair<TH1*, TTreeFormula*>> variations_{};
 };
 
 class Tree : public ExprFiller {
@@ -127,6 +203,7 @@ public:
 
   TObject const* getObj() const override { return tree_; }
   TTree const* getTree() const { return tree_; }
+  TTree* getTree() { return tree_; }
 
   static unsigned const NBRANCHMAX = 128;
 
@@ -154,6 +231,15 @@ private:
  * h2 with the subset of such electrons that also pass the tight selection.
  * It is also possible to set cuts and reweights for individual plots. Event-wide weights can
  * be set by three methods setWeightBranch, setConstantWeight, and setGlobalReweight.
+ *
+ * With setNumThreads(n) (n > 1), fillPlots splits the input into n entry ranges (aligned to
+ * file boundaries when there are enough files) and processes them in parallel. Each thread
+ * runs its own MultiDraw with an independent TChain, formula library, and histogram / tree
+ * clones, which are added back to the user objects at the end.
+ *
+ * With setCompileFormulas(true), expressions, cuts, and reweights are created as CompiledFormula,
+ * which evaluates them through JIT-compiled functions reading leaf values from a common set of
+ * columns. Expressions that cannot be compiled are transparently evaluated by TTreeFormula.
  */
 class MultiDraw {
 public:
@@ -179,6 +265,10 @@ public:
    * When prescale_ > 1, only events that satisfy eventNumber % prescale_ == 0 are read.
    */
   void setPrescale(unsigned p) { prescale_ = p; }
+  //! Set the number of threads to use in fillPlots.
+  void setNumThreads(unsigned n) { nThreads_ = n; }
+  //! Compile the formulas added after this call into C++ functions where possible.
+  void setCompileFormulas(bool b) { compileFormulas_ = b; }
   //! Set a global reweight
   /*!
    * Reweight factor can be set in two ways. If the second argument is nullptr,
@@ -192,6 +282,13 @@ public:
    * Currently only 1D histograms can be used.
    */
   void addPlot(TH1* hist, char const* expr, char const* cuts = "", bool applyBaseline = true, bool applyFullSelection = false, char const* reweight = "", Plot::OverflowMode mode = Plot::kNoOverflowBin);
+  //! Add a weight variation to a plot already added to the MultiDraw object.
+  /*!
+   * hist is filled in the same pass as the plot of nominal, with the same expression and cuts
+   * (evaluated once per event), and with the plot weight multiplied by reweight (e.g. a
+   * reweight_<name>Up branch or a constant).
+   */
+  void addWeightVariation(TH1* nominal, TH1* hist, char const* reweight = "");
   //! Add a tree to fill.
   /*!
    * Use addTreeBranch to add branches.
@@ -216,6 +313,9 @@ private:
   TTreeFormulaCached* getFormula_(char const*);
   void deleteFormula_(TTreeFormulaCached*);
 
+  //! Multi-threaded version of fillPlots
+  void fillPlotsParallel_(long nEntries, long firstEntry);
+
   TChain tree_;
   TString weightBranchName_{"weight"};
   TTreeFormulaCached* baseSelection_{nullptr};
@@ -223,12 +323,17 @@ private:
   double constWeight_{1.};
   unsigned prescale_{1};
   TTreeFormulaCached* reweightExpr_{nullptr};
+  TObject const* reweightSource_{nullptr};
   std::function<void(std::vector<double>&)> reweight_;
   std::vector<ExprFiller*> unconditional_{};
   std::vector<ExprFiller*> postBase_{};
   std::vector<ExprFiller*> postFull_{};
 
   std::map<TString, TTreeFormulaCached*> library_;
+  FormulaColumns columns_{};
+
+  unsigned nThreads_{1};
+  bool compileFormulas_{false};
 
   int printLevel_{0};
   long totalEvents_{0};
@@ -1,5 +1,4 @@
 import os
-import json
 import ROOT
 
 thisdir = os.path.dirname(os.path.realpath(__file__))
@@ -8,14 +7,6 @@ ROOT.gROOT.LoadMacro(thisdir + '/GoodLumiFilter.cc+')
 
 def makeGoodLumiFilter(jsonPath):
     goodLumi = ROOT.GoodLumiFilter()
-
-    with open(jsonPath) as source:
-        lumiList = json.loads(source.read())
-
-        for run, lumiranges in lumiList.items():
-            for lumirange in lumiranges:
-                lumirange[1] += 1
-                for lumi in range(*tuple(lumirange)):
-                    goodLumi.addLumi(int(run), lumi)
+    goodLumi.readJSON(jsonPath)
 
     return goodLumi
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+#-------------------------------------------------------------------------------
+# lumilist.py
+#
+# Make a lumi list JSON file out of ntuples, processing the input files in
+# parallel. Lumi lists are handled as sorted interval lists throughout.
+# Usage: lumilist.py <ROOT file> [<ROOT file2> ...] -o lumis.txt -j 8
+# With --incremental, files already recorded in <output>.files are skipped and
+# the lumis of the new files are merged into the existing output.
+#
+#-------------------------------------------------------------------------------
+
+import sys
+import os
+import json
+import glob
+import multiprocessing
+
+thisdir = os.path.dirname(os.path.realpath(__file__))
+
+def mergeIntervals(intervals):
+    """
+    Merge a list of (first, last) lumi intervals into a sorted list of disjoint intervals.
+    Adjacent intervals are joined.
+    """
+
+    merged = []
+    for first, last in sorted(intervals):
+        if len(merged) != 0 and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+
+    return merged
+
+def mergeLumis(target, source):
+    """
+    Merge lumi list source ({run: [(first, last)]}) into target.
+    """
+
+    for run, intervals in source.iteritems():
+        if run in target:
+            target[run] = mergeIntervals(target[run] + intervals)
+        else:
+            target[run] = mergeIntervals(intervals)
+
+def readLumiJSON(path):
+    with open(path) as source:
+        content = json.loads(source.read())
+
+    return dict((int(run), mergeIntervals([tuple(interval) for interval in intervals])) for run, intervals in content.iteritems())
+
+def writeLumiJSON(lumis, path):
+    runBlocks = []
+    for run in sorted(lumis.keys()):
+        runBlock = '  "%d": [\n' % run
+        runBlock += ',\n'.join(['    [%d, %d]' % interval for interval in lumis[run]])
+        runBlock += '\n  ]'
+
+        runBlocks.append(runBlock)
+
+    tmpPath = path + '.tmp'
+    with open(tmpPath, 'w') as output:
+        output.write('{\n')
+        output.write(',\n'.join(runBlocks))
+        output.write('\n}\n')
+
+    os.rename(tmpPath, path)
+
+_config = {}
+
+def _processFile(path):
+    """
+    Worker function: read the run and lumi branches of one file and return its lumi intervals.
+    """
+
+    import ROOT
+
+    source = ROOT.TFile.Open(path)
+    if not source or source.IsZombie():
+        return path, None
+
+    tree = source.Get(_config['treeName'])
+    if not tree:
+        source.Close()
+        return path, None
+
+    flat = ROOT.readLumis(tree, _config['mask'], _config['runBranchName'], _config['lumiBranchName'])
+
+    lumis = {}
+    for i in xrange(0, flat.size(), 3):
+        lumis.setdefault(int(flat[i]), []).append((int(flat[i + 1]), int(flat[i + 2])))
+
+    source.Close()
+
+    return path, lumis
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    argParser = ArgumentParser(description = 'Make JSON lumi list in parallel')
+    argParser.add_argument('paths', metavar = 'PATH', nargs = '*', help = 'Paths to ROOT files (wildcard allowed) containing lumi list trees.')
+    argParser.add_argument('--mask', '-m', metavar = 'FILE', dest = 'mask', default = '', help = 'Lumi mask (e.g. Golden JSON) to apply.')
+    argParser.add_argument('--out', '-o', metavar = 'FILE', dest = 'outputFile', default = 'lumis.txt', help = 'Output file name.')
+    argParser.add_argument('--list', '-i', metavar = 'FILE', dest = 'listFile', default = '', help = 'File that contains the list of input files.')
+    argParser.add_argument('--tree', '-t', metavar = 'NAME', dest = 'treeName', default = 'nero/all', help = 'Name of the input tree.')
+    argParser.add_argument('--run-branch', '-r', metavar = 'NAME', dest = 'runBranchName', default = 'runNum', help = 'Name of the run branch.')
+    argParser.add_argument('--lumi-branch', '-l', metavar = 'NAME', dest = 'lumiBranchName', default = 'lumiNum', help = 'Name of the lumi branch.')
+    argParser.add_argument('--jobs', '-j', metavar = 'N', dest = 'numJobs', type = int, default = multiprocessing.cpu_count(), help = 'Number of worker processes.')
+    argParser.add_argument('--incremental', '-I', action = 'store_true', dest = 'incremental', help = 'Only process files not recorded in <output>.files and merge into the existing output.')
+    argParser.add_argument('--merge', '-M', metavar = 'JSON', dest = 'mergeInputs', nargs = '+', default = [], help = 'Additional lumi JSON files to merge into the output.')
+
+    args = argParser.parse_args()
+    sys.argv = []
+
+    paths = []
+    if args.listFile:
+        with open(args.listFile) as listFile:
+            for line in listFile:
+                if line.strip() == '' or line.strip().startswith('#'):
+                    continue
+
+                paths.append(line.strip())
+    else:
+        for path in args.paths:
+            if '*' in path:
+                paths.extend(sorted(glob.glob(path)))
+            else:
+                paths.append(path)
+
+    lumis = {}
+    processed = []
+    recordPath = args.outputFile + '.files'
+
+    if args.incremental and os.path.exists(args.outputFile):
+        lumis = readLumiJSON(args.outputFile)
+        if os.path.exists(recordPath):
+            with open(recordPath) as record:
+                processed = json.loads(record.read())
+
+        done = set(processed)
+        paths = [path for path in paths if path not in done]
+        print len(paths), 'new files'
+
+    for path in args.mergeInputs:
+        mergeLumis(lumis, readLumiJSON(path))
+
+    if len(paths) != 0:
+        import ROOT
+        ROOT.gROOT.SetBatch(True)
+
+        ROOT.gROOT.LoadMacro(thisdir + '/GoodLumiFilter.cc+')
+        ROOT.gROOT.LoadMacro(thisdir + '/MakeLumiList.cc+')
+
+        if args.mask:
+            mask = ROOT.GoodLumiFilter()
+            mask.readJSON(args.mask)
+        else:
+            mask = None
+
+        # inherited by the forked workers
+        _config.update(mask = mask, treeName = args.treeName, runBranchName = args.runBranchName, lumiBranchName = args.lumiBranchName)
+
+        if args.numJobs > 1 and len(paths) > 1:
+            pool = multiprocessing.Pool(min(args.numJobs, len(paths)))
+            results = pool.imap_unordered(_processFile, paths)
+        else:
+            pool = None
+            results = (_processFile(path) for path in paths)
+
+        failed = []
+        for ifile, (path, fileLumis) in enumerate(results):
+            if fileLumis is None:
+                print 'Could not read', path
+                failed.append(path)
+                continue
+
+            mergeLumis(lumis, fileLumis)
+            processed.append(path)
+
+            if ifile % 100 == 0:
+                print ifile, '/', len(paths)
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        if len(failed) != 0:
+            print len(failed), 'files could not be read and are not recorded as processed.'
+
+    writeLumiJSON(lumis, args.outputFile)
+
+    with open(recordPath, 'w') as record:
+        record.write(json.dumps(processed, indent = 0))
@@ -45,8 +45,7 @@ if args.mask:
         for runStr, lumiRanges in maskJSON.items():
             run = int(runStr)
             for begin, end in lumiRanges:
-                for lumi in range(begin, end + 1):
-                    mask.addLumi(run, lumi)
+                mask.addLumiRange(run, begin, end)
 
     except:
         print 'Could not parse mask JSON', args.mask
@@ -4,10 +4,17 @@ import re
 import os
 import math
 import fnmatch
+import bisect
 import subprocess
+import json
+import sqlite3
+import cPickle as pickle
 
 defaultList = os.path.dirname(os.path.realpath(__file__)) + '/data/datasets.csv'
 catalogDir = '/home/cmsprod/catalog/t2mit'
+sumwCachePath = os.path.expanduser('~/.cache/monophoton/sumw.json')
+sumwCacheThreads = 16
+catalogIndexPath = os.path.expanduser('~/.cache/monophoton/catalog.db')
 
 def expandBrace(pattern):
     """Expand a string with a brace-enclosed substitution pattern."""
@@ -87,6 +94,300 @@ def braceContract(strings):
     return base[:start] + '{' + ','.join(diffs) + '}' + base[end:]
 
 
+class SumwCache(object):
+    """
+    On-disk cache of per-file event counts, stored as JSON {path: [mtime, size, nevents, sumw, sumw2]}.
+    An entry is valid as long as the mtime and size of the file are unchanged. Missing entries are filled
+    by reading the eventcounter and hSumW histograms from the files in a thread pool.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = None
+
+    def _load(self):
+        try:
+            with open(self.path) as source:
+                return json.load(source)
+        except (IOError, ValueError):
+            return {}
+
+    def _save(self, updates):
+        # merge with the content on disk in case another process updated the cache in the meantime
+        entries = self._load()
+        entries.update(updates)
+
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+
+        tmpPath = '%s.%d' % (self.path, os.getpid())
+        with open(tmpPath, 'w') as out:
+            json.dump(entries, out)
+
+        os.rename(tmpPath, self.path)
+
+        self._entries = entries
+
+    @staticmethod
+    def _read(path):
+        """
+        Read (nevents, sumw, sumw2) from a file. sumw and sumw2 are None if hSumW does not exist.
+        Returns None if the file cannot be read.
+        """
+
+        import ROOT
+
+        source = ROOT.TFile.Open(path)
+        if not source:
+            return None
+
+        try:
+            counter = source.Get('eventcounter')
+            nevents = counter.GetBinContent(1)
+            hsumw = source.Get('hSumW')
+            if hsumw:
+                sumw = hsumw.GetBinContent(1)
+                sumw2 = math.pow(hsumw.GetBinError(1), 2.)
+            else:
+                sumw = None
+                sumw2 = None
+
+        except:
+            print path, 'corrupt'
+            return None
+
+        finally:
+            source.Close()
+
+        return (nevents, sumw, sumw2)
+
+    def get(self, paths):
+        """
+        Return {path: (nevents, sumw, sumw2) or None}.
+        """
+
+        if self._entries is None:
+            self._entries = self._load()
+
+        counts = {}
+        misses = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                key = [int(stat.st_mtime), stat.st_size]
+            except OSError:
+                # not visible on the local file system; cannot validate -> always read
+                key = None
+
+            entry = self._entries.get(path)
+            if key is not None and entry is not None and entry[:2] == key:
+                counts[path] = tuple(entry[2:])
+            else:
+                misses.append((path, key))
+
+        if len(misses) == 0:
+            return counts
+
+        if len(misses) == 1 or sumwCacheThreads <= 1:
+            results = [SumwCache._read(path) for path, _ in misses]
+        else:
+            import ROOT
+            from multiprocessing.pool import ThreadPool
+
+            ROOT.ROOT.EnableThreadSafety()
+            # release the GIL while opening the files
+            ROOT.TFile.Open._threaded = True
+
+            pool = ThreadPool(min(sumwCacheThreads, len(misses)))
+            try:
+                results = pool.map(SumwCache._read, [path for path, _ in misses])
+            finally:
+                pool.close()
+                pool.join()
+
+        updates = {}
+        for (path, key), result in zip(misses, results):
+            counts[path] = result
+            if result is not None and key is not None:
+                updates[path] = key + list(result)
+
+        if len(updates) != 0:
+            try:
+                self._save(updates)
+            except (IOError, OSError):
+                print 'Failed to update sumw cache', self.path
+
+        return counts
+
+
+class CatalogIndex(object):
+    """
+    sqlite index of the text file catalogs (<catalogDir>/<book>/<dataset>/Filesets and Files) and of the
+    parsed sample lists. Entries are validated against the modification times of the source text files
+    and are refreshed transparently when stale. The index is only an accelerator; any database error
+    results in a fallback to parsing the text files.
+    """
+
+    # Bump when the pickled sample list layout changes. Sample list entries are additionally validated
+    # against the modification time of this module.
+    listSchemaVersion = 2
+    moduleSource = os.path.splitext(os.path.realpath(__file__))[0] + '.py'
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        # sqlite connections cannot be shared with forked processes
+        if self._conn is not None and self._pid == os.getpid():
+            return self._conn
+
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise sqlite3.OperationalError('Cannot create ' + directory)
+
+        conn = sqlite3.connect(self.path, timeout = 30.)
+        conn.text_factory = str
+        conn.executescript("""
+CREATE TABLE IF NOT EXISTS datasets (id INTEGER PRIMARY KEY, path TEXT UNIQUE, directory TEXT, mtime REAL);
+CREATE TABLE IF NOT EXISTS filesets (dataset_id INTEGER, name TEXT);
+CREATE TABLE IF NOT EXISTS files (dataset_id INTEGER, fileset TEXT, basename TEXT);
+CREATE INDEX IF NOT EXISTS filesets_dataset ON filesets (dataset_id);
+CREATE INDEX IF NOT EXISTS files_dataset ON files (dataset_id);
+CREATE TABLE IF NOT EXISTS samplelists (path TEXT PRIMARY KEY, sources TEXT, content BLOB);
+""")
+
+        self._conn = conn
+        self._pid = os.getpid()
+
+        return conn
+
+    @staticmethod
+    def _parseDataset(dsdir):
+        """
+        Read the text catalog in dsdir. Returns (xrootd directory, [fileset], [(fileset, basename)]).
+        """
+
+        directory = ''
+        filesets = []
+        with open(dsdir + '/Filesets') as filesetList:
+            for line in filesetList:
+                fileset, xrdpath = line.split()[:2]
+                filesets.append(fileset)
+                if not directory:
+                    directory = xrdpath
+
+        files = []
+        with open(dsdir + '/Files') as fileList:
+            for line in fileList:
+                files.append(tuple(line.split()[:2]))
+
+        return directory, filesets, files
+
+    def readDataset(self, dsdir):
+        """
+        Return (xrootd directory, [fileset], [(fileset, basename)]) of the dataset catalog in dsdir.
+        """
+
+        mtime = max(os.stat(dsdir + '/Filesets').st_mtime, os.stat(dsdir + '/Files').st_mtime)
+
+        try:
+            conn = self._connection()
+            row = conn.execute('SELECT id, directory, mtime FROM datasets WHERE path = ?', (dsdir,)).fetchone()
+            if row is not None and row[2] == mtime:
+                dsid, directory, _ = row
+                filesets = [r[0] for r in conn.execute('SELECT name FROM filesets WHERE dataset_id = ? ORDER BY rowid', (dsid,))]
+                files = conn.execute('SELECT fileset, basename FROM files WHERE dataset_id = ? ORDER BY rowid', (dsid,)).fetchall()
+                return directory, filesets, files
+
+        except sqlite3.Error:
+            conn = None
+
+        directory, filesets, files = CatalogIndex._parseDataset(dsdir)
+
+        if conn is not None:
+            try:
+                with conn:
+                    if row is not None:
+                        dsid = row[0]
+                        conn.execute('DELETE FROM filesets WHERE dataset_id = ?', (dsid,))
+                        conn.execute('DELETE FROM files WHERE dataset_id = ?', (dsid,))
+                        conn.execute('UPDATE datasets SET directory = ?, mtime = ? WHERE id = ?', (directory, mtime, dsid))
+                    else:
+                        dsid = conn.execute('INSERT INTO datasets (path, directory, mtime) VALUES (?, ?, ?)', (dsdir, directory, mtime)).lastrowid
+
+                    conn.executemany('INSERT INTO filesets VALUES (?, ?)', ((dsid, f) for f in filesets))
+                    conn.executemany('INSERT INTO files VALUES (?, ?, ?)', ((dsid, f, b) for f, b in files))
+
+            except sqlite3.Error:
+                pass
+
+        return directory, filesets, files
+
+    def loadList(self, listpath):
+        """
+        Return the pickled content of the sample list at listpath, or None if it is not indexed or stale.
+        """
+
+        try:
+            row = self._connection().execute('SELECT sources, content FROM samplelists WHERE path = ?', (listpath,)).fetchone()
+        except sqlite3.Error:
+            return None
+
+        if row is None:
+            return None
+
+        sources, content = row
+        try:
+            sources = json.loads(sources)
+        except ValueError:
+            return None
+
+        if type(sources) is not dict or sources.get('version') != CatalogIndex.listSchemaVersion:
+            return None
+
+        for path, mtime in sources['files']:
+            try:
+                if os.stat(path).st_mtime != mtime:
+                    return None
+            except OSError:
+                return None
+
+        try:
+            return pickle.loads(str(content))
+        except:
+            return None
+
+    def saveList(self, listpath, sources, content):
+        """
+        Store the content of the sample list at listpath. sources is the list of all files the list was read from.
+        The module source is added to the sources so that code changes invalidate the stored content.
+        """
+
+        try:
+            paths = list(sources) + [CatalogIndex.moduleSource]
+            sources = json.dumps({'version': CatalogIndex.listSchemaVersion, 'files': [(path, os.stat(path).st_mtime) for path in paths]})
+            conn = self._connection()
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO samplelists VALUES (?, ?, ?)', (listpath, sources, sqlite3.Binary(pickle.dumps(content, 2))))
+
+        except (sqlite3.Error, OSError):
+            pass
+
+
+catalogIndex = CatalogIndex(catalogIndexPath)
+
+
 class SampleDef(object):
     def __init__(self, name, title = '', book = '', fullname = '', additionalDatasets = [], crosssection = 0., nevents = 0, sumw = 0., lumi = 0., data = False, comments = '', custom = {}):
         self.name = name
@@ -188,36 +489,35 @@ class SampleDef(object):
         if self._sumw2 > 0.:
             return
 
-        import ROOT
-
         self.download()
 
         self.nevents = 0
         self.sumw = 0.
 
-        error = False
+        paths = []
         for dataset in self.datasetNames:
             for fileset, basenames in self._basenames[dataset].items():
                 for basename in basenames:
-                    path = self._directories[dataset] + '/' + basename
-                    source = ROOT.TFile.Open(path)
-                    if not source:
-                        error = True
-                        continue
+                    paths.append(self._directories[dataset] + '/' + basename)
 
-                    try:
-                        counter = source.Get('eventcounter')
-                        self.nevents += counter.GetBinContent(1)
-                        if not self.data:
-                            sumw = source.Get('hSumW')
-                            self.sumw += sumw.GetBinContent(1)
-                            self._sumw2 += math.pow(sumw.GetBinError(1), 2.)
+        counts = SumwCache(sumwCachePath).get(paths)
 
-                    except:
-                        print path, 'corrupt'
-                        error = True
+        error = False
+        for path in paths:
+            if counts[path] is None:
+                error = True
+                continue
+
+            nevents, sumw, sumw2 = counts[path]
+            self.nevents += nevents
+            if not self.data:
+                if sumw is None:
+                    print path, 'corrupt'
+                    error = True
+                    continue
 
-                    source.Close()
+                self.sumw += sumw
+                self._sumw2 += sumw2
 
         if error:
             raise RuntimeError('Corrupt input')
@@ -228,25 +528,16 @@ class SampleDef(object):
             if dataset in self._basenames:
                 continue
 
-            self._basenames[dataset] = {}
+            xrdpath, filesets, files = catalogIndex.readDataset(catalogDir + '/' + self.book + '/' + dataset)
 
-            with open(catalogDir + '/' + self.book + '/' + dataset + '/Filesets') as filesetList:
-                for line in filesetList:
-                    fileset, xrdpath = line.split()[:2]
-                    fileset += dsuffix
+            self._basenames[dataset] = dict((fileset + dsuffix, []) for fileset in filesets)
 
-                    self._basenames[dataset][fileset] = []
+            if len(filesets) != 0:
+                self._directories[dataset] = xrdpath.replace('root://xrootd.cmsaf.mit.edu/', '/mnt/hadoop/cms').replace('root://t3serv006.mit.edu/', '/mnt/hadoop')
+                self._downloadable[dataset] = self._directories[dataset].startswith('/mnt/hadoop/cms/store/user/paus')
 
-                    if dataset not in self._directories:
-                        self._directories[dataset] = xrdpath.replace('root://xrootd.cmsaf.mit.edu/', '/mnt/hadoop/cms').replace('root://t3serv006.mit.edu/', '/mnt/hadoop')
-                        self._downloadable[dataset] = self._directories[dataset].startswith('/mnt/hadoop/cms/store/user/paus')
-    
-            with open(catalogDir + '/' + self.book + '/' + dataset + '/Files') as fileList:
-                for line in fileList:
-                    fileset, fname = line.split()[:2]
-                    fileset += dsuffix
-    
-                    self._basenames[dataset][fileset].append(fname)
+            for fileset, fname in files:
+                self._basenames[dataset][fileset + dsuffix].append(fname)
     
     def recomputeWeight(self):
         self._sumw2 = 0.
@@ -309,9 +600,21 @@ class SampleDefList(object):
         self.samples = list(samples)
         self._commentLines = {} # {path: [(dataset before, comment)]} to reproduce comment lines from the source
         self._sample_source = {} # {path: set(sample name)}
+        self._names = None # sorted [sample name], built on demand
+        self._byname = {} # {sample name: [sample]}, built on demand
 
         if listpath:
-            self._load(listpath)
+            # Only builtin types are stored in the index; pickled SampleDef instances would be bound to the
+            # module name (datasets or __main__) of the process that wrote them.
+            content = catalogIndex.loadList(listpath)
+            if content is None:
+                rows = []
+                self._load(listpath, rows)
+                catalogIndex.saveList(listpath, self._sample_source.keys(), (rows, self._commentLines, self._sample_source))
+            else:
+                rows, self._commentLines, self._sample_source = content
+
+            self.samples.extend(SampleDef(name, **kwd) for name, kwd in rows)
 
     def __iter__(self):
         return iter(self.samples)
@@ -325,7 +628,8 @@ class SampleDefList(object):
         except RuntimeError:
             raise KeyError(key + ' not defined')
 
-    def _load(self, listpath):
+    def _load(self, listpath, rows):
+        # append (name, SampleDef keyword arguments) of each line to rows
         self._commentLines[listpath] = []
         self._sample_source[listpath] = set()
 
@@ -348,7 +652,7 @@ class SampleDefList(object):
                     if path[0] != '/':
                         path = os.path.dirname(os.path.realpath(listpath)) + '/' + path
                     
-                    self._load(path)
+                    self._load(path, rows)
                     continue
         
                 matches = re.match('([^\s]+)\s+"(.*)"\s+([0-9e.+-]+)\s+([0-9]+)\s+([0-9e.+-]+)\s+([^\s]+)\s+((?:[^\s#]+\s*)+)(#.*|)$', line)
@@ -374,7 +678,7 @@ class SampleDefList(object):
                 else:
                     kwd.update({'crosssection': float(crosssection), 'sumw': float(sumw)})
 
-                self.samples.append(SampleDef(name, **kwd))
+                rows.append((name, kwd))
 
     def save(self, listpath):
         commentLines = self._commentLines[listpath]
@@ -408,10 +712,44 @@ class SampleDefList(object):
     def names(self):
         return [s.name for s in self.samples]
 
+    def _buildIndex(self):
+        # rebuild when samples were added since the last call
+        if self._names is not None and sum(len(v) for v in self._byname.itervalues()) == len(self.samples):
+            return
+
+        self._byname = {}
+        for sample in self.samples:
+            self._byname.setdefault(sample.name, []).append(sample)
+
+        self._names = sorted(self._byname.iterkeys())
+
+    def _glob(self, pattern):
+        """
+        Return the samples with names matching the pattern. Only the names sharing the literal prefix
+        of the pattern are tested.
+        """
+
+        self._buildIndex()
+
+        prefix = re.match('[^*?[]*', pattern).group(0)
+
+        matching = []
+        for iname in xrange(bisect.bisect_left(self._names, prefix), len(self._names)):
+            name = self._names[iname]
+            if not name.startswith(prefix):
+                break
+
+            if fnmatch.fnmatch(name, pattern):
+                matching.extend(self._byname[name])
+
+        return matching
+
     def get(self, name):
+        self._buildIndex()
+
         try:
-            return next(s for s in self.samples if s.name == name)
-        except StopIteration:
+            return self._byname[name][0]
+        except KeyError:
             raise RuntimeError('Sample ' + name + ' not found')
 
     def getmany(self, names):
@@ -437,7 +775,7 @@ class SampleDefList(object):
                 names.extend(expanded[1:]) # add to the end of list
             
             if '*' in name:
-                matching = [s for s in self.samples if fnmatch.fnmatch(s.name, name)]
+                matching = self._glob(name)
             else:
                 matching = [self.get(name)]
 
@@ -462,16 +800,21 @@ if __name__ == '__main__':
 print DATASET: Print information of DATASET.
 dump DATASETS: Dump information of DATASETS in CSV form.
 recalculate DATASETS: Recalculate nentries and sumw for DATASETS.
+index [DATASETS]: Update the catalog index for DATASETS (no argument: all datasets).
 add INFO: Add a new dataset.'''
     argParser.add_argument('command', nargs = '+', help = commandHelp)
     argParser.add_argument('--catalog', '-c', metavar = 'PATH', dest = 'catalog', default = catalogDir, help = 'Source file catalog.')
     argParser.add_argument('--list-path', '-s', metavar = 'PATH', dest = 'listPath', default = defaultList, help = 'CSV file to load data from.')
+    argParser.add_argument('--sumw-cache', '-w', metavar = 'PATH', dest = 'sumwCache', default = sumwCachePath, help = 'Per-file nevents and sumw cache used by recalculate.')
+    argParser.add_argument('--catalog-index', '-x', metavar = 'PATH', dest = 'catalogIndex', default = catalogIndexPath, help = 'sqlite index of the catalog and the sample lists.')
     argParser.add_argument('--save', '-o', metavar = 'PATH', dest = 'outPath', nargs = '?', const = '', help = 'Save updated content to CSV file (no argument: save to original CSV).')
 
     args = argParser.parse_args()
     sys.argv = []
 
     catalogDir = args.catalog
+    sumwCachePath = args.sumwCache
+    catalogIndex = CatalogIndex(args.catalogIndex)
 
     import ROOT
 
@@ -528,6 +871,16 @@ add INFO: Add a new dataset.'''
             sample.recomputeWeight()
             print sample.linedump()
 
+    elif command == 'index':
+        if len(arguments) == 0:
+            arguments = ['*']
+
+        for sample in samples.getmany(arguments):
+            try:
+                sample._readCatalogs()
+            except (IOError, OSError):
+                print sample.name, 'catalog not found'
+
     elif command == 'add':
         name, title, crosssection, nevents, sumw, book, fullname = arguments[:7]
         additionalDatasets = []
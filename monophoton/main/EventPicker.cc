@@ -1,17 +1,28 @@
 #include "PandaTree/Objects/interface/Event.h"
 
-#include "TChain.h"
 #include "TString.h"
 #include "TFile.h"
 #include "TTree.h"
 #include "TKey.h"
+#include "TBranch.h"
+
+#include <vector>
+#include <map>
+#include <unordered_set>
+#include <utility>
+#include <memory>
+#include <functional>
+#include <cstring>
+#include <iostream>
 
 class EventPicker {
 public:
   EventPicker() {}
   ~EventPicker() {}
-  void addPath(char const* _path) { paths_.emplace_back(_path); }
-  void addEvent(unsigned r, unsigned l, unsigned e) { eventIds_.emplace_back(r, l, e); }
+  void addPath(char const* _path);
+  // Restrict the search in path to entries [first, last] (from the event index). Can be called multiple times.
+  void addEntryRange(char const* _path, long first, long last);
+  void addEvent(unsigned r, unsigned l, unsigned e) { eventIds_.emplace(r, l, e); }
   void setPrintEvery(unsigned i) { printEvery_ = i; }
   void setPrintLevel(unsigned l) { printLevel_ = l; }
 
@@ -20,91 +31,185 @@ public:
   struct EventId {
     EventId() {}
     EventId(unsigned r, unsigned l, unsigned e) : runNumber(r), lumiNumber(l), eventNumber(e) {}
+    bool operator==(EventId const& rhs) const { return runNumber == rhs.runNumber && lumiNumber == rhs.lumiNumber && eventNumber == rhs.eventNumber; }
 
     unsigned runNumber{0};
     unsigned lumiNumber{0};
     unsigned eventNumber{0};
   };
 
+  struct EventIdHash {
+    size_t operator()(EventId const& id) const { return std::hash<unsigned long long>()((static_cast<unsigned long long>(id.runNumber) << 32) ^ (static_cast<unsigned long long>(id.lumiNumber) << 20) ^ id.eventNumber); }
+  };
+
 private:
+  void pick_(panda::Event&, TFile&, char const* outputDir);
+
   std::vector<TString> paths_{};
-  std::vector<EventId> eventIds_{};
+  std::map<TString, std::vector<std::pair<long, long>>> entryRanges_{};
+  std::unordered_set<EventId, EventIdHash> eventIds_{};
   unsigned printEvery_{10000};
   unsigned printLevel_{0};
 };
 
+void
+EventPicker::addPath(char const* _path)
+{
+  for (auto& path : paths_) {
+    if (path == _path)
+      return;
+  }
+
+  paths_.emplace_back(_path);
+}
+
+void
+EventPicker::addEntryRange(char const* _path, long _first, long _last)
+{
+  addPath(_path);
+  entryRanges_[_path].emplace_back(_first, _last);
+}
+
 void
 EventPicker::run(char const* _outputDir, long _nEntries/* = -1*/)
 {
   panda::Event event;
-  panda::Run run;
+  panda::utils::BranchList idBranches{{"!*", "runNumber", "lumiNumber", "eventNumber"}};
 
-  TChain idInput("events");
-  TChain fullInput("events");
+  long iEntry(0);
 
   for (auto& path : paths_) {
-    idInput.Add(path);
-    fullInput.Add(path);
-  }
+    if (eventIds_.empty() || iEntry == _nEntries)
+      break;
 
-  event.setStatus(idInput, {"!*"});
-  event.setAddress(idInput, {"runNumber", "lumiNumber", "eventNumber"});
-  event.setAddress(fullInput);
+    std::unique_ptr<TFile> source(TFile::Open(path));
+    if (!source || source->IsZombie()) {
+      std::cerr << "Cannot open file " << path << std::endl;
+      continue;
+    }
 
-  int treeNumber(-1);
-  TTree* runTree(0);
+    auto* input(static_cast<TTree*>(source->Get("events")));
+    if (!input) {
+      std::cerr << "Events tree missing from " << path << std::endl;
+      continue;
+    }
 
-  long iEntry(0);
-  while (iEntry != _nEntries && event.getEntry(idInput, iEntry++) > 0) {
-    if (iEntry % printEvery_ == 1 && printLevel_ > 0)
-      std::cout << " " << iEntry << std::endl;
-
-    // not the most efficient implementation, but we don't need ultimate speed here.
-    for (auto idItr(eventIds_.begin()); idItr != eventIds_.end(); ++idItr) {
-      auto& id(*idItr);
-      if (id.runNumber == event.runNumber && id.lumiNumber == event.lumiNumber && id.eventNumber == event.eventNumber) {
-        if (printLevel_ > 0)
-          std::cout << "Found event " << id.runNumber << ":" << id.lumiNumber << ":" << id.eventNumber << std::endl;
+    // only the ID branches are read until an event matches
+    event.setStatus(*input, idBranches);
+    event.setAddress(*input, {"*"}, false);
 
-        event.getEntry(fullInput, iEntry - 1);
+    std::vector<std::pair<long, long>> ranges;
+    auto rItr(entryRanges_.find(path));
+    if (rItr != entryRanges_.end())
+      ranges = rItr->second;
+    else
+      ranges.emplace_back(0, input->GetEntries() - 1);
 
-        if (treeNumber != fullInput.GetTreeNumber()) {
-          treeNumber = fullInput.GetTreeNumber();
-          run.runNumber = 0;
+    for (auto& range : ranges) {
+      if (eventIds_.empty())
+        break;
 
-          runTree = static_cast<TTree*>(fullInput.GetCurrentFile()->Get("runs"));
-          run.setAddress(*runTree);
-        }
+      for (long iLocalEntry(range.first); iLocalEntry <= range.second && iEntry != _nEntries; ++iLocalEntry) {
+        if (iEntry++ % printEvery_ == 0 && printLevel_ > 0)
+          std::cout << " " << iEntry << std::endl;
 
-        run.findEntry(*runTree, id.runNumber);
+        if (event.getEntry(*input, iLocalEntry) <= 0)
+          break;
 
-        auto* outputFile(TFile::Open(TString::Format("%s/%d_%d_%d.root", _outputDir, id.runNumber, id.lumiNumber, id.eventNumber), "recreate"));
-        auto* outputEvents(new TTree("events", "events"));
-        auto* outputRuns(new TTree("runs", "runs"));
+        auto idItr(eventIds_.find(EventId(event.runNumber, event.lumiNumber, event.eventNumber)));
+        if (idItr == eventIds_.end())
+          continue;
 
-        event.book(*outputEvents);
-        event.run.book(*outputRuns);
-        event.fill(*outputEvents);
-        event.run.fill(*outputRuns);
+        if (printLevel_ > 0)
+          std::cout << "Found event " << idItr->runNumber << ":" << idItr->lumiNumber << ":" << idItr->eventNumber << std::endl;
 
-        outputFile->cd();
-        outputEvents->Write();
-        outputRuns->Write();
+        event.setStatus(*input, {"*"});
+        event.getEntry(*input, iLocalEntry);
+        event.setStatus(*input, idBranches);
 
-        for (auto* key : *fullInput.GetCurrentFile()->GetListOfKeys()) {
-          if (std::strcmp(key->GetName(), "events") == 0 || std::strcmp(key->GetName(), "runs") == 0)
-            continue;
+        pick_(event, *source, _outputDir);
 
-          outputFile->cd();
-          auto* obj(static_cast<TKey*>(key)->ReadObj());
-          obj->Write();
-        }
-        
-        delete outputFile;
-        
         eventIds_.erase(idItr);
-        break;
+        if (eventIds_.empty())
+          break;
       }
     }
   }
 }
+
+void
+EventPicker::pick_(panda::Event& _event, TFile& _source, char const* _outputDir)
+{
+  auto* runTree(static_cast<TTree*>(_source.Get("runs")));
+  _event.run.runNumber = 0;
+  _event.run.setAddress(*runTree);
+  _event.run.findEntry(*runTree, _event.runNumber);
+
+  auto* outputFile(TFile::Open(TString::Format("%s/%d_%d_%d.root", _outputDir, _event.runNumber, _event.lumiNumber, _event.eventNumber), "recreate"));
+  auto* outputEvents(new TTree("events", "events"));
+  auto* outputRuns(new TTree("runs", "runs"));
+
+  _event.book(*outputEvents);
+  _event.run.book(*outputRuns);
+  _event.fill(*outputEvents);
+  _event.run.fill(*outputRuns);
+
+  outputFile->cd();
+  outputEvents->Write();
+  outputRuns->Write();
+
+  for (auto* key : *_source.GetListOfKeys()) {
+    if (std::strcmp(key->GetName(), "events") == 0 || std::strcmp(key->GetName(), "runs") == 0)
+      continue;
+
+    outputFile->cd();
+    auto* obj(static_cast<TKey*>(key)->ReadObj());
+    obj->Write();
+  }
+
+  delete outputFile;
+}
+
+std::vector<long>
+indexLumiBlocks(char const* _path)
+{
+  // Returns the blocks of consecutive entries with the same run and lumi numbers in the file at path
+  // as a flat list (run, lumi, first entry, last entry, ...). Only the run and lumi branches are read.
+
+  std::vector<long> blocks;
+
+  std::unique_ptr<TFile> source(TFile::Open(_path));
+  if (!source || source->IsZombie())
+    return blocks;
+
+  auto* input(static_cast<TTree*>(source->Get("events")));
+  if (!input)
+    return blocks;
+
+  unsigned run(0);
+  unsigned lumi(0);
+
+  input->SetBranchStatus("*", false);
+  input->SetBranchStatus("runNumber", true);
+  input->SetBranchStatus("lumiNumber", true);
+  input->SetBranchAddress("runNumber", &run);
+  input->SetBranchAddress("lumiNumber", &lumi);
+
+  long nEntries(input->GetEntries());
+  for (long iEntry(0); iEntry != nEntries; ++iEntry) {
+    if (input->GetEntry(iEntry) <= 0)
+      break;
+
+    if (blocks.size() != 0 && unsigned(blocks[blocks.size() - 4]) == run && unsigned(blocks[blocks.size() - 3]) == lumi && blocks.back() == iEntry - 1) {
+      blocks.back() = iEntry;
+      continue;
+    }
+
+    blocks.push_back(run);
+    blocks.push_back(lumi);
+    blocks.push_back(iEntry);
+    blocks.push_back(iEntry);
+  }
+
+  return blocks;
+}
@@ -4,13 +4,15 @@
 
 #include "TString.h"
 #include "TFile.h"
-#include "TChain.h"
+#include "TTree.h"
 #include "TKey.h"
 #include "TError.h"
 #include "TSystem.h"
 #include "TROOT.h"
 #include "TDirectory.h"
 #include "TTreeFormula.h"
+#include "TLeaf.h"
+#include "TBranch.h"
 
 #include "GoodLumiFilter.h"
 
@@ -19,10 +21,157 @@
 #include <fstream>
 #include <stdexcept>
 #include <chrono>
+#include <thread>
+#include <mutex>
+#include <condition_variable>
+#include <memory>
+#include <algorithm>
+#include <map>
 typedef std::chrono::steady_clock SClock;
 
 unsigned TIMEOUT(300);
 
+namespace {
+  // ROOT errors from the open attempts of the probe threads are not printed (the retries are reported instead)
+  thread_local bool suppressOpenErrors(false);
+  ErrorHandlerFunc_t previousErrorHandler(nullptr);
+
+  void
+  probeErrorHandler(Int_t _level, Bool_t _abort, char const* _location, char const* _msg)
+  {
+    if (suppressOpenErrors && _level <= kError && !_abort)
+      return;
+
+    previousErrorHandler(_level, _abort, _location, _msg);
+  }
+}
+
+// Opens the input files in background threads, retrying every 30 seconds up to TIMEOUT.
+// next() hands the files out in the order of the paths, so the output does not depend on
+// which file opens first. At most nThreads files are opened ahead of the last served file.
+class InputProbe {
+public:
+  InputProbe(std::vector<TString> const& paths, bool skipMissing, unsigned nThreads);
+  ~InputProbe();
+
+  // Blocks until the next file is available. Returns 0 if the file could not be opened.
+  TFile* next(TString& path);
+
+private:
+  void probe_();
+
+  std::vector<TString> const& paths_;
+  bool skipMissing_;
+  unsigned lookahead_;
+  std::vector<TFile*> sources_;
+  std::vector<bool> probed_;
+  std::vector<bool> served_;
+  unsigned nextToProbe_{0};
+  unsigned nextToServe_{0};
+  bool abort_{false};
+  std::mutex mutex_{};
+  std::condition_variable cond_{};
+  std::vector<std::thread> threads_{};
+};
+
+InputProbe::InputProbe(std::vector<TString> const& _paths, bool _skipMissing, unsigned _nThreads) :
+  paths_(_paths),
+  skipMissing_(_skipMissing),
+  lookahead_(std::max(_nThreads, 1u)),
+  sources_(_paths.size(), 0),
+  probed_(_paths.size(), false),
+  served_(_paths.size(), false)
+{
+  ROOT::EnableThreadSafety();
+
+  previousErrorHandler = SetErrorHandler(probeErrorHandler);
+
+  unsigned nThreads(std::min(lookahead_, unsigned(paths_.size())));
+  for (unsigned iT(0); iT != nThreads; ++iT)
+    threads_.emplace_back(&InputProbe::probe_, this);
+}
+
+InputProbe::~InputProbe()
+{
+  {
+    std::lock_guard<std::mutex> lock(mutex_);
+    abort_ = true;
+  }
+  cond_.notify_all();
+
+  for (auto& thread : threads_)
+    thread.join();
+
+  SetErrorHandler(previousErrorHandler);
+
+  for (unsigned iP(0); iP != paths_.size(); ++iP) {
+    if (!served_[iP])
+      delete sources_[iP];
+  }
+}
+
+TFile*
+InputProbe::next(TString& _path)
+{
+  std::unique_lock<std::mutex> lock(mutex_);
+
+  unsigned iP(nextToServe_++);
+  // lets the probe threads open one more file
+  cond_.notify_all();
+
+  cond_.wait(lock, [this, iP]() { return bool(probed_[iP]); });
+
+  served_[iP] = true;
+  _path = paths_[iP];
+  return sources_[iP];
+}
+
+void
+InputProbe::probe_()
+{
+  unsigned const tryEvery(30);
+
+  suppressOpenErrors = true;
+
+  while (true) {
+    unsigned iP(0);
+    {
+      std::unique_lock<std::mutex> lock(mutex_);
+      cond_.wait(lock, [this]() { return abort_ || nextToProbe_ == paths_.size() || nextToProbe_ < nextToServe_ + lookahead_; });
+      if (abort_ || nextToProbe_ == paths_.size())
+        return;
+      iP = nextToProbe_++;
+    }
+
+    TFile* source(0);
+    for (unsigned iAtt(0); iAtt <= TIMEOUT / tryEvery; ++iAtt) {
+      source = TFile::Open(paths_[iP]);
+      if (source) {
+        if (!source->IsZombie())
+          break;
+        delete source;
+        source = 0;
+      }
+
+      if (skipMissing_)
+        break;
+
+      std::cerr << paths_[iP] << " is not available. Waiting for " << tryEvery << " seconds.." << std::endl;
+
+      std::unique_lock<std::mutex> lock(mutex_);
+      if (cond_.wait_for(lock, std::chrono::seconds(tryEvery), [this]() { return abort_; }))
+        break;
+    }
+
+    {
+      std::lock_guard<std::mutex> lock(mutex_);
+      sources_[iP] = source;
+      probed_[iP] = true;
+    }
+    cond_.notify_all();
+  }
+}
+
 class Skimmer {
 public:
   Skimmer() {}
@@ -39,6 +188,13 @@ public:
   void prepareEvent(panda::Event const&, panda::EventMonophoton&, panda::GenParticleCollection const* = 0);
   void setPrintLevel(unsigned l) { printLevel_ = l; }
   void setCompatibilityMode(bool r) { compatibilityMode_ = r; }
+  void setCacheSize(long s) { cacheSize_ = s; }
+  void setNumOpenThreads(unsigned n) { numOpenThreads_ = n; }
+  void setShareResults(bool b) { shareResults_ = b; }
+  // Read the full standard branch list instead of only the branches declared by the selectors
+  void setReadAllBranches(bool b) { readAllBranches_ = b; }
+  // Write per-stage timing, I/O volume, and per-selector operator timing as JSON to path
+  void setProfile(char const* path) { profilePath_ = path; }
 
 private:
   std::vector<TString> paths_{};
@@ -49,6 +205,12 @@ private:
   unsigned printEvery_{10000};
   unsigned printLevel_{0};
   bool compatibilityMode_{false};
+  long cacheSize_{64 * 1024 * 1024};
+  unsigned numOpenThreads_{8};
+  bool shareResults_{true};
+  bool readAllBranches_{false};
+  OperatorCache resultCache_{};
+  TString profilePath_{""};
 };
 
 Skimmer::~Skimmer()
@@ -65,57 +227,6 @@ Skimmer::run(char const* _outputDir, char const* _sampleName, bool isData, long
   if (selectors_.size() == 0)
     throw std::runtime_error("No selectors set");
 
-  // check all input exists
-  for (auto&& pItr(paths_.begin()); pItr != paths_.end(); ++pItr) {
-    TFile* source(0);
-
-    auto originalErrorIgnoreLevel(gErrorIgnoreLevel);
-    gErrorIgnoreLevel = kError + 1;
-
-    unsigned const tryEvery(30);
-    for (unsigned iAtt(0); iAtt <= TIMEOUT / tryEvery; ++iAtt) {
-      source = TFile::Open(*pItr);
-      if (source) {
-        if (!source->IsZombie())
-          break;
-        delete source;
-      }
-
-      if (skipMissingFiles_)
-        break;
-
-      std::cerr << *pItr << " is not available. Waiting for " << tryEvery << " seconds.." << std::endl;
-
-      gSystem->Sleep(tryEvery * 1000.);
-    }
-
-    gErrorIgnoreLevel = originalErrorIgnoreLevel;
-
-    if ((!source || source->IsZombie())) {
-      if (skipMissingFiles_) {
-        std::cerr << "Skipping missing file " << *pItr << std::endl;
-        auto pos(pItr);
-        --pItr;
-        paths_.erase(pos);
-      }
-      else {
-        std::cerr << "Cannot open file " << *pItr << std::endl;
-        delete source;
-        throw std::runtime_error("source");
-      }
-    }
-    else {
-      auto* inputKey(static_cast<TKey*>(source->GetListOfKeys()->FindObject("events")));
-      if (!inputKey) {
-        std::cerr << "Events tree missing from " << source->GetName() << std::endl;
-        delete source;
-        throw std::runtime_error("source");
-      }
-    }
-
-    delete source;
-  }
-
   TString outputDir(_outputDir);
   TString sampleName(_sampleName);
 
@@ -132,7 +243,8 @@ Skimmer::run(char const* _outputDir, char const* _sampleName, bool isData, long
   genParticles.data.parentContainer_ = &genParticles;
   panda::EventMonophoton skimmedEvent;
 
-  // will get updated by individual operators
+  // Branches needed by prepareEvent. The rest is declared by the selectors and their operators
+  // (addInputBranch) in initialize, so only the union of what the configured selectors read is enabled.
   panda::utils::BranchList branchList = {
     "!*",
     "runNumber",
@@ -140,36 +252,44 @@ Skimmer::run(char const* _outputDir, char const* _sampleName, bool isData, long
     "eventNumber",
     "isData",
     "weight",
-    "npv",
-    "rho",
-    "rhoCentralCalo",
-    "triggers",
-    "vertices",
-    "superClusters",
-    "electrons",
-    "muons",
-    "taus",
-    "photons",
-    "chsAK4Jets",
-    "!chsAK4Jets.constituents_",
-    "pfMet",
-    "metFilters",
-    "metMuOnlyFix"
+    "rho"
   };
 
-  if (!isData)
-    branchList += {"npvTrue", "genReweight", "genVertex", "partons"}; //  , "genMet"};
+  if (readAllBranches_) {
+    branchList += {
+      "npv",
+      "rhoCentralCalo",
+      "triggers",
+      "vertices",
+      "superClusters",
+      "electrons",
+      "muons",
+      "taus",
+      "photons",
+      "chsAK4Jets",
+      "pfMet",
+      "metFilters",
+      "metMuOnlyFix"
+    };
+
+    if (!isData)
+      branchList += {"npvTrue", "genReweight", "genVertex", "partons"}; //  , "genMet"};
+  }
 
-  if (compatibilityMode_)
-    branchList += {"!eventNumber", "!electrons.triggerMatch", "!muons.triggerMatch", "!photons.triggerMatch"};
+  TString commonSelection(selectors_[0]->getPreskim());
 
-  if (printLevel_ > 0 && printLevel_ <= DEBUG)
-    branchList.setVerbosity(1);
+  bool profile(profilePath_.Length() != 0);
 
-  TString commonSelection(selectors_[0]->getPreskim());
+  // slots are assigned again by the selectors
+  resultCache_.reset();
 
   for (auto* sel : selectors_) {
     sel->setPrintLevel(printLevel_, stream);
+    if (profile)
+      sel->setUseTimers(true);
+    // Identically configured operators (with identical preceding operators, for those that use the output
+    // event) are executed once per event for all selectors
+    sel->setResultCache(shareResults_ ? &resultCache_ : 0);
 
     TString outputPath(outputDir + "/" + sampleName + "_" + sel->name() + ".root");
     sel->initialize(outputPath, skimmedEvent, branchList, !isData);
@@ -180,131 +300,295 @@ Skimmer::run(char const* _outputDir, char const* _sampleName, bool isData, long
     }
   }
 
+  // exclusions come after all declarations
+  branchList += {"!chsAK4Jets.constituents_"};
+
+  if (compatibilityMode_)
+    branchList += {"!eventNumber", "!electrons.triggerMatch", "!muons.triggerMatch", "!photons.triggerMatch"};
+
+  if (printLevel_ > 0 && printLevel_ <= DEBUG)
+    branchList.setVerbosity(1);
+
   // if the selectors register triggers, make sure the information is passed to the actual input event
   event.run = skimmedEvent.run;
 
   if (goodLumiFilter_)
     *stream << "Applying good lumi filter." << std::endl;
 
-  TChain preInput("events");
-  TChain mainInput("events");
-  TChain genInput("events");
-  int mainTreeNumber(-1);
-
-  for (auto& path : paths_) {
-    preInput.Add(path);
-    mainInput.Add(path);
-    genInput.Add(path);
-  }
-
-  TTreeFormula* preselection(0);
-  int preTreeNumber(-1);
-  if (commonSelection != "") {
+  if (commonSelection != "")
     *stream << "Applying baseline selection \"" << commonSelection << "\"" << std::endl;
 
-    preselection = new TTreeFormula("preselection", commonSelection, &preInput);
-  }
-
-  event.setStatus(mainInput, branchList);
-  event.setAddress(mainInput, {"*"}, false);
-
-  genInput.SetBranchStatus("*", false);
-  genParticles.setAddress(genInput);
-
   event.electrons.data.matchedGenContainer_ = &genParticles;
   event.muons.data.matchedGenContainer_ = &genParticles;
   event.taus.data.matchedGenContainer_ = &genParticles;
   event.photons.data.matchedGenContainer_ = &genParticles;
 
+  // Inputs are opened concurrently in the background, up to numOpenThreads_ files ahead, and processed
+  // in the order of the paths so that the output and the entry ranges do not depend on the open timing.
+  InputProbe probe(paths_, skipMissingFiles_, numOpenThreads_);
+
   auto now(SClock::now());
   auto start(now);
 
+  enum Stage {
+    kOpen,
+    kPreselection,
+    kRead,
+    kPrepare,
+    kSelect,
+    kWrite,
+    nStages
+  };
+  char const* stageNames[nStages] = {"open", "preselection", "read", "prepareEvent", "select", "write"};
+  StageTimer stageTimers[nStages];
+  long nRead(0);
+  long bytesRead(0);
+  std::map<TString, long> branchZipBytes; // compressed size of the enabled input branches
+
+  long iGlobalEntry(0);
   long iEntry(0);
-  while (iEntry++ != _nEntries) {
-    if ((iEntry - 1) % printEvery_ == 0 && printLevel_ > 0) {
-      auto past = now;
-      now = SClock::now();
-      *stream << " " << iEntry << " (took " << std::chrono::duration_cast<std::chrono::milliseconds>(now - past).count() / 1000. << " s)" << std::endl;
+  unsigned nPaths(paths_.size());
+  for (unsigned iPath(0); iPath != nPaths && iEntry != _nEntries; ++iPath) {
+    TString path;
+    std::unique_ptr<TFile> source;
+    {
+      StageTimer::Scope timer(stageTimers[kOpen], profile);
+      source.reset(probe.next(path));
     }
 
-    if (preselection) {
-      if (preInput.LoadTree(_firstEntry + iEntry - 1) < 0)
-        break;
-
-      if (preTreeNumber != preInput.GetTreeNumber()) {
-        preTreeNumber = preInput.GetTreeNumber();
-        preselection->UpdateFormulaLeaves();
+    if (!source) {
+      if (skipMissingFiles_) {
+        std::cerr << "Skipping missing file " << path << std::endl;
+        continue;
       }
-
-      int nD(preselection->GetNdata());
-      int iD(0);
-      for (; iD != nD; ++iD) {
-        if (preselection->EvalInstance(iD) != 0.)
-          break;
+      else {
+        std::cerr << "Cannot open file " << path << std::endl;
+        throw std::runtime_error("source");
       }
-      if (iD == nD)
-        continue;
     }
 
-    try {
-      if (event.getEntry(mainInput, _firstEntry + iEntry - 1) <= 0)
-        break;
-    }
-    catch (std::exception& _ex) {
-      *stream << "Error while processing " << mainInput.GetCurrentFile()->GetName() << std::endl;
-      throw;
+    auto* input(dynamic_cast<TTree*>(source->Get("events")));
+    if (!input) {
+      std::cerr << "Events tree missing from " << source->GetName() << std::endl;
+      throw std::runtime_error("source");
     }
 
-    if (goodLumiFilter_ && !goodLumiFilter_->isGoodLumi(event.runNumber, event.lumiNumber))
+    long nLocalEntries(input->GetEntries());
+    if (iGlobalEntry + nLocalEntries <= _firstEntry) {
+      iGlobalEntry += nLocalEntries;
       continue;
+    }
+
+    // Single reader for all branches. The preselection formula reads its branches first, and
+    // the rest of the event is read only if the preselection is satisfied.
+    event.setStatus(*input, branchList);
+    // standalone genParticles collection reads the gen particle branches
+    event.setAddress(*input, {"*", "!genParticles"}, false);
 
-    if (mainTreeNumber != mainInput.GetTreeNumber()) {
-      mainTreeNumber = mainInput.GetTreeNumber();
-      // invalidate output event run number so it gets updated in prepareEvent
-      skimmedEvent.run.runNumber = 0;
+    if (!isData)
+      genParticles.setAddress(*input);
+
+    std::unique_ptr<TTreeFormula> preselection;
+    if (commonSelection != "") {
+      preselection.reset(new TTreeFormula("preselection", commonSelection, input));
+
+      // make sure the branches used in the preselection are readable
+      for (int iL(0); iL != preselection->GetNcodes(); ++iL) {
+        auto* leaf(preselection->GetLeaf(iL));
+        if (leaf)
+          input->SetBranchStatus(leaf->GetBranch()->GetName(), true);
+      }
     }
 
-    if (!event.isData) {
-      genParticles.getEntry(genInput, _firstEntry + iEntry - 1);
-      prepareEvent(event, skimmedEvent, &genParticles);
+    // run and lumi numbers are read alone first so that events in bad lumis are rejected
+    // before any other branch is decompressed
+    TBranch* runBranch(0);
+    TBranch* lumiBranch(0);
+    if (goodLumiFilter_) {
+      runBranch = input->GetBranch("runNumber");
+      lumiBranch = input->GetBranch("lumiNumber");
     }
-    else
-      prepareEvent(event, skimmedEvent);
-
-    if (printLevel_ > 0 && printLevel_ <= INFO) {
-      debugFile << std::endl << ">>>>> Printing event " << iEntry <<" !!! <<<<<" << std::endl;
-      debugFile << skimmedEvent.runNumber << ":" << skimmedEvent.lumiNumber << ":" << skimmedEvent.eventNumber << std::endl;
-      skimmedEvent.print(debugFile, 2);
-      debugFile << std::endl;
-      skimmedEvent.photons.print(debugFile, 2);
-      // debugFile << "photons.size() = " << skimmedEvent.photons.size() << std::endl;
-      debugFile << std::endl;
-      skimmedEvent.muons.print(debugFile, 2);
-      // debugFile << "muons.size() = " << skimmedEvent.muons.size() << std::endl;
-      debugFile << std::endl;
-      skimmedEvent.electrons.print(debugFile, 2);
-      // debugFile << "electrons.size() = " << skimmedEvent.electrons.size() << std::endl;
-      debugFile << std::endl;
-      skimmedEvent.jets.print(debugFile, 2);
-      // debugFile << "jets.size() = " << skimmedEvent.jets.size() << std::endl;
-      debugFile << std::endl;
-      skimmedEvent.t1Met.print(debugFile, 2);
-      // debugFile << std::endl;
-      skimmedEvent.metMuOnlyFix.print(debugFile, 2);
-      debugFile << std::endl;
-      skimmedEvent.metNoFix.print(debugFile, 2);
-      debugFile << std::endl;
-      debugFile << ">>>>> Event " << iEntry << " done!!! <<<<<" << std::endl << std::endl;
+
+    if (cacheSize_ > 0)
+      input->SetCacheSize(cacheSize_);
+
+    // invalidate output event run number so it gets updated in prepareEvent
+    skimmedEvent.run.runNumber = 0;
+
+    long iLocalEntry(0);
+    if (iGlobalEntry < _firstEntry)
+      iLocalEntry = _firstEntry - iGlobalEntry;
+
+    iGlobalEntry += nLocalEntries;
+
+    if (profile) {
+      for (auto* obj : *input->GetListOfBranches()) {
+        auto* branch(static_cast<TBranch*>(obj));
+        if (input->GetBranchStatus(branch->GetName()))
+          branchZipBytes[branch->GetName()] += branch->GetZipBytes("*");
+      }
     }
 
+    for (; iLocalEntry != nLocalEntries && iEntry != _nEntries; ++iLocalEntry) {
+      ++iEntry;
+
+      if ((iEntry - 1) % printEvery_ == 0 && printLevel_ > 0) {
+        auto past = now;
+        now = SClock::now();
+        *stream << " " << iEntry << " (took " << std::chrono::duration_cast<std::chrono::milliseconds>(now - past).count() / 1000. << " s)" << std::endl;
+      }
+
+      if (profile)
+        stageTimers[kPreselection].start();
+
+      if (input->LoadTree(iLocalEntry) < 0) {
+        if (profile)
+          stageTimers[kPreselection].stop();
+        break;
+      }
+
+      if (goodLumiFilter_) {
+        runBranch->GetEntry(iLocalEntry);
+        lumiBranch->GetEntry(iLocalEntry);
+        if (!goodLumiFilter_->isGoodLumi(event.runNumber, event.lumiNumber)) {
+          if (profile)
+            stageTimers[kPreselection].stop();
+          continue;
+        }
+      }
+
+      if (preselection) {
+        int nD(preselection->GetNdata());
+        int iD(0);
+        for (; iD != nD; ++iD) {
+          if (preselection->EvalInstance(iD) != 0.)
+            break;
+        }
+        if (iD == nD) {
+          if (profile)
+            stageTimers[kPreselection].stop();
+          continue;
+        }
+      }
+
+      if (profile) {
+        stageTimers[kPreselection].stop();
+        stageTimers[kRead].start();
+      }
+
+      try {
+        if (event.getEntry(*input, iLocalEntry) <= 0) {
+          if (profile)
+            stageTimers[kRead].stop();
+          break;
+        }
+      }
+      catch (std::exception& _ex) {
+        *stream << "Error while processing " << source->GetName() << std::endl;
+        throw;
+      }
+
+      if (!event.isData)
+        genParticles.getEntry(*input, iLocalEntry);
+
+      ++nRead;
+
+      if (profile) {
+        stageTimers[kRead].stop();
+        stageTimers[kPrepare].start();
+      }
+
+      if (!event.isData)
+        prepareEvent(event, skimmedEvent, &genParticles);
+      else
+        prepareEvent(event, skimmedEvent);
+
+      if (profile)
+        stageTimers[kPrepare].stop();
+
+      if (printLevel_ > 0 && printLevel_ <= INFO) {
+        debugFile << std::endl << ">>>>> Printing event " << iEntry <<" !!! <<<<<" << std::endl;
+        debugFile << skimmedEvent.runNumber << ":" << skimmedEvent.lumiNumber << ":" << skimmedEvent.eventNumber << std::endl;
+        skimmedEvent.print(debugFile, 2);
+        debugFile << std::endl;
+        skimmedEvent.photons.print(debugFile, 2);
+        // debugFile << "photons.size() = " << skimmedEvent.photons.size() << std::endl;
+        debugFile << std::endl;
+        skimmedEvent.muons.print(debugFile, 2);
+        // debugFile << "muons.size() = " << skimmedEvent.muons.size() << std::endl;
+        debugFile << std::endl;
+        skimmedEvent.electrons.print(debugFile, 2);
+        // debugFile << "electrons.size() = " << skimmedEvent.electrons.size() << std::endl;
+        debugFile << std::endl;
+        skimmedEvent.jets.print(debugFile, 2);
+        // debugFile << "jets.size() = " << skimmedEvent.jets.size() << std::endl;
+        debugFile << std::endl;
+        skimmedEvent.t1Met.print(debugFile, 2);
+        // debugFile << std::endl;
+        skimmedEvent.metMuOnlyFix.print(debugFile, 2);
+        debugFile << std::endl;
+        skimmedEvent.metNoFix.print(debugFile, 2);
+        debugFile << std::endl;
+        debugFile << ">>>>> Event " << iEntry << " done!!! <<<<<" << std::endl << std::endl;
+      }
+
+      StageTimer::Scope timer(stageTimers[kSelect], profile);
+
+      resultCache_.clear();
+
+      for (auto* sel : selectors_)
+        sel->selectEvent(skimmedEvent);
+    }
+
+    bytesRead += source->GetBytesRead();
+  }
+
+  {
+    StageTimer::Scope timer(stageTimers[kWrite], profile);
+
     for (auto* sel : selectors_)
-      sel->selectEvent(skimmedEvent);
+      sel->finalize();
   }
 
-  delete preselection;
+  if (profile) {
+    double totalTime(std::chrono::duration_cast<std::chrono::nanoseconds>(SClock::now() - start).count() * 1.e-9);
+
+    std::ofstream profileFile(profilePath_.Data());
+    profileFile << "{\"sample\": \"" << sampleName << "\",\n";
+    profileFile << " \"wall\": " << totalTime << ",\n";
+    profileFile << " \"events\": {\"scanned\": " << iEntry << ", \"read\": " << nRead << ", \"rate\": " << (totalTime > 0. ? iEntry / totalTime : 0.) << "},\n";
 
-  for (auto* sel : selectors_)
-    sel->finalize();
+    profileFile << " \"stages\": {";
+    for (unsigned iS(0); iS != nStages; ++iS) {
+      if (iS != 0)
+        profileFile << ",";
+      profileFile << "\n  \"" << stageNames[iS] << "\": ";
+      stageTimers[iS].writeJSON(profileFile);
+    }
+    profileFile << "},\n";
+
+    profileFile << " \"input\": {\"bytesRead\": " << bytesRead << ", \"branches\": {";
+    bool first(true);
+    for (auto& b : branchZipBytes) {
+      if (!first)
+        profileFile << ",";
+      first = false;
+      profileFile << "\n  \"" << b.first << "\": {\"zipBytes\": " << b.second << "}";
+    }
+    profileFile << "}},\n";
+
+    profileFile << " \"selectors\": [";
+    for (unsigned iS(0); iS != selectors_.size(); ++iS) {
+      if (iS != 0)
+        profileFile << ",";
+      profileFile << "\n  ";
+      selectors_[iS]->writeProfile(profileFile);
+    }
+    profileFile << "]}" << std::endl;
+
+    if (printLevel_ > 0)
+      *stream << "Wrote profile to " << profilePath_ << std::endl;
+  }
 
   if (printLevel_ > 0 && printLevel_ <= INFO) {
     debugFile.close();
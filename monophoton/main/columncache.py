@@ -0,0 +1,80 @@
+import os
+import hashlib
+import numpy
+
+import ROOT
+
+class ColumnCache(object):
+    """
+    Directory of per-plot (x, weight) columns extracted from the skims by MultiDraw.
+    Each entry is a 2 x N float64 .npy file, keyed by a hash of the source file path, size and mtime and
+    of everything that determines the filled values (selections, weights, expression, cut, reweight).
+    Binning and overflow handling are not part of the key, so histograms can be refilled with a
+    different binning directly from the cache.
+    """
+
+    def __init__(self, cacheDir):
+        self.cacheDir = cacheDir
+
+        if not os.path.isdir(self.cacheDir):
+            try:
+                os.makedirs(self.cacheDir)
+            except OSError:
+                if not os.path.isdir(self.cacheDir):
+                    raise
+
+    def makeKey(self, sourceName, *args):
+        stat = os.stat(sourceName)
+
+        digest = hashlib.sha1()
+        digest.update(repr((os.path.realpath(sourceName), stat.st_size, int(stat.st_mtime)) + args))
+
+        return digest.hexdigest()
+
+    def path(self, key):
+        return self.cacheDir + '/' + key + '.npy'
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def save(self, key, tree):
+        """
+        Save the x and weight branches of a tree filled by MultiDraw.
+        """
+
+        nentries = tree.GetEntries()
+        columns = numpy.empty((2, nentries), dtype = numpy.float64)
+
+        if nentries != 0:
+            tree.SetEstimate(nentries + 1)
+            tree.Draw('x:weight', '', 'goff')
+            for irow, buf in enumerate([tree.GetV1(), tree.GetV2()]):
+                buf.SetSize(nentries)
+                columns[irow] = numpy.frombuffer(buf, dtype = numpy.float64, count = nentries)
+
+        tmpPath = '%s.%d' % (self.path(key), os.getpid())
+        with open(tmpPath, 'wb') as out:
+            numpy.save(out, columns)
+
+        os.rename(tmpPath, self.path(key))
+
+    def fill(self, key, hist, overflowMode = ROOT.Plot.kNoOverflowBin):
+        """
+        Fill a 1D histogram from the cached columns, with the same overflow treatment as MultiDraw.
+        """
+
+        columns = numpy.load(self.path(key), mmap_mode = 'r')
+        if columns.shape[1] == 0:
+            return
+
+        x = numpy.array(columns[0])
+        w = numpy.ascontiguousarray(columns[1])
+
+        nbins = hist.GetNbinsX()
+        lastLow = hist.GetXaxis().GetBinLowEdge(nbins)
+        if overflowMode == ROOT.Plot.kDedicated:
+            x[x > lastLow] = lastLow
+        elif overflowMode == ROOT.Plot.kMergeLast:
+            x[x > hist.GetXaxis().GetBinUpEdge(nbins)] = lastLow
+
+        hist.FillN(len(x), x, w)
@@ -2,7 +2,9 @@
 import os
 import sys
 sys.dont_write_bytecode = True
-import array
+import collections
+import numpy
+from multiprocessing.pool import ThreadPool
 from argparse import ArgumentParser
 
 thisdir = os.path.dirname(os.path.realpath(__file__))
@@ -21,6 +23,7 @@ argParser.add_argument('--flow', '-f', metavar = 'CUTS', nargs = '+', dest = 'cu
 argParser.add_argument('--cut-results', '-r', metavar = 'EVENTID', nargs = '+', dest = 'eventIds', help = 'Show results of the cuts on a specific event.')
 argParser.add_argument('--out', '-o', metavar = 'PATH', dest = 'outName', default = '', help = 'Output file name. Use "-" for stdout.')
 argParser.add_argument('--uw-format', '-U', action = 'store_true', dest = 'uwFormat', help = 'Print event list in run:event:lumi format.')
+argParser.add_argument('--threads', '-j', metavar = 'N', dest = 'numThreads', type = int, default = 16, help = 'Number of threads for reading the per-file event counters.')
 
 args = argParser.parse_args()
 sys.argv = []
@@ -28,11 +31,114 @@ sys.argv = []
 import ROOT
 ROOT.gROOT.SetBatch(True)
 
+# number of cutflow tree entries read into memory at once
+chunkSize = 10000000
+
+def readCounter(path):
+    source = ROOT.TFile.Open(path)
+    if not source:
+        return 0.
+
+    counter = source.Get('counter')
+    if counter:
+        count = counter.GetBinContent(1)
+    else:
+        count = 0.
+
+    source.Close()
+
+    return count
+
+def readColumns(tree, branches, firstEntry, nentries):
+    """
+    Read the branches for the entry range into numpy arrays. Returns ({branch: array}, number of entries read).
+    """
+
+    columns = {}
+    nread = 0
+
+    # TTree::Draw keeps at most four columns
+    for istart in range(0, len(branches), 4):
+        names = branches[istart:istart + 4]
+        nread = tree.Draw(':'.join(names), '', 'goff', nentries, firstEntry)
+        if nread <= 0:
+            return {}, 0
+
+        for iv, name in enumerate(names):
+            buf = tree.GetVal(iv)
+            buf.SetSize(nread)
+            columns[name] = numpy.frombuffer(buf, dtype = numpy.float64, count = nread).copy()
+
+    return columns, nread
+
+def cutflowChunks(branches):
+    """
+    Iterate over the cutflow tree in chunks of at most chunkSize entries, yielding {branch: array}.
+    """
+
+    nentries = tree.GetEntries()
+    tree.SetEstimate(min(nentries, chunkSize) + 1)
+
+    for firstEntry in xrange(0, nentries, chunkSize):
+        columns, nread = readColumns(tree, branches, firstEntry, min(chunkSize, nentries - firstEntry))
+        if nread == 0:
+            break
+
+        yield columns
+
+def sequentialMasks(columns, cutflow):
+    """
+    Return a (len(cutflow), nentries) boolean array; row i is true for entries passing cut groups 0..i.
+    """
+
+    nentries = len(columns.itervalues().next())
+
+    results = numpy.empty((len(cutflow), nentries), dtype = numpy.bool_)
+    for icut, cuts in enumerate(cutflow):
+        results[icut] = numpy.logical_and.reduce([columns[cut] != 0. for cut in cuts], axis = 0)
+
+    return numpy.logical_and.accumulate(results, axis = 0)
+
+def cutflowCounts(cutflow):
+    """
+    Return ([number of entries passing cut groups 0..i], number of entries) for the whole sample.
+    """
+
+    if cutMasks is not None:
+        # summary mode skims: combinations of cut results with counts
+        masks = numpy.array(cutMasks.keys(), dtype = numpy.uint64)
+        counts = numpy.array(cutMasks.values(), dtype = numpy.float64)
+
+        required = numpy.uint64(0)
+        npass = []
+        for cuts in cutflow:
+            for cut in cuts:
+                try:
+                    required |= numpy.uint64(1 << cutBits[cut])
+                except KeyError:
+                    print 'Cut', cut, 'is not in the cutflow summary'
+                    sys.exit(1)
+
+            npass.append(int(counts[(masks & required) == required].sum()))
+
+        return npass, int(counts.sum())
+
+    branches = sorted(set(cut for cuts in cutflow for cut in cuts))
+    if len(branches) == 0:
+        return [], tree.GetEntries()
+
+    npass = numpy.zeros(len(cutflow), dtype = numpy.int64)
+    for columns in cutflowChunks(branches):
+        npass += sequentialMasks(columns, cutflow).sum(axis = 1)
+
+    return [int(n) for n in npass], tree.GetEntries()
+
 data = False
 
 ntotal = 0
 
 sampleNames = []
+filePaths = []
 
 tree = ROOT.TChain('cutflow')
 for sample in allsamples.getmany(args.snames):
@@ -48,21 +154,71 @@ for sample in allsamples.getmany(args.snames):
         filePath = utils.getSkimPath(sample.name, args.region)
 
     else:
-        # otherwise open the original files
-        for fname in sample.files():
-            source = ROOT.TFile.Open(fname)
-            counter = source.Get('counter')
-            if not counter:
-                source.Close()
-                continue
-    
-            ntotal += counter.GetBinContent(1)
-            source.Close()
+        # otherwise read the counters of the original files
+        fnames = sample.files()
+        if args.numThreads > 1 and len(fnames) > 1:
+            ROOT.ROOT.EnableThreadSafety()
+            # release the GIL while opening the files
+            ROOT.TFile.Open._threaded = True
+
+            pool = ThreadPool(min(args.numThreads, len(fnames)))
+            try:
+                ntotal += sum(pool.map(readCounter, fnames))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            ntotal += sum(readCounter(fname) for fname in fnames)
 
         filePath = args.skimDir + '/' + sample.name + '_' + args.region + '.root'
 
     print filePath
     tree.Add(filePath)
+    filePaths.append(filePath)
+
+# Skims made with ssw2.py --cutflow summary have no per-event cutflow tree.
+# Event counts are then computed from the cut result combinations (cutmasks) instead.
+cutBits = None
+cutMasks = None
+
+if len(filePaths) == 0:
+    print 'No sample selected'
+    sys.exit(1)
+
+source = ROOT.TFile.Open(filePaths[0])
+if not source:
+    print 'Cannot open', filePaths[0]
+    sys.exit(1)
+
+hasTree = bool(source.Get('cutflow'))
+source.Close()
+
+if not hasTree:
+    cutMasks = collections.defaultdict(float)
+
+    for filePath in filePaths:
+        source = ROOT.TFile.Open(filePath)
+        if not source:
+            print 'Cannot open', filePath
+            sys.exit(1)
+
+        countsHist = source.Get('cutflowCounts')
+        if not countsHist:
+            print 'No cutflow tree or counts in', filePath
+            sys.exit(1)
+
+        axis = countsHist.GetXaxis()
+        names = [axis.GetBinLabel(ibin) for ibin in range(2, axis.GetNbins() + 1)]
+        if cutBits is None:
+            cutBits = dict((name, ibit) for ibit, name in enumerate(names))
+        elif names != sorted(cutBits, key = cutBits.get):
+            print 'Inconsistent cut list in', filePath
+            sys.exit(1)
+
+        for entry in source.Get('cutmasks'):
+            cutMasks[entry.mask] += entry.count
+
+        source.Close()
 
 if args.cutflow is None:
     if data:
@@ -123,51 +279,35 @@ else:
         cuts = tuple(cutstr.split(','))
         cutflow.append(cuts)
 
-if args.eventList:
-    run = array.array('I', [0])
-    lumi = array.array('I', [0])
-    event = array.array('I', [0])
-    
-    tree.SetBranchAddress('runNumber', run)
-    tree.SetBranchAddress('lumiNumber', lumi)
-    tree.SetBranchAddress('eventNumber', event)
+if (args.eventList or args.eventIds is not None) and cutMasks is not None:
+    print 'Event-level cut results are not available in cutflow summary mode skims.'
+    sys.exit(1)
 
-    for ic, cut in enumerate(list(cutflow)):
-        if type(cut) is tuple:
-            cutflow[ic] = cut[0]
-            cutflow.extend(list(cut[1:]))
+idBranches = ['runNumber', 'lumiNumber', 'eventNumber']
 
-    print ' && '.join(cutflow)
+if args.eventList:
+    print ' && '.join(cut for cuts in cutflow for cut in cuts)
 
-    tree.Draw('>>elist', ' && '.join(cutflow), 'entrylist')
-    elist = ROOT.gDirectory.Get('elist')
-    tree.SetEntryList(elist)
-    
     evlist = []
-    
-    iListEntry = 0
-    while True:
-        iEntry = tree.GetEntryNumber(iListEntry)
-        if iEntry < 0:
-            break
-    
-        iListEntry += 1
-    
-        tree.GetEntry(iEntry)
 
-        eventNumber = int(event[0])
+    branches = idBranches + sorted(set(cut for cuts in cutflow for cut in cuts))
+    for columns in cutflowChunks(branches):
+        passing = sequentialMasks(columns, cutflow)[-1]
+
+        runs = columns['runNumber'][passing].astype(numpy.int64)
+        lumis = columns['lumiNumber'][passing].astype(numpy.int64)
+        events = columns['eventNumber'][passing].astype(numpy.int64)
 
         if data:
             # ad-hoc fix
             # L1A comes at ~100kHz * one lumi section is 23 seconds.
             # giving a huge safety factor of allowing 10kHz rate.
-            if eventNumber < lumi[0] * 23 * 10000:
-                eventNumber += 0x100000000
+            events[events < lumis * 23 * 10000] += 0x100000000
 
         if args.uwFormat:
-            evlist.append((run[0], eventNumber, lumi[0]))
+            evlist.extend(zip(runs.tolist(), events.tolist(), lumis.tolist()))
         else:
-            evlist.append((run[0], lumi[0], eventNumber))
+            evlist.extend(zip(runs.tolist(), lumis.tolist(), events.tolist()))
 
     evlist.sort()
 
@@ -180,14 +320,6 @@ if args.eventList:
         args.outName = 'events_' + args.region + '_' + '+'.join(sampleNames) + '.list'
 
 elif args.eventIds is not None:
-    run = array.array('I', [0])
-    lumi = array.array('I', [0])
-    event = array.array('I', [0])
-    
-    tree.SetBranchAddress('runNumber', run)
-    tree.SetBranchAddress('lumiNumber', lumi)
-    tree.SetBranchAddress('eventNumber', event)
-
     eventIds = []
     for sid in args.eventIds:
         if args.uwFormat:
@@ -204,42 +336,28 @@ elif args.eventIds is not None:
         cutflow = []
         tree.LoadTree(0)
         for branch in tree.GetListOfBranches():
-            if branch.GetName() != 'runNumber' and branch.GetName() != 'lumiNumber' and branch.GetName() != 'eventNumber':
+            if branch.GetName() not in idBranches:
                 cutflow.append((branch.GetName(),))
 
-    results = {}
-    for cuts in cutflow:
-        for cut in cuts:
-            bit = array.array('B', [0])
-            tree.SetBranchAddress(cut, bit)
-            results[cut] = bit
+    branches = idBranches + sorted(set(cut for cuts in cutflow for cut in cuts))
 
-    sels = []
-    for eventId in eventIds:
-        sels.append('(runNumber == %d && lumiNumber == %d && eventNumber == %d)' % eventId)
-
-    tree.Draw('>>elist', ' || '.join(sels), 'entrylist')
-    elist = ROOT.gDirectory.Get('elist')
+    outputLines = []
 
-    if elist.GetN() == 0:
-        print 'No event found:', eventIds
-        sys.exit(1)
+    for columns in cutflowChunks(branches):
+        selected = numpy.zeros(len(columns['runNumber']), dtype = numpy.bool_)
+        for r, l, e in eventIds:
+            selected |= (columns['runNumber'] == r) & (columns['lumiNumber'] == l) & (columns['eventNumber'] == e)
 
-    outputLines = []
+        for ientry in numpy.nonzero(selected)[0]:
+            outputLines.append('=== %d:%d:%d ===' % tuple(int(columns[b][ientry]) for b in idBranches))
 
-    tree.SetEntryList(elist)
-    for iL in range(elist.GetN()):
-        iEntry = tree.GetEntryNumber(iL)
-        tree.GetEntry(iEntry)
+            for cuts in cutflow:
+                result = int(all(columns[cut][ientry] != 0. for cut in cuts))
+                outputLines.append('%s: %d' % (' && '.join(cuts), result))
 
-        outputLines.append('=== %d:%d:%d ===' % (run[0], lumi[0], event[0]))
-       
-        for cuts in cutflow:
-            result = 1
-            for cut in cuts:
-                result *= results[cut][0]
-    
-            outputLines.append('%s: %d' % (' && '.join(cuts), result))
+    if len(outputLines) == 0:
+        print 'No event found:', eventIds
+        sys.exit(1)
 
     if not args.outName:
         args.outName = '-'
@@ -254,20 +372,18 @@ else:
 
     outputLines.append(formLine('Total', ntotal, ntotal))
 
-    nevt = tree.GetEntries()
+    # all steps of the cutflow are computed in one pass over the cut results
+    npass, nevt = cutflowCounts(cutflow)
     outputLines.append(formLine('PhotonSkim', nevt, ntotal))
 
-    expr = ''
-    for cuts in cutflow:
-        if expr == '':
+    for icut, cuts in enumerate(cutflow):
+        if icut == 0:
             name = ' && '.join(cuts)
-            expr = name
         else:
             name = ' && ' + ' && '.join(cuts)
-            expr += name
-    
+
         prev = nevt
-        nevt = tree.GetEntries(expr)
+        nevt = npass[icut]
         outputLines.append(formLine(name, nevt, prev))
 
     if args.outName == '':
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import sqlite3
+import multiprocessing
+
+eventIndexPath = os.path.expanduser('~/.cache/monophoton/events.db')
+
+class EventIndex(object):
+    """
+    sqlite index of (run, lumi) -> (file, first entry, last entry) for panda files.
+    Events of one lumi are stored in contiguous blocks of entries, so the index stays small while
+    allowing EventPicker to read only the few entries that can contain a requested event.
+    Files are re-indexed when their size or modification time changes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        # sqlite connections cannot be shared with forked processes
+        if self._conn is not None and self._pid == os.getpid():
+            return self._conn
+
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+
+        conn = sqlite3.connect(self.path, timeout = 30.)
+        conn.text_factory = str
+        conn.executescript("""
+CREATE TABLE IF NOT EXISTS indexedfiles (id INTEGER PRIMARY KEY, path TEXT UNIQUE, size INTEGER, mtime REAL);
+CREATE TABLE IF NOT EXISTS lumiblocks (file_id INTEGER, run INTEGER, lumi INTEGER, first INTEGER, last INTEGER);
+CREATE INDEX IF NOT EXISTS lumiblocks_lumi ON lumiblocks (run, lumi);
+CREATE INDEX IF NOT EXISTS lumiblocks_file ON lumiblocks (file_id);
+""")
+
+        self._conn = conn
+        self._pid = os.getpid()
+
+        return conn
+
+    @staticmethod
+    def _stat(path):
+        try:
+            stat = os.stat(path)
+            return stat.st_size, stat.st_mtime
+        except OSError:
+            return None
+
+    def indexed(self, paths):
+        """
+        Return the subset of paths with an up-to-date index.
+        """
+
+        conn = self._connection()
+
+        result = set()
+        for path in paths:
+            row = conn.execute('SELECT size, mtime FROM indexedfiles WHERE path = ?', (path,)).fetchone()
+            if row is not None and EventIndex._stat(path) == tuple(row):
+                result.add(path)
+
+        return result
+
+    def addFile(self, path, blocks):
+        """
+        Store the lumi blocks [(run, lumi, first, last)] of the file at path.
+        """
+
+        stat = EventIndex._stat(path)
+        if stat is None:
+            return
+
+        conn = self._connection()
+        with conn:
+            row = conn.execute('SELECT id FROM indexedfiles WHERE path = ?', (path,)).fetchone()
+            if row is not None:
+                fileId = row[0]
+                conn.execute('DELETE FROM lumiblocks WHERE file_id = ?', (fileId,))
+                conn.execute('UPDATE indexedfiles SET size = ?, mtime = ? WHERE id = ?', stat + (fileId,))
+            else:
+                fileId = conn.execute('INSERT INTO indexedfiles (path, size, mtime) VALUES (?, ?, ?)', (path,) + stat).lastrowid
+
+            conn.executemany('INSERT INTO lumiblocks VALUES (?, ?, ?, ?, ?)', ((fileId,) + tuple(block) for block in blocks))
+
+    def lookup(self, run, lumi):
+        """
+        Return [(path, first, last)] of entry blocks containing the given lumi.
+        """
+
+        return self._connection().execute('SELECT f.path, b.first, b.last FROM lumiblocks AS b INNER JOIN indexedfiles AS f ON f.id = b.file_id WHERE b.run = ? AND b.lumi = ?', (run, lumi)).fetchall()
+
+
+def _indexFile(path):
+    import ROOT
+
+    flat = ROOT.indexLumiBlocks(path)
+    if flat.size() == 0:
+        return path, None
+
+    return path, [tuple(int(flat[i + j]) for j in range(4)) for i in xrange(0, flat.size(), 4)]
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    argParser = ArgumentParser(description = 'Build the (run, lumi) -> (file, entries) index used by pickevent.py')
+    argParser.add_argument('snames', metavar = 'SAMPLE', nargs = '*', help = 'Sample names to index.')
+    argParser.add_argument('--catalog', '-c', metavar = 'PATH', dest = 'catalog', default = '/home/cmsprod/catalog/t2mit', help = 'Source file catalog.')
+    argParser.add_argument('--files', '-i', metavar = 'PATH', dest = 'files', nargs = '+', default = [], help = 'Directly index files.')
+    argParser.add_argument('--index', '-x', metavar = 'PATH', dest = 'indexPath', default = eventIndexPath, help = 'Event index database.')
+    argParser.add_argument('--jobs', '-j', metavar = 'N', dest = 'numJobs', type = int, default = 8, help = 'Number of worker processes.')
+    argParser.add_argument('--force', '-F', action = 'store_true', dest = 'force', help = 'Re-index files that are already indexed.')
+
+    args = argParser.parse_args()
+    sys.argv = []
+
+    thisdir = os.path.dirname(os.path.realpath(__file__))
+    basedir = os.path.dirname(thisdir)
+    sys.path.append(basedir)
+
+    paths = list(args.files)
+
+    if len(args.snames) != 0:
+        import datasets
+        datasets.catalogDir = args.catalog
+
+        for sample in datasets.allsamples.getmany(args.snames):
+            paths.extend(sample.files())
+
+    index = EventIndex(args.indexPath)
+
+    if not args.force:
+        done = index.indexed(paths)
+        paths = [path for path in paths if path not in done]
+
+    print len(paths), 'files to index'
+
+    if len(paths) == 0:
+        sys.exit(0)
+
+    import ROOT
+    ROOT.gROOT.SetBatch(True)
+    ROOT.gSystem.Load('libPandaTreeObjects.so')
+    e = ROOT.panda.Event
+    ROOT.gROOT.LoadMacro(thisdir + '/EventPicker.cc+')
+
+    if args.numJobs > 1 and len(paths) > 1:
+        pool = multiprocessing.Pool(min(args.numJobs, len(paths)))
+        results = pool.imap_unordered(_indexFile, paths)
+    else:
+        pool = None
+        results = (_indexFile(path) for path in paths)
+
+    for ifile, (path, blocks) in enumerate(results):
+        if blocks is None:
+            print 'Could not index', path
+            continue
+
+        # database writes only from the main process
+        index.addFile(path, blocks)
+
+        if ifile % 100 == 0:
+            print ifile, '/', len(paths)
+
+    if pool is not None:
+        pool.close()
+        pool.join()
@@ -14,6 +14,7 @@
 #include <iostream>
 #include <functional>
 #include <fstream>
+#include <algorithm>
 
 #include "fastjet/internal/base.hh"
 #include "fastjet/PseudoJet.hh"
@@ -25,6 +26,66 @@
 // Base
 //--------------------------------------------------------------------
 
+namespace {
+  template<class C>
+  void
+  copyCollection(C const& _source, C& _target)
+  {
+    _target.clear();
+    for (auto& obj : _source)
+      _target.push_back(obj);
+  }
+}
+
+unsigned
+OperatorCache::slot(TString const& _key)
+{
+  auto itr(slots_.find(_key));
+  if (itr != slots_.end()) {
+    ++users_[itr->second];
+    return itr->second;
+  }
+
+  unsigned slot(states_.size());
+  slots_.emplace(_key, slot);
+  states_.push_back(kUnknown);
+  leaders_.push_back(0);
+  users_.push_back(1);
+  return slot;
+}
+
+TString
+Operator::setResultCache(OperatorCache& _cache, TString const& _chainKey)
+{
+  cache_ = 0;
+
+  TString key(cacheKey_());
+  if (key.Length() == 0)
+    return "";
+
+  if (usesOutEvent_()) {
+    // the result depends on what the preceding operators did to the output event
+    if (_chainKey.Length() == 0)
+      return "";
+
+    key = _chainKey + "/" + key;
+
+    cache_ = &_cache;
+    cacheSlot_ = _cache.slot(key);
+
+    return key;
+  }
+  else {
+    cache_ = &_cache;
+    cacheSlot_ = _cache.slot(key);
+
+    if (_chainKey.Length() == 0)
+      return "";
+
+    return _chainKey + "/" + key;
+  }
+}
+
 TString
 Cut::expr() const
 {
@@ -37,14 +98,40 @@ Cut::expr() const
 bool
 Cut::exec(panda::EventMonophoton const& _event, panda::EventBase& _outEvent)
 {
-  result_ = pass(_event, static_cast<panda::EventMonophoton&>(_outEvent));
+  auto& outEvent(static_cast<panda::EventMonophoton&>(_outEvent));
+
+  if (cache_ && cache_->get(cacheSlot_) != OperatorCache::kUnknown) {
+    result_ = cache_->get(cacheSlot_) == OperatorCache::kPass;
+    restoreResult_(*cache_->leader(cacheSlot_), outEvent);
+  }
+  else {
+    result_ = pass(_event, outEvent);
+    if (cache_) {
+      cache_->set(cacheSlot_, result_, this);
+      if (cache_->shared(cacheSlot_))
+        saveResult_(outEvent);
+    }
+  }
+
   return ignoreDecision_ || result_;
 }
 
 bool
 Modifier::exec(panda::EventMonophoton const& _event, panda::EventBase& _outEvent)
 {
-  apply(_event, static_cast<panda::EventMonophoton&>(_outEvent));
+  auto& outEvent(static_cast<panda::EventMonophoton&>(_outEvent));
+
+  if (cache_ && cache_->get(cacheSlot_) != OperatorCache::kUnknown)
+    restoreResult_(*cache_->leader(cacheSlot_), outEvent);
+  else {
+    apply(_event, outEvent);
+    if (cache_) {
+      cache_->set(cacheSlot_, true, this);
+      if (cache_->shared(cacheSlot_))
+        saveResult_(outEvent);
+    }
+  }
+
   return true;
 }
 
@@ -409,6 +496,8 @@ PhotonSelection::addBranches(TTree& _skimTree)
 void
 PhotonSelection::addInputBranch(panda::utils::BranchList& _blist)
 {
+  _blist += {"photons", "superClusters"};
+
   bool hasPF(false);
   for (auto& sel : selections_) {
     if (sel.second[ChargedPFVeto]) {
@@ -581,6 +670,43 @@ PhotonSelection::pass(panda::EventMonophoton const& _event, panda::EventMonophot
   return _outEvent.photons.size() >= nPhotons_;
 }
 
+TString
+PhotonSelection::cacheKey_() const
+{
+  TString key(TString::Format("PhotonSelection:%.17g:%.17g:%d:%u:%u:%d:%d", minPt_, maxPt_, int(idTune_), wp_, nPhotons_, includeLowPt_, useOriginalPt_));
+  for (auto& sel : selections_)
+    key += TString::Format(":S%d_%lu", sel.first, sel.second.to_ulong());
+  for (auto& sel : vetoes_)
+    key += TString::Format(":V%d_%lu", sel.first, sel.second.to_ulong());
+
+  return key;
+}
+
+void
+PhotonSelection::saveResult_(panda::EventMonophoton const& _outEvent)
+{
+  copyCollection(_outEvent.photons, sharedPhotons_);
+}
+
+void
+PhotonSelection::restoreResult_(Operator const& _leader, panda::EventMonophoton& _outEvent)
+{
+  auto& leader(static_cast<PhotonSelection const&>(_leader));
+
+  copyCollection(leader.sharedPhotons_, _outEvent.photons);
+
+  size_ = leader.size_;
+  for (unsigned iC(0); iC != nSelections; ++iC)
+    std::copy_n(leader.cutRes_[iC], size_, cutRes_[iC]);
+
+  unsigned nP(_outEvent.photons.size());
+  std::copy_n(leader.ptVarUp_, nP, ptVarUp_);
+  std::copy_n(leader.ptVarDown_, nP, ptVarDown_);
+  std::copy_n(leader.chargedPFVeto_, nP, chargedPFVeto_);
+
+  nominalResult_ = leader.nominalResult_;
+}
+
 int
 PhotonSelection::selectPhoton(panda::XPhoton const& _photon, unsigned _idx)
 {
@@ -729,6 +855,18 @@ TauVeto::pass(panda::EventMonophoton const& _event, panda::EventMonophoton& _out
   return !hasNonOverlapping;
 }
 
+void
+TauVeto::saveResult_(panda::EventMonophoton const& _outEvent)
+{
+  copyCollection(_outEvent.taus, sharedTaus_);
+}
+
+void
+TauVeto::restoreResult_(Operator const& _leader, panda::EventMonophoton& _outEvent)
+{
+  copyCollection(static_cast<TauVeto const&>(_leader).sharedTaus_, _outEvent.taus);
+}
+
 //--------------------------------------------------------------------
 // LeptonMt
 //--------------------------------------------------------------------
@@ -978,6 +1116,12 @@ BjetVeto::pass(panda::EventMonophoton const& _event, panda::EventMonophoton& _ou
   return !hasNonOverlapping;
 }
 
+void
+BjetVeto::restoreResult_(Operator const& _leader, panda::EventMonophoton&)
+{
+  copyCollection(static_cast<BjetVeto const&>(_leader).bjets_, bjets_);
+}
+
 //--------------------------------------------------------------------
 // PhotonMetDPhi
 //--------------------------------------------------------------------
@@ -1345,6 +1489,30 @@ LeptonSelection::pass(panda::EventMonophoton const& _event, panda::EventMonophot
     return _outEvent.electrons.size() >= nEl_ && _outEvent.muons.size() >= nMu_ && nLooseIsoMuons >= nMu_;
 }
 
+TString
+LeptonSelection::cacheKey_() const
+{
+  return TString::Format("LeptonSelection:%d:%d:%d:%d:%d:%u:%u", strictMu_, strictEl_, requireMedium_, mediumBtoF_, requireTight_, nEl_, nMu_);
+}
+
+void
+LeptonSelection::saveResult_(panda::EventMonophoton const& _outEvent)
+{
+  copyCollection(_outEvent.muons, sharedMuons_);
+  copyCollection(_outEvent.electrons, sharedElectrons_);
+}
+
+void
+LeptonSelection::restoreResult_(Operator const& _leader, panda::EventMonophoton& _outEvent)
+{
+  auto& leader(static_cast<LeptonSelection const&>(_leader));
+
+  copyCollection(leader.sharedMuons_, _outEvent.muons);
+  copyCollection(leader.sharedElectrons_, _outEvent.electrons);
+  copyCollection(*leader.failingMuons_, *failingMuons_);
+  copyCollection(*leader.failingElectrons_, *failingElectrons_);
+}
+
 //--------------------------------------------------------------------
 // FakeElectron
 //--------------------------------------------------------------------
@@ -2265,6 +2433,24 @@ JetCleaning::apply(panda::EventMonophoton const& _event, panda::EventMonophoton&
   }
 }
 
+TString
+JetCleaning::cacheKey_() const
+{
+  return TString::Format("JetCleaning:%lu:%.17g:%d:%d", cleanAgainst_.to_ulong(), minPt_, useTightWP_, puidWP_);
+}
+
+void
+JetCleaning::saveResult_(panda::EventMonophoton const& _outEvent)
+{
+  copyCollection(_outEvent.jets, sharedJets_);
+}
+
+void
+JetCleaning::restoreResult_(Operator const& _leader, panda::EventMonophoton& _outEvent)
+{
+  copyCollection(static_cast<JetCleaning const&>(_leader).sharedJets_, _outEvent.jets);
+}
+
 //--------------------------------------------------------------------
 // PhotonJetDPhi
 //--------------------------------------------------------------------
@@ -2341,6 +2527,19 @@ CopyMet::apply(panda::EventMonophoton const& _event, panda::EventMonophoton& _ou
     _outEvent.t1Met = _event.metMuOnlyFix;
   }
 }
+
+void
+CopyMet::saveResult_(panda::EventMonophoton const& _outEvent)
+{
+  sharedMet_ = _outEvent.t1Met;
+}
+
+void
+CopyMet::restoreResult_(Operator const& _leader, panda::EventMonophoton& _outEvent)
+{
+  _outEvent.t1Met = static_cast<CopyMet const&>(_leader).sharedMet_;
+}
+
 //--------------------------------------------------------------------
 // CopySuperClusters
 //--------------------------------------------------------------------
@@ -2377,6 +2576,24 @@ CopySuperClusters::apply(panda::EventMonophoton const& _event, panda::EventMonop
   }
 }
 
+void
+CopySuperClusters::saveResult_(panda::EventMonophoton const& _outEvent)
+{
+  copyCollection(_outEvent.superClusters, sharedSuperClusters_);
+  copyCollection(_outEvent.photons, sharedPhotons_);
+  copyCollection(_outEvent.electrons, sharedElectrons_);
+}
+
+void
+CopySuperClusters::restoreResult_(Operator const& _leader, panda::EventMonophoton& _outEvent)
+{
+  auto& leader(static_cast<CopySuperClusters const&>(_leader));
+
+  copyCollection(leader.sharedSuperClusters_, _outEvent.superClusters);
+  copyCollection(leader.sharedPhotons_, _outEvent.photons);
+  copyCollection(leader.sharedElectrons_, _outEvent.electrons);
+}
+
 //--------------------------------------------------------------------
 // AddTrailingPhotons
 //--------------------------------------------------------------------
@@ -2924,6 +3141,24 @@ MetVariations::apply(panda::EventMonophoton const& _event, panda::EventMonophoto
   // }
 }
 
+TString
+MetVariations::cacheKey_() const
+{
+  // only the pt variation of the photon selection is used
+  return TString::Format("MetVariations:%d:%d", int(metSource_), photonSel_ ? int(photonSel_->getUseOriginalPt()) : -1);
+}
+
+void
+MetVariations::restoreResult_(Operator const& _leader, panda::EventMonophoton&)
+{
+  auto& leader(static_cast<MetVariations const&>(_leader));
+
+  metGECUp_ = leader.metGECUp_;
+  phiGECUp_ = leader.phiGECUp_;
+  metGECDown_ = leader.metGECDown_;
+  phiGECDown_ = leader.phiGECDown_;
+}
+
 //--------------------------------------------------------------------
 // ConstantWeight
 //--------------------------------------------------------------------
@@ -3660,7 +3895,7 @@ JetScore::apply(panda::EventMonophoton const& _event, panda::EventMonophoton& _o
 void
 LeptonVertex::addInputBranch(panda::utils::BranchList& _blist)
 {
-  _blist += {"pfCandidates"};
+  _blist += {"pfCandidates", "vertices"};
 }
 
 void
@@ -3922,7 +4157,7 @@ TPLeptonPhoton::addBranches(TTree& _skimTree)
 void
 TPLeptonPhoton::addInputBranch(panda::utils::BranchList& _blist)
 {
-  _blist += {"pfCandidates"};
+  _blist += {"electrons", "muons", "photons", "superClusters", "pfCandidates"};
 }
 
 bool
@@ -110,6 +110,38 @@ const UInt_t NMAX_PARTICLES = 128;
 // Base classes
 //--------------------------------------------------------------------
 
+class Operator;
+
+class OperatorCache {
+  // Per-event store of operator results shared among selectors.
+  // Each distinct cache key (operator class + configuration, prefixed with the keys of the preceding operators
+  // for operators that use the output event) is assigned a slot at initialization.
+ public:
+  enum State {
+    kUnknown,
+    kFail,
+    kPass
+  };
+
+  unsigned slot(TString const& key);
+  // Drop all slots (before the operators are registered again)
+  void reset() { slots_.clear(); states_.clear(); leaders_.clear(); users_.clear(); }
+  void clear() { states_.assign(states_.size(), kUnknown); }
+  State get(unsigned slot) const { return State(states_[slot]); }
+  // Record the result of the operator that executed first in the event
+  void set(unsigned slot, bool result, Operator const* leader) { states_[slot] = result ? kPass : kFail; leaders_[slot] = leader; }
+  Operator const* leader(unsigned slot) const { return leaders_[slot]; }
+  // True if more than one operator is registered to the slot
+  bool shared(unsigned slot) const { return users_[slot] > 1; }
+  unsigned size() const { return states_.size(); }
+
+ private:
+  std::map<TString, unsigned> slots_{};
+  std::vector<unsigned char> states_{};
+  std::vector<Operator const*> leaders_{};
+  std::vector<unsigned> users_{};
+};
+
 class Operator {
  public:
   Operator(char const* name) : name_(name) {}
@@ -119,19 +151,49 @@ class Operator {
 
   virtual bool exec(panda::EventMonophoton const&, panda::EventBase&) = 0;
 
+  // Declare the input (panda::Event) branches read from the input event. Skimmer reads only the union of
+  // the declarations of all operators and selectors; collections filled into the output event by an
+  // earlier operator need no declaration. genParticles are always read for MC.
   virtual void addInputBranch(panda::utils::BranchList&) {}
   virtual void addBranches(TTree& skimTree) {}
   virtual void initialize(panda::EventMonophoton&) {}
 
   virtual void registerCut(TTree&) {}
+  // Address of the cut decision for cutflow bookkeeping; null for operators that are not cuts
+  virtual bool const* cutResult() const { return 0; }
+  // Register to the shared result cache. chainKey identifies the output event state before this operator
+  // (class of the selector + keys of the preceding operators; empty if the state cannot be identified).
+  // Returns the chain key for the next operator.
+  TString setResultCache(OperatorCache&, TString const& chainKey);
+  void unsetResultCache() { cache_ = 0; }
+  // Lazy evaluation: skip() is called instead of exec() when an earlier cut has already failed.
+  // Applied only when the selector records no cut results (cutflow mode none).
+  // Operators that must see every event (e.g. consume random numbers) return false from skippable().
+  virtual bool skippable() const { return true; }
+  virtual void skip() {}
 
   void setPrintLevel(unsigned l) { printLevel_ = l; }
   void setOutputStream(std::ostream& st) { stream_ = &st; }
 
  protected:
+  // Operators whose result depends only on the input event and their own configuration can return a
+  // non-empty key (class name + settings). Results are then computed once per event and shared.
+  virtual TString cacheKey_() const { return ""; }
+  // Operators that also read or write the output event return true. Their results are shared only among
+  // selectors with identical chains of keyed operators before them.
+  virtual bool usesOutEvent_() const { return false; }
+  // Store the output of the operator for the other selectors (called after execution if the result is shared)
+  virtual void saveResult_(panda::EventMonophoton const&) {}
+  // Called instead of the execution when the result is taken from the cache. leader is the operator of the
+  // same class and configuration that executed first in the event.
+  virtual void restoreResult_(Operator const& leader, panda::EventMonophoton&) {}
+
   TString name_;
   unsigned printLevel_{0};
   std::ostream* stream_{&std::cout};
+
+  OperatorCache* cache_{0};
+  unsigned cacheSlot_{0};
 };
 
 class Cut : public Operator {
@@ -145,6 +207,8 @@ class Cut : public Operator {
   void setIgnoreDecision(bool b) { ignoreDecision_ = b; }
 
   void registerCut(TTree& cutsTree) override { cutsTree.Branch(name_, &result_, name_ + "/O"); }
+  bool const* cutResult() const override { return &result_; }
+  void skip() override { result_ = false; }
 
  protected:
   virtual bool pass(panda::EventMonophoton const&, panda::EventMonophoton&) = 0;
@@ -177,6 +241,8 @@ class TPCut : public Operator {
   void setIgnoreDecision(bool b) { ignoreDecision_ = b; }
 
   void registerCut(TTree& cutsTree) override { cutsTree.Branch(name_, &result_, name_ + "/O"); }
+  bool const* cutResult() const override { return &result_; }
+  void skip() override { result_ = false; }
 
  protected:
   virtual bool pass(panda::EventMonophoton const&, panda::EventTP&) = 0;
@@ -209,9 +275,12 @@ class HLTFilter : public Cut {
 
   void initialize(panda::EventMonophoton& _event) override;
   void addBranches(TTree& skimTree) override;
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"triggers"}; }
     
  protected:
   bool pass(panda::EventMonophoton const& _event, panda::EventMonophoton&) override;
+  TString cacheKey_() const override { return "HLTFilter:" + pathNames_; }
+  void restoreResult_(Operator const& leader, panda::EventMonophoton&) override { pass_ = static_cast<HLTFilter const&>(leader).pass_; }
 
   TString pathNames_{""};
   std::vector<UInt_t> tokens_;
@@ -241,8 +310,10 @@ class MetFilters : public Cut {
   MetFilters(char const* name = "MetFilters") : Cut(name) {}
 
   void allowHalo() { halo_ = true; }
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"metFilters"}; }
  protected:
   bool pass(panda::EventMonophoton const&, panda::EventMonophoton&) override;
+  TString cacheKey_() const override { return TString::Format("MetFilters:%d", halo_); }
 
   bool halo_{false};
 };
@@ -254,9 +325,11 @@ class GenPhotonVeto : public Cut {
 
   void setMinPt(double m) { minPt_ = m; }
   void setMinPartonDR(double m) { minPartonDR2_ = m * m; }
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"partons"}; }
 
  protected:
   bool pass(panda::EventMonophoton const&, panda::EventMonophoton&) override;
+  TString cacheKey_() const override { return TString::Format("GenPhotonVeto:%.17g:%.17g", minPt_, minPartonDR2_); }
 
   double minPt_{130.}; // minimum pt of the gen photon to be vetoed
   double minPartonDR2_{0.5 * 0.5}; // minimum dR wrt any parton of the gen photon to be vetoed
@@ -268,6 +341,7 @@ class PartonKinematics : public Modifier {
   PartonKinematics(char const* name = "PartonKinematics") : Modifier(name) {}
   
   void addBranches(TTree& skimTree) override;
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"partons"}; }
  protected:
   void apply(panda::EventMonophoton const&, panda::EventMonophoton&) override;
   
@@ -289,9 +363,11 @@ class PartonFlavor : public Cut {
 
   unsigned getRejectedPdgId() const { return rejectedId_; }
   unsigned getRequiredPdgId() const { return requiredId_; }
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"partons"}; }
 
  protected:
   bool pass(panda::EventMonophoton const&, panda::EventMonophoton&) override;
+  TString cacheKey_() const override { return TString::Format("PartonFlavor:%u:%u", rejectedId_, requiredId_); }
 
   unsigned rejectedId_{0};
   unsigned requiredId_{0};
@@ -362,6 +438,7 @@ class PhotonSelection : public Cut {
 
   void setIncludeLowPt(bool i) { includeLowPt_ = i; }
   void setUseOriginalPt(bool b) { useOriginalPt_ = b; }
+  bool getUseOriginalPt() const { return useOriginalPt_; }
 
   void setMinPt(double minPt) { minPt_ = minPt; }
   void setMaxPt(double maxPt) { maxPt_ = maxPt; }
@@ -372,6 +449,10 @@ class PhotonSelection : public Cut {
 
  protected:
   bool pass(panda::EventMonophoton const&, panda::EventMonophoton&) override;
+  TString cacheKey_() const override;
+  bool usesOutEvent_() const override { return true; }
+  void saveResult_(panda::EventMonophoton const&) override;
+  void restoreResult_(Operator const&, panda::EventMonophoton&) override;
   int selectPhoton(panda::XPhoton const&, unsigned idx);
 
   double minPt_{175.};
@@ -394,13 +475,22 @@ class PhotonSelection : public Cut {
   bool nominalResult_{false};
   std::vector<panda::PFCand const*> chargedCands_;
   bool chargedPFVeto_[NMAX_PARTICLES];
+
+  decltype(panda::EventMonophoton::photons) sharedPhotons_{"sharedPhotons"};
 };
 
 class TauVeto : public Cut {
  public:
   TauVeto(char const* name = "TauVeto") : Cut(name) {}
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"taus"}; }
  protected:
   bool pass(panda::EventMonophoton const&, panda::EventMonophoton&) override;
+  TString cacheKey_() const override { return "TauVeto"; }
+  bool usesOutEvent_() const override { return true; }
+  void saveResult_(panda::EventMonophoton const&) override;
+  void restoreResult_(Operator const&, panda::EventMonophoton&) override;
+
+  decltype(panda::EventMonophoton::taus) sharedTaus_{"sharedTaus"};
 };
 
 class LeptonMt : public Cut {
@@ -414,6 +504,7 @@ class LeptonMt : public Cut {
   void addBranches(TTree& skimTree) override;
 
   void setOnlyLeading(bool b) { onlyLeading_ = b; }
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"pfMet"}; }
 
  protected:
   bool pass(panda::EventMonophoton const&, panda::EventMonophoton&) override;
@@ -478,6 +569,9 @@ class BjetVeto : public Cut {
   void addBranches(TTree& skimTree) override;
  protected:
   bool pass(panda::EventMonophoton const&, panda::EventMonophoton&) override;
+  TString cacheKey_() const override { return "BjetVeto"; }
+  bool usesOutEvent_() const override { return true; }
+  void restoreResult_(Operator const&, panda::EventMonophoton&) override;
 
   panda::JetCollection bjets_;
 };
@@ -495,6 +589,7 @@ class PhotonMetDPhi : public Cut {
   void setMetSource(MetSource s) { metSource_ = s; }
   void setMetVariations(MetVariations* v) { metVar_ = v; }
   void invert(bool i) { invert_ = i; }
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"pfMet"}; }
  protected:
   bool pass(panda::EventMonophoton const&, panda::EventMonophoton&) override;
 
@@ -529,6 +624,7 @@ class JetMetDPhi : public Cut {
   void setPassIfIsolated(bool p) { passIfIsolated_ = p; }
   void setMetVariations(MetVariations* v) { metVar_ = v; }
   /* void setJetCleaning(JetCleaning* jcl) { jetCleaning_ = jcl; } */
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"pfMet"}; }
 
  protected:
   bool pass(panda::EventMonophoton const&, panda::EventMonophoton&) override;
@@ -565,9 +661,14 @@ class LeptonSelection : public Cut {
   void setRequireTight(bool require) { requireTight_ = require; }
   panda::MuonCollection* getFailingMuons() { return failingMuons_; }
   panda::ElectronCollection* getFailingElectrons() {return failingElectrons_; }
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"electrons", "muons"}; }
 
  protected:
   bool pass(panda::EventMonophoton const&, panda::EventMonophoton&) override;
+  TString cacheKey_() const override;
+  bool usesOutEvent_() const override { return true; }
+  void saveResult_(panda::EventMonophoton const&) override;
+  void restoreResult_(Operator const&, panda::EventMonophoton&) override;
 
   bool strictMu_{true};
   bool strictEl_{true};
@@ -579,6 +680,9 @@ class LeptonSelection : public Cut {
 
   panda::MuonCollection* failingMuons_{0};
   panda::ElectronCollection* failingElectrons_{0};
+
+  decltype(panda::EventMonophoton::muons) sharedMuons_{"sharedMuons"};
+  decltype(panda::EventMonophoton::electrons) sharedElectrons_{"sharedElectrons"};
 };
 
 class FakeElectron : public Cut {
@@ -586,6 +690,7 @@ class FakeElectron : public Cut {
   // Overlaps with photons are skipped
  public:
   FakeElectron(char const* name = "FakeElectron") : Cut(name) {}
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"electrons"}; }
 
  protected:
   bool pass(panda::EventMonophoton const&, panda::EventMonophoton&) override;
@@ -598,6 +703,7 @@ class Met : public Cut {
   void setMetSource(MetSource s) { metSource_ = s; }
   void setThreshold(double min) { min_ = min; }
   void setCeiling(double max) { max_ = max; }
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"pfMet"}; }
  protected:
   bool pass(panda::EventMonophoton const&, panda::EventMonophoton& outEvent) override;
 
@@ -613,6 +719,7 @@ class PhotonPtOverMet : public Cut {
   void setMetSource(MetSource s) { metSource_ = s; }
   void setThreshold(double min) { min_ = min; }
   void setCeiling(double max) { max_ = max; }
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"pfMet"}; }
  protected:
   bool pass(panda::EventMonophoton const&, panda::EventMonophoton& outEvent) override;
 
@@ -711,8 +818,10 @@ class PhotonPtTruncator : public Cut {
 
   void setPtMin(double min) { min_ = min; }
   void setPtMax(double max) { max_ = max; }
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"partons"}; }
  protected:
   bool pass(panda::EventMonophoton const&, panda::EventMonophoton&) override;
+  TString cacheKey_() const override { return TString::Format("PhotonPtTruncator:%.17g:%.17g", min_, max_); }
 
   double min_{0.};
   double max_{500.};
@@ -726,6 +835,7 @@ class HtTruncator : public Cut {
 
   void setHtMin(double min) { min_ = min; }
   void setHtMax(double max) { max_ = max; }
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"partons"}; }
  protected:
   bool pass(panda::EventMonophoton const&, panda::EventMonophoton&) override;
 
@@ -742,6 +852,7 @@ class GenBosonPtTruncator : public Cut {
 
   void setPtMin(double min) { min_ = min; }
   void setPtMax(double max) { max_ = max; }
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"partons"}; }
  protected:
   bool pass(panda::EventMonophoton const&, panda::EventMonophoton&) override;
 
@@ -776,6 +887,7 @@ class EcalCrackVeto : public Cut {
   EcalCrackVeto(char const* name = "EcalCrackVeto") : Cut(name) {}
   void addBranches(TTree& skimTree) override;
   void setMinPt(double minPt) { minPt_ = minPt; }
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"chsAK4Jets", "photons", "superClusters"}; }
 
  protected:
   bool pass(panda::EventMonophoton const&, panda::EventMonophoton&) override;
@@ -794,6 +906,7 @@ class TagAndProbePairZ : public Cut {
 
   unsigned getNUniqueZ() const { return nUniqueZ_; }
   float getPhiZ(unsigned idx) const { return tp_[idx].phi(); }
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"electrons", "muons", "photons", "superClusters"}; }
   
  protected:
   bool pass(panda::EventMonophoton const&, panda::EventMonophoton&) override;
@@ -898,6 +1011,7 @@ class ExtraPhotons : public Modifier {
  public:
   ExtraPhotons(char const* name = "ExtraPhotons") : Modifier(name) {}
   void setMinPt(double minPt) { minPt_ = minPt; }
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"photons", "superClusters"}; }
 
  protected:
   double minPt_{30.};
@@ -926,9 +1040,14 @@ class JetCleaning : public Modifier {
 
   static double const puidCuts[4][4][4]; // WP x pt x eta
   static bool passPUID(int wp, panda::Jet const& jet);
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"chsAK4Jets"}; }
 
  protected:
   void apply(panda::EventMonophoton const&, panda::EventMonophoton&) override;
+  TString cacheKey_() const override;
+  bool usesOutEvent_() const override { return true; }
+  void saveResult_(panda::EventMonophoton const&) override;
+  void restoreResult_(Operator const&, panda::EventMonophoton&) override;
   
   std::bitset<nCollections> cleanAgainst_{};
 
@@ -942,6 +1061,8 @@ class JetCleaning : public Modifier {
   double minPt_{30.};
   bool useTightWP_{false};
   int puidWP_{3}; // 0: loose, 1: medium, 2: tight, 3: some old WP
+
+  decltype(panda::EventMonophoton::jets) sharedJets_{"sharedJets"};
 };
 
 class PhotonJetDPhi : public Modifier {
@@ -965,23 +1086,41 @@ class CopyMet : public Modifier {
   CopyMet(char const* name = "CopyMet") : Modifier(name) {}
 
   void setUseGSFix(bool b) { useGSFix_ = b; }
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"pfMet", "metMuOnlyFix"}; }
  protected:
   void apply(panda::EventMonophoton const& event, panda::EventMonophoton& outEvent) override;
+  TString cacheKey_() const override { return TString::Format("CopyMet:%d", useGSFix_); }
+  bool usesOutEvent_() const override { return true; }
+  void saveResult_(panda::EventMonophoton const&) override;
+  void restoreResult_(Operator const&, panda::EventMonophoton&) override;
 
   bool useGSFix_{true};
+
+  decltype(panda::EventMonophoton::t1Met) sharedMet_{"sharedMet"};
 };
 
 class CopySuperClusters : public Modifier {
  public:
   CopySuperClusters(char const* name = "CopySuperClusters") : Modifier(name) {}
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"superClusters"}; }
  protected:
   void apply(panda::EventMonophoton const&, panda::EventMonophoton&) override;
+  TString cacheKey_() const override { return "CopySuperClusters"; }
+  bool usesOutEvent_() const override { return true; }
+  void saveResult_(panda::EventMonophoton const&) override;
+  void restoreResult_(Operator const&, panda::EventMonophoton&) override;
+
+  // superCluster references of the photons and electrons are updated too
+  decltype(panda::EventMonophoton::superClusters) sharedSuperClusters_{"sharedSuperClusters"};
+  decltype(panda::EventMonophoton::photons) sharedPhotons_{"sharedPhotons"};
+  decltype(panda::EventMonophoton::electrons) sharedElectrons_{"sharedElectrons"};
 };
 
 class AddTrailingPhotons : public Modifier {
   // Keep photons[0] and add all other loose photons to output
  public:
   AddTrailingPhotons(char const* name = "AddTrailingPhotons") : Modifier(name) {}
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"photons", "superClusters"}; }
   
  protected:
   void apply(panda::EventMonophoton const& event, panda::EventMonophoton& outEvent) override;
@@ -1046,6 +1185,8 @@ class PhotonFakeMet : public Modifier {
  public:
   PhotonFakeMet(char const* name = "PhotonFakeMet") : Modifier(name), rand_(12345) {}
   void addBranches(TTree& skimTree) override;
+  // random sequence must not depend on the decisions of preceding cuts
+  bool skippable() const override { return false; }
 
   void setFraction(float frac) { fraction_ = frac; }
 
@@ -1100,9 +1241,13 @@ class MetVariations : public Modifier {
   /* TVector2 jer() const { TVector2 v; v.SetMagPhi(metJER_, phiJER_); return v; } */
   /* TVector2 jerUp() const { TVector2 v; v.SetMagPhi(metJERUp_, phiJERUp_); return v; } */
   /* TVector2 jerDown() const { TVector2 v; v.SetMagPhi(metJERDown_, phiJERDown_); return v; } */
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"pfMet"}; }
 
  protected:
   void apply(panda::EventMonophoton const&, panda::EventMonophoton&) override;
+  TString cacheKey_() const override;
+  bool usesOutEvent_() const override { return true; }
+  void restoreResult_(Operator const&, panda::EventMonophoton&) override;
   
   PhotonSelection* photonSel_{0};
   JetCleaning* jetCleaning_{0};
@@ -1158,6 +1303,7 @@ class PhotonPtWeight : public Modifier {
   double getVariation(TString const& var) const { return *varWeights_.at(var); }
 
   void computeWeight(panda::EventMonophoton const&, panda::EventMonophoton const& _outEvent);
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"partons"}; }
 
  protected:
   void apply(panda::EventMonophoton const&, panda::EventMonophoton& _outEvent) override;
@@ -1191,6 +1337,7 @@ class PhotonPtWeightSigned : public Modifier {
   void addVariation(char const* tag, TObject* pcorr, TObject* ncorr);
   void setPhotonType(unsigned t);
   void useErrors(bool); // use errors of the nominal histogram weight for Up/Down variation
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"partons"}; }
  protected:
   void apply(panda::EventMonophoton const&, panda::EventMonophoton& _outEvent) override;
   
@@ -1232,6 +1379,7 @@ class IDSFWeight : public Modifier {
   void setNParticles(unsigned _nP) { nParticles_ = _nP; }
   void addFactor(TH1* factor) { factors_.emplace_back(factor); }
   void addCustomCollection(panda::ParticleCollection* coll) { customCollection_ = coll; }
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"npvTrue"}; }
  protected:
   void applyParticle(unsigned iP, panda::EventMonophoton const& _event, panda::EventMonophoton& _outEvent);
   void apply(panda::EventMonophoton const&, panda::EventMonophoton& _outEvent) override;
@@ -1251,6 +1399,7 @@ class NPVWeight : public Modifier {
  // DEPRECATED - USE PUWeight
  public:
   NPVWeight(TH1* factors, char const* name = "NPVWeight") : Modifier(name), factors_(factors) {}
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"npv"}; }
  protected:
   void apply(panda::EventMonophoton const&, panda::EventMonophoton& _outEvent) override;
 
@@ -1264,6 +1413,7 @@ class VtxAdjustedJetProxyWeight : public PhotonPtWeight {
   void setRCProb(TH2* distribution, double chIsoCut);
 
   void addBranches(TTree& skimTree) override;
+  void addInputBranch(panda::utils::BranchList& blist) override { PhotonPtWeight::addInputBranch(blist); blist += {"vertices"}; }
 
  protected:
   void apply(panda::EventMonophoton const&, panda::EventMonophoton& _outEvent) override;
@@ -1287,6 +1437,7 @@ class NNPDFVariation : public Modifier {
 
   void setRescale(double scale) { rescale_ = scale; }
   void addBranches(TTree& skimTree) override;
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"genReweight"}; }
  protected:
   void apply(panda::EventMonophoton const&, panda::EventMonophoton& _outEvent) override;
 
@@ -1300,6 +1451,7 @@ class GJetsDR : public Modifier {
   GJetsDR(char const* name = "GJetsDR") : Modifier(name) {}
 
   void addBranches(TTree& skimTree) override;
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"partons"}; }
  protected:
   void apply(panda::EventMonophoton const&, panda::EventMonophoton& _outEvent) override;
 
@@ -1396,6 +1548,7 @@ class PUWeight : public Operator {
   void addBranches(TTree& _skimTree) override;
 
   bool exec(panda::EventMonophoton const&, panda::EventBase&) override;
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"npvTrue"}; }
 
  protected:
   TH1* factors_;
@@ -1444,6 +1597,7 @@ class TPDilepton : public TPCut {
   void setMinProbePt(double d) { minProbePt_ = d; }
   void setMinTagPt(double d) { minTagPt_ = d; }
   void setTagTriggerMatch(bool b) { tagTriggerMatch_ = b; }
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"electrons", "muons"}; }
   
  protected:
   bool pass(panda::EventMonophoton const&, panda::EventTP&) override;
@@ -1464,6 +1618,7 @@ class TPLeptonVeto : public TPCut {
 
   void setVetoElectrons(bool b) { vetoElectrons_ = b; }
   void setVetoMuons(bool b) { vetoMuons_ = b; }
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"electrons", "muons"}; }
 
  protected:
   bool pass(panda::EventMonophoton const&, panda::EventTP&) override;
@@ -1483,6 +1638,7 @@ class TPJetCleaning : public TPModifier {
   ~TPJetCleaning() {}
 
   void setMinPt(double min) { minPt_ = min; }
+  void addInputBranch(panda::utils::BranchList& blist) override { blist += {"chsAK4Jets"}; }
   
  protected:
   void apply(panda::EventMonophoton const&, panda::EventTP&) override;
@@ -6,6 +6,7 @@ import re
 import tempfile
 
 from batch import BatchManager
+from eventindex import EventIndex, eventIndexPath
 
 ## load condor-run
 sys.path.append('/home/yiiyama/lib')
@@ -77,18 +78,44 @@ class PickEvent(object):
         skimmer.setPrintEvery(PickEvent.config['printEvery'])
         skimmer.setPrintLevel(PickEvent.config['printLevel'])
     
+        paths = []
         if self.manual:
-            for path in self.files:
-                skimmer.addPath(path)
+            paths = list(self.files)
         else:
             for fileset in self.filesets:
-                for path in self.sample.files([fileset]):
-                    if PickEvent.config['readRemote']:
-                        if not os.path.exists(path) or os.stat(path).st_size == 0:
-                            path = path.replace('/mnt/hadoop/cms', 'root://xrootd.cmsaf.mit.edu/')
-        
-                    logger.debug('Add input: %s %s', fileset, path)
-                    skimmer.addPath(path)
+                paths.extend(self.sample.files([fileset]))
+
+        inputPaths = {}
+        for path in paths:
+            inputPath = path
+            if not self.manual and PickEvent.config['readRemote']:
+                if not os.path.exists(path) or os.stat(path).st_size == 0:
+                    inputPath = path.replace('/mnt/hadoop/cms', 'root://xrootd.cmsaf.mit.edu/')
+
+            inputPaths[path] = inputPath
+
+        indexed = set()
+        if PickEvent.config['indexPath']:
+            # with the event index, only the entry blocks of the requested lumis are read
+            index = EventIndex(PickEvent.config['indexPath'])
+            indexed = index.indexed(paths)
+
+            ranges = set()
+            for run, lumi, event in self.eventIds:
+                for path, first, last in index.lookup(run, lumi):
+                    if path in indexed:
+                        ranges.add((path, first, last))
+
+            for path, first, last in sorted(ranges):
+                logger.debug('Add input: %s %d-%d', inputPaths[path], first, last)
+                skimmer.addEntryRange(inputPaths[path], first, last)
+
+            logger.info('%d/%d input files indexed', len(indexed), len(paths))
+
+        for path in paths:
+            if path not in indexed:
+                logger.debug('Add input: %s', inputPaths[path])
+                skimmer.addPath(inputPaths[path])
 
         for eventId in self.eventIds:
             skimmer.addEvent(*eventId)
@@ -183,6 +210,7 @@ if __name__ == '__main__':
     argParser.add_argument('--read-remote', '-R', action = 'store_true', dest = 'readRemote', help = 'Read from root://xrootd.cmsaf.mit.edu if a local copy of the file does not exist.')
     argParser.add_argument('--resubmit', '-S', action = 'store_true', dest = 'autoResubmit', help = '(Without no-wait option) Automatically release held jobs.')
     argParser.add_argument('--skip-missing', '-K', action = 'store_true', dest = 'skipMissing', help = 'Skip missing files in skim.')
+    argParser.add_argument('--index', '-x', metavar = 'PATH', dest = 'indexPath', default = eventIndexPath, help = 'Event index database built by eventindex.py. Set to empty string to scan all files.')
     argParser.add_argument('--uw-format', '-U', action = 'store_true', dest = 'uwFormat', help = 'Print event list in run:event:lumi format.')
     
     args = argParser.parse_args()
@@ -7,12 +7,13 @@ import math
 import re
 import collections
 
+import numpy
 import ROOT
 
-def makePlotter(sourceName, plotConfig, group, sample, lumi, printLevel):
-    global ROOT
-    plotter = ROOT.MultiDraw()
-    plotter.addInputPath(sourceName)
+def getSelections(plotConfig, group):
+    """
+    Return the (baseline, full) selection strings for the group.
+    """
 
     cuts = []
     if plotConfig.baseline.strip():
@@ -21,14 +22,27 @@ def makePlotter(sourceName, plotConfig, group, sample, lumi, printLevel):
         else:
             cuts.append('(' + plotConfig.baseline.strip() + ')')
 
-    baseSel = ' && '.join(cuts)
+    return ' && '.join(cuts), plotConfig.fullSelection.strip()
+
+
+def makePlotter(sourceName, plotConfig, group, sample, lumi, printLevel, numThreads = 1, compileFormulas = False, selections = None):
+    global ROOT
+    plotter = ROOT.MultiDraw()
+    plotter.addInputPath(sourceName)
+    # must be set before any formula is added
+    plotter.setCompileFormulas(compileFormulas)
+
+    if selections is None:
+        baseSel, fullSel = getSelections(plotConfig, group)
+    else:
+        baseSel, fullSel = selections
 
     if printLevel > 0:
         print '      Baseline selection:', baseSel
-        print '      Full selection:', plotConfig.fullSelection.strip()
+        print '      Full selection:', fullSel
 
     plotter.setBaseSelection(baseSel)
-    plotter.setFullSelection(plotConfig.fullSelection.strip())
+    plotter.setFullSelection(fullSel)
 
     if not sample.data:
         plotter.setConstantWeight(lumi)
@@ -37,19 +51,400 @@ def makePlotter(sourceName, plotConfig, group, sample, lumi, printLevel):
         plotter.setPrescale(plotConfig.prescales[sample])
 
     plotter.setPrintLevel(printLevel)
+    plotter.setNumThreads(numThreads)
 
     return plotter
     
 
-def fillPlots(plotConfig, group, plotdefs, sourceDir, outFile, lumi = 0., postscale = 1., printLevel = 0, altSourceDir = ''):
+class PlotSpec(object):
+    """
+    Arguments of a MultiDraw.addPlot call for one histogram.
+    If nominal is set, the plot differs from the nominal PlotSpec only by the reweight and can be
+    filled as its weight variation.
+    """
+
+    def __init__(self, plotdef, hist, expr, cut, applyBaseline, applyFullSel, reweight, overflowMode, nominal = None):
+        self.plotdef = plotdef
+        self.hist = hist
+        self.expr = expr
+        self.cut = cut
+        self.applyBaseline = applyBaseline
+        self.applyFullSel = applyFullSel
+        self.reweight = reweight
+        self.overflowMode = overflowMode
+        self.nominal = nominal
+
+    def addTo(self, plotter, hist = None):
+        if hist is None:
+            hist = self.hist
+
+        plotter.addPlot(hist, self.expr, self.cut, self.applyBaseline, self.applyFullSel, self.reweight, self.overflowMode)
+
+    def addFoldedTo(self, plotter, baseSel, fullSel, hist = None):
+        """
+        Add the plot with the given baseline and full selections included in its cut. Used when the plotter
+        is shared with plots of other configs whose selections differ.
+        """
+
+        if hist is None:
+            hist = self.hist
+
+        cuts = []
+        if self.applyBaseline:
+            if baseSel:
+                cuts.append('(' + baseSel + ')')
+            if self.applyFullSel and fullSel:
+                cuts.append('(' + fullSel + ')')
+        if self.cut:
+            cuts.append('(' + self.cut + ')')
+
+        plotter.addPlot(hist, self.expr, ' && '.join(cuts), False, False, self.reweight, self.overflowMode)
+
+    def addColumnsTo(self, plotter, tree):
+        """
+        Add a tree with branches x (the expression) and weight, to be saved in the column cache.
+        """
+
+        plotter.addTree(tree, self.cut, self.applyBaseline, self.applyFullSel, self.reweight)
+        plotter.addTreeBranch(tree, 'x', self.expr)
+
+
+def bookSample(plotConfig, group, sample, plotdefs, region, sourceDir, outFile, histograms, altSourceDir = ''):
+    """
+    Create the histograms of one sample and collect the plot specifications.
+    Returns {source file name: [PlotSpec]}.
+    """
+
+    dname = sample.name + '_' + region
+
+    sourceName = utils.getSkimPath(sample.name, region, sourceDir, altSourceDir)
+
+    specs = collections.OrderedDict([(sourceName, [])]) # additional sources for variations of sample type
+
+    for plotdef in plotdefs:
+        if not outFile.GetDirectory(plotdef.name):
+            outFile.mkdir(plotdef.name)
+
+        outDir = outFile.GetDirectory(plotdef.name + '/samples')
+        if not outDir:
+            outDir = outFile.GetDirectory(plotdef.name).mkdir('samples')
+
+        hist = plotdef.makeHist(dname, outDir = outDir)
+        histograms[(sample, plotdef, None, None)] = hist
+
+        if group == plotConfig.obs and plotdef.fullyBlinded():
+            continue
+
+        if sample.data and plotdef.mcOnly:
+            continue
+
+        plotCuts = []
+
+        if plotdef.cut.strip():
+            plotCuts.append('(' + plotdef.cut.strip() + ')')
+
+        if group.cut.strip():
+            plotCuts.append('(' + group.cut.strip() + ')' )
+
+        cut = ' && '.join(plotCuts)
+
+        if plotdef.overflow:
+            overflowMode = ROOT.Plot.kMergeLast
+        else:
+            overflowMode = ROOT.Plot.kNoOverflowBin
+
+        # nominal distribution
+        nominalSpec = PlotSpec(
+            plotdef,
+            hist,
+            plotdef.formExpression(),
+            cut.strip(),
+            plotdef.applyBaseline,
+            plotdef.applyFullSel,
+            '',
+            overflowMode
+        )
+        specs[sourceName].append(nominalSpec)
+
+        # systematic variations
+        for variation in group.variations:
+            for iv, direction in [(0, 'Up'), (1, 'Down')]:
+                hist = plotdef.makeHist(dname + '_' + variation.name + direction, outDir = outDir)
+                histograms[(sample, plotdef, variation, direction)] = hist
+
+                if type(variation.reweight) is str:
+                    reweight = 'reweight_' + variation.reweight + direction
+                elif type(variation.reweight) is float:
+                    reweight = str(1. + variation.reweight * (1. - 2. * iv))
+                else:
+                    reweight = ''
+
+                plotCuts = []
+                if variation.cuts is not None:
+                    # variation cuts override the plotdef cut
+                    plotCuts.append('(' + variation.cuts[iv].strip() + ')')
+                elif group.cut.strip():
+                    plotCuts.append('(' + group.cut.strip() + ')')
+
+                if plotdef.cut.strip():
+                    plotCuts.append('(' + plotdef.cut.strip() + ')')
+
+                cut = ' && '.join(plotCuts)
+
+                if variation.replacements is not None:
+                    expr = plotdef.formExpression(variation.replacements[iv])
+                else:
+                    expr = plotdef.formExpression()
+
+                if variation.regions is not None:
+                    varSourceName = utils.getSkimPath(sample.name, variation.regions[iv], sourceDir, altSourceDir)
+                else:
+                    varSourceName = sourceName
+
+                if varSourceName not in specs:
+                    specs[varSourceName] = []
+
+                if variation.cuts is None and variation.replacements is None and variation.regions is None:
+                    # pure reweight variation; same expression, cuts, and source as the nominal
+                    nominal = nominalSpec
+                else:
+                    nominal = None
+
+                specs[varSourceName].append(PlotSpec(
+                    plotdef,
+                    hist,
+                    expr,
+                    cut.strip(),
+                    plotdef.applyBaseline,
+                    plotdef.applyFullSel,
+                    reweight,
+                    overflowMode,
+                    nominal = nominal
+                ))
+
+    return specs
+
+
+def runFills(task, plotConfig, group, lumi, printLevel, numThreads = 1, compileFormulas = False, columnCache = '', hists = None):
+    """
+    Fill all histograms of a task (sample, source file name, [PlotSpec]) in one pass.
+    Optionally the histograms to fill can be overridden by hists (list aligned with the specs).
+    With columnCache, 1D histograms are filled from the cached columns, and only the columns
+    missing from the cache are extracted from the source.
+    """
+
+    sample, sourceName, specs = task
+
+    if hists is None:
+        hists = [spec.hist for spec in specs]
+
+    plotter = makePlotter(sourceName, plotConfig, group, sample, lumi, printLevel, numThreads, compileFormulas)
+
+    keys = [None] * len(specs)
+    if columnCache:
+        cache = ColumnCache(columnCache)
+
+        baseSel, fullSel = getSelections(plotConfig, group)
+        if sample.data:
+            weightKey = (None, plotConfig.prescales[sample] if group == plotConfig.obs else 1)
+        else:
+            weightKey = (lumi, 1)
+
+        for ispec, spec in enumerate(specs):
+            if hists[ispec].GetDimension() == 1:
+                keys[ispec] = cache.makeKey(sourceName, baseSel, fullSel, weightKey, spec.expr, spec.cut, spec.applyBaseline, spec.applyFullSel, spec.reweight)
+
+    trees = {} # {key: tree}
+    added = {} # {PlotSpec: histogram} added to the plotter
+    for ispec, spec in enumerate(specs):
+        key = keys[ispec]
+        if key is None:
+            if spec.nominal in added:
+                # filled in the same expression and cut evaluation as the nominal plot
+                plotter.addWeightVariation(added[spec.nominal], hists[ispec], spec.reweight)
+            else:
+                spec.addTo(plotter, hists[ispec])
+                added[spec] = hists[ispec]
+
+        elif key not in trees and not cache.exists(key):
+            tree = ROOT.TTree('columns%d' % ispec, '')
+            tree.SetDirectory(0)
+            spec.addColumnsTo(plotter, tree)
+            trees[key] = tree
+
+    if plotter.numObjs() != 0:
+        plotter.fillPlots()
+
+    for key, tree in trees.iteritems():
+        cache.save(key, tree)
+
+    for ispec, spec in enumerate(specs):
+        if keys[ispec] is not None:
+            cache.fill(keys[ispec], hists[ispec], spec.overflowMode)
+
+
+# task list and fill arguments shared with the worker processes (inherited at fork)
+_fillTasks = []
+_fillArgs = {}
+
+def _runFillTask(itask):
+    """
+    Worker process function. Fills clones of the task histograms and saves them to a temporary file.
+    """
+
+    task = _fillTasks[itask]
+
+    if _fillArgs['merged']:
+        specs = mergedSpecs(task)
+    else:
+        _, _, specs = task
+
+    tmpPath = _fillArgs['tmpDir'] + '/task%d.root' % itask
+    tmpFile = ROOT.TFile.Open(tmpPath, 'recreate')
+
+    hists = []
+    for ispec, spec in enumerate(specs):
+        hist = spec.hist.Clone('h%d' % ispec)
+        hist.SetDirectory(tmpFile)
+        # owned by tmpFile
+        ROOT.SetOwnership(hist, False)
+        hists.append(hist)
+
+    if _fillArgs['merged']:
+        runMergedFills(task, _fillArgs['printLevel'], _fillArgs['numThreads'], _fillArgs['compileFormulas'], hists = hists)
+    else:
+        runFills(task, _fillArgs['plotConfig'], _fillArgs['group'], _fillArgs['lumi'], _fillArgs['printLevel'], _fillArgs['numThreads'], _fillArgs['compileFormulas'], _fillArgs['columnCache'], hists = hists)
+
+    tmpFile.cd()
+    for hist in hists:
+        hist.Write()
+
+    tmpFile.Close()
+
+    return tmpPath
+
+
+def _runFillPool(tasks, taskSpecs, fillArgs, numJobs):
+    """
+    Run _runFillTask over the tasks in a process pool and add the results to the histograms of taskSpecs (list of [PlotSpec] aligned with tasks).
+    """
+
+    import multiprocessing
+    import tempfile
+    import shutil
+
+    global _fillTasks
+    global _fillArgs
+
+    tmpDir = tempfile.mkdtemp(prefix = 'plot_')
+
+    _fillTasks = tasks
+    _fillArgs = dict(fillArgs, tmpDir = tmpDir)
+
+    try:
+        pool = multiprocessing.Pool(min(numJobs, len(tasks)))
+        try:
+            tmpPaths = pool.map(_runFillTask, range(len(tasks)))
+        finally:
+            pool.close()
+            pool.join()
+
+        for specs, tmpPath in zip(taskSpecs, tmpPaths):
+            source = ROOT.TFile.Open(tmpPath)
+            for ispec, spec in enumerate(specs):
+                spec.hist.Add(source.Get('h%d' % ispec))
+
+            source.Close()
+
+    finally:
+        _fillTasks = []
+        _fillArgs = {}
+        shutil.rmtree(tmpDir)
+
+
+def runFillsParallel(tasks, plotConfig, group, lumi, printLevel, numThreads = 1, compileFormulas = False, columnCache = '', numJobs = 1):
+    """
+    Run the fill tasks in a process pool and add the results to the task histograms.
+    """
+
+    fillArgs = {'merged': False, 'plotConfig': plotConfig, 'group': group, 'lumi': lumi, 'printLevel': printLevel, 'numThreads': numThreads, 'compileFormulas': compileFormulas, 'columnCache': columnCache}
+
+    _runFillPool(tasks, [specs for _, _, specs in tasks], fillArgs, numJobs)
+
+
+def computeHashes(plotConfig, group, histograms, tasks, lumi, postscale):
+    """
+    Compute a content hash for each (sample, plotdef) from everything that determines the final
+    sample histograms: plot definition, group and variation settings, selections, weights, and the
+    specs with the sizes and modification times of their source skims.
+    Returns {(sample, plotdef): hex digest}.
+    """
+
+    import hashlib
+
+    baseSel, fullSel = getSelections(plotConfig, group)
+    groupKey = (group.name, group.scale, group.norm, [(v.name, v.normalize) for v in group.variations])
+
+    contents = collections.defaultdict(list) # {(sample, plotdef): [spec content]}
+    for sample, sourceName, specList in tasks:
+        stat = os.stat(sourceName)
+        for spec in specList:
+            contents[(sample, spec.plotdef)].append((sourceName, stat.st_size, int(stat.st_mtime), spec.hist.GetName(), spec.expr, spec.cut, spec.applyBaseline, spec.applyFullSel, spec.reweight, spec.overflowMode))
+
+    hashes = {}
+    for sample, plotdef, _, _ in histograms.keys():
+        if (sample, plotdef) in hashes:
+            continue
+
+        plotKey = (plotdef.name, plotdef.title, plotdef.unit, plotdef.binning, plotdef.blind, plotdef.mcOnly)
+
+        if sample.data:
+            weightKey = (plotConfig.prescales[sample] if group == plotConfig.obs else 1, postscale if group != plotConfig.obs else 1.)
+        else:
+            weightKey = (lumi,)
+
+        digest = hashlib.sha1()
+        digest.update(repr((sample.name, plotKey, groupKey, baseSel, fullSel, weightKey, contents[(sample, plotdef)])))
+        hashes[(sample, plotdef)] = digest.hexdigest()
+
+    return hashes
+
+
+class GroupFill(object):
+    """
+    Booked histograms and pending fill tasks of one group of a plot config.
+    Created by bookPlots; histograms are scaled, written, and aggregated by finishPlots once the tasks are run.
+    """
+
+    def __init__(self, plotConfig, group, plotdefs, outFile, region, lumi, postscale, prevFile):
+        self.plotConfig = plotConfig
+        self.group = group
+        self.plotdefs = plotdefs
+        self.outFile = outFile
+        self.region = region
+        self.lumi = lumi
+        self.postscale = postscale
+        self.prevFile = prevFile
+
+        self.histograms = collections.OrderedDict() # {(sample, plotdef, variation, direction): histogram}
+        self.tasks = [] # [(sample, sourceName, [PlotSpec])]
+        self.hashes = {} # {(sample, plotdef): hex digest}
+        self.reused = set() # (sample, plotdef) whose histograms are copied from the previous output
+
+
+def bookPlots(plotConfig, group, plotdefs, sourceDir, outFile, lumi = 0., postscale = 1., altSourceDir = '', prevFile = None):
+    """
+    Book the histograms of the group and group the plots by source file. Returns a GroupFill.
+    """
+
     if group.region:
         region = group.region
     else:
         region = plotConfig.name
 
-    histograms = collections.OrderedDict() # {(sample, plotdef, variation, direction): histogram}
+    fill = GroupFill(plotConfig, group, plotdefs, outFile, region, lumi, postscale, prevFile)
 
-    # run the Plotter for each sample
+    # book the histograms for each sample and group the plots by source file
     for sample in group.samples:
         sourceName = utils.getSkimPath(sample.name, region, sourceDir, altSourceDir)
 
@@ -61,114 +456,154 @@ def fillPlots(plotConfig, group, plotdefs, sourceDir, outFile, lumi = 0., postsc
             sys.stderr.write('File ' + sourceName + ' does not exist.\n')
             raise RuntimeError('InvalidSource')
 
-        plotter = makePlotter(sourceName, plotConfig, group, sample, lumi, printLevel)
-        varPlotters = {} # additional plotters for variations of sample type
+        specs = bookSample(plotConfig, group, sample, plotdefs, region, sourceDir, outFile, fill.histograms, altSourceDir = altSourceDir)
 
-        for plotdef in plotdefs:
-            if not outFile.GetDirectory(plotdef.name):
-                outFile.mkdir(plotdef.name)
+        for specSource, specList in specs.items():
+            fill.tasks.append((sample, specSource, specList))
 
-            outDir = outFile.GetDirectory(plotdef.name + '/samples')
-            if not outDir:
-                outDir = outFile.GetDirectory(plotdef.name).mkdir('samples')
+    fill.hashes = computeHashes(plotConfig, group, fill.histograms, fill.tasks, lumi, postscale)
 
-            hist = plotdef.makeHist(dname, outDir = outDir)
-            histograms[(sample, plotdef, None, None)] = hist
+    # groups with norm are always refilled because the normalization depends on all samples
+    if prevFile is not None and group.norm < 0.:
+        for (sample, plotdef), digest in fill.hashes.items():
+            prevHash = prevFile.Get(plotdef.name + '/samples/hash_' + sample.name + '_' + region)
+            if prevHash and prevHash.GetTitle() == digest:
+                fill.reused.add((sample, plotdef))
 
-            if group == plotConfig.obs and plotdef.fullyBlinded():
-                continue
+        if len(fill.reused) != 0:
+            print '    Reusing', len(fill.reused), 'of', len(fill.hashes), 'sample plots from the previous output'
 
-            if sample.data and plotdef.mcOnly:
-                continue
+        tasks = [(sample, src, [spec for spec in specList if (sample, spec.plotdef) not in fill.reused]) for sample, src, specList in fill.tasks]
+        fill.tasks = [task for task in tasks if len(task[2]) != 0]
 
-            plotCuts = []
+    return fill
 
-            if plotdef.cut.strip():
-                plotCuts.append('(' + plotdef.cut.strip() + ')')
 
-            if group.cut.strip():
-                plotCuts.append('(' + group.cut.strip() + ')' )
+def mergeFillTasks(fills):
+    """
+    Group the tasks of multiple GroupFills (possibly of different plot configs) by source file and event weight,
+    so that each source file is read once for all of them.
+    Returns a list of units [(source file name, [(GroupFill, task)])].
+    """
+
+    units = collections.OrderedDict()
 
-            cut = ' && '.join(plotCuts)
+    for fill in fills:
+        for task in fill.tasks:
+            sample, sourceName, _ = task
 
-            if plotdef.overflow:
-                overflowMode = ROOT.Plot.kMergeLast
+            # same conditions under which makePlotter sets the constant weight and the prescale
+            if sample.data:
+                weight = None
             else:
-                overflowMode = ROOT.Plot.kNoOverflowBin
-
-            # nominal distribution
-            plotter.addPlot(
-                hist,
-                plotdef.formExpression(),
-                cut.strip(),
-                plotdef.applyBaseline,
-                plotdef.applyFullSel,
-                '',
-                overflowMode
-            )
-
-            # systematic variations
-            for variation in group.variations:
-                for iv, direction in [(0, 'Up'), (1, 'Down')]:
-                    hist = plotdef.makeHist(dname + '_' + variation.name + direction, outDir = outDir)
-                    histograms[(sample, plotdef, variation, direction)] = hist
-    
-                    if type(variation.reweight) is str:
-                        reweight = 'reweight_' + variation.reweight + direction
-                    elif type(variation.reweight) is float:
-                        reweight = str(1. + variation.reweight * (1. - 2. * iv))
-                    else:
-                        reweight = ''
+                weight = fill.lumi
 
-                    plotCuts = []
-                    if variation.cuts is not None:
-                        # variation cuts override the plotdef cut
-                        plotCuts.append('(' + variation.cuts[iv].strip() + ')')
-                    elif group.cut.strip():
-                        plotCuts.append('(' + group.cut.strip() + ')')
+            if fill.group == fill.plotConfig.obs:
+                prescale = fill.plotConfig.prescales[sample]
+            else:
+                prescale = 1
 
-                    if plotdef.cut.strip():
-                        plotCuts.append('(' + plotdef.cut.strip() + ')')
+            units.setdefault((sourceName, weight, prescale), []).append((fill, task))
 
-                    cut = ' && '.join(plotCuts)
+    return [(key[0], entries) for key, entries in units.iteritems()]
+
+
+def mergedSpecs(unit):
+    """
+    Flat list of the PlotSpecs of a merged fill unit.
+    """
+
+    _, entries = unit
+    return [spec for _, (_, _, specs) in entries for spec in specs]
 
-                    if variation.replacements is not None:
-                        expr = plotdef.formExpression(variation.replacements[iv])
-                    else:
-                        expr = plotdef.formExpression()
-
-                    if variation.regions is not None:
-                        try:
-                            varPlotter = varPlotters[hist.GetName()]
-                        except KeyError:
-                            varSourceName = utils.getSkimPath(sample.name, variation.regions[iv], sourceDir, altSourceDir)
-                            varPlotter = makePlotter(varSourceName, plotConfig, group, sample, lumi, printLevel)
-                            varPlotters[hist.GetName()] = varPlotter
-                    else:
-                        varPlotter = plotter
-
-                    varPlotter.addPlot(
-                        hist,
-                        expr,
-                        cut.strip(),
-                        plotdef.applyBaseline,
-                        plotdef.applyFullSel,
-                        reweight,
-                        overflowMode
-                    )
-
-        # setup complete. Fill all plots in one go
-        if plotter.numObjs() != 0:
-            plotter.fillPlots()
-
-        for varname, varPlotter in varPlotters.items():
-            if varPlotter.numObjs() != 0:
-                varPlotter.fillPlots()
+
+def runMergedFills(unit, printLevel, numThreads = 1, compileFormulas = False, hists = None):
+    """
+    Fill all histograms of a merged fill unit (see mergeFillTasks) in one pass over the source file.
+    The plotter takes the selections shared by most of the plots; the selections of the other plots
+    are folded into their individual cuts.
+    Optionally the histograms to fill can be overridden by hists (list aligned with mergedSpecs(unit)).
+    """
+
+    sourceName, entries = unit
+
+    specs = mergedSpecs(unit)
+    if hists is None:
+        hists = [spec.hist for spec in specs]
+
+    selections = [getSelections(fill.plotConfig, fill.group) for fill, _ in entries]
+
+    counts = collections.Counter()
+    for sels, (_, (_, _, specList)) in zip(selections, entries):
+        counts[sels] += len(specList)
+
+    common = counts.most_common(1)[0][0]
+
+    if printLevel > 0:
+        print '    ', sourceName, 'for', ', '.join('%s/%s' % (fill.plotConfig.name, fill.group.name) for fill, _ in entries)
+
+    fill, (sample, _, _) = entries[0]
+    plotter = makePlotter(sourceName, fill.plotConfig, fill.group, sample, fill.lumi, printLevel, numThreads, compileFormulas, selections = common)
+
+    added = {} # {PlotSpec: histogram} added to the plotter
+    ispec = 0
+    for sels, (_, (_, _, specList)) in zip(selections, entries):
+        for spec in specList:
+            if spec.nominal in added:
+                plotter.addWeightVariation(added[spec.nominal], hists[ispec], spec.reweight)
+            elif sels == common:
+                spec.addTo(plotter, hists[ispec])
+                added[spec] = hists[ispec]
+            else:
+                spec.addFoldedTo(plotter, sels[0], sels[1], hists[ispec])
+                added[spec] = hists[ispec]
+
+            ispec += 1
+
+    if plotter.numObjs() != 0:
+        plotter.fillPlots()
+
+
+def runMergedFillsParallel(units, printLevel, numThreads = 1, compileFormulas = False, numJobs = 1):
+    """
+    Run the merged fill units in a process pool and add the results to the unit histograms.
+    """
+
+    fillArgs = {'merged': True, 'printLevel': printLevel, 'numThreads': numThreads, 'compileFormulas': compileFormulas}
+
+    _runFillPool(units, [mergedSpecs(unit) for unit in units], fillArgs, numJobs)
+
+
+def finishPlots(fill):
+    """
+    Scale and write the sample histograms of a GroupFill whose tasks have been run, then write the group aggregates.
+    """
+
+    plotConfig = fill.plotConfig
+    group = fill.group
+    histograms = fill.histograms
+    reused = fill.reused
+    prevFile = fill.prevFile
+    region = fill.region
 
     if group.norm >= 0.:
         normalization = sum(hist.GetBinContent(1) for (_, plotdef, variation, direction), hist in histograms.items() if plotdef.name == 'count' and variation is None)
 
     for (sample, plotdef, variation, _), hist in histograms.items():
+        if (sample, plotdef) in reused:
+            # final (scaled and cleaned) histograms from the previous output
+            prevName = plotdef.name + '/samples/' + hist.GetName()
+            hist.Add(prevFile.Get(prevName))
+            writeHist(hist)
+
+            prevOrig = prevFile.Get(prevName + '_original')
+            if prevOrig:
+                horig = prevOrig.Clone()
+                horig.SetDirectory(hist.GetDirectory())
+                writeHist(horig)
+
+            continue
+
         # ad-hoc scaling
         hist.Scale(group.scale)
 
@@ -177,7 +612,7 @@ def fillPlots(plotConfig, group, plotdefs, sourceDir, outFile, lumi = 0., postsc
 
         if sample.data and group != plotConfig.obs:
             # this is a data-driven background sample
-            hist.Scale(postscale)
+            hist.Scale(fill.postscale)
 
         # histograms is an ordered dict -> nominal histogram always comes before the variations
         if variation and variation.normalize and hist.GetSumOfWeights() > 0.:
@@ -193,29 +628,41 @@ def fillPlots(plotConfig, group, plotdefs, sourceDir, outFile, lumi = 0., postsc
             horig.SetDirectory(hist.GetDirectory())
             writeHist(horig)
 
+    # record the hashes for incremental refills
+    for (sample, plotdef), digest in fill.hashes.items():
+        outDir = fill.outFile.GetDirectory(plotdef.name + '/samples')
+        if outDir and outDir.GetFile():
+            outDir.WriteTObject(ROOT.TNamed('hash_' + sample.name + '_' + region, digest))
+
     # aggregate group plots
 
     # not for signal
     if group in plotConfig.sigGroups:
         return
 
-    for plotdef in plotdefs:
-        outDir = outFile.GetDirectory(plotdef.name)
+    for plotdef in fill.plotdefs:
+        outDir = fill.outFile.GetDirectory(plotdef.name)
 
         # simple sum of samples
         ghist = plotdef.makeHist(group.name, outDir = outDir)
 
         for sample in group.samples:
-            shist = outDir.Get('samples/' + sample.name + '_' + region)
-            ghist.Add(shist)
+            ghist.Add(histograms[(sample, plotdef, None, None)])
 
         if group == plotConfig.obs and plotdef.blind is not None:
             # take care of masking
-            for iBin in range(1, ghist.GetNbinsX() + 1):
-                binCenter = ghist.GetBinCenter(iBin)
-                if (binCenter > plotdef.blind[0] and (plotdef.blind[1] == 'inf' or binCenter < plotdef.blind[1])):
-                    ghist.SetBinContent(iBin, 0.)
-                    ghist.SetBinError(iBin, 0.)
+            nbins = ghist.GetNbinsX()
+            contents, sumw2 = binArrays(ghist)
+            edges = binEdges(ghist.GetXaxis())
+            binCenters = 0.5 * (edges[:-1] + edges[1:])
+
+            masked = binCenters > plotdef.blind[0]
+            if plotdef.blind[1] != 'inf':
+                masked &= binCenters < plotdef.blind[1]
+
+            contents[1:nbins + 1][masked] = 0.
+            sumw2[1:nbins + 1][masked] = 0.
+            ghist.ResetStats()
 
         writeHist(ghist)
 
@@ -233,10 +680,8 @@ def fillPlots(plotConfig, group, plotdefs, sourceDir, outFile, lumi = 0., postsc
                     if sample.data and plotdef.mcOnly:
                         continue
 
-                    suphist = outDir.Get('samples/' + sample.name + '_' + region + '_' + variation.name + 'Up')
-                    sdownhist = outDir.Get('samples/' + sample.name + '_' + region + '_' + variation.name + 'Down')
-                    uphist.Add(suphist)
-                    downhist.Add(sdownhist)
+                    uphist.Add(histograms[(sample, plotdef, variation, 'Up')])
+                    downhist.Add(histograms[(sample, plotdef, variation, 'Down')])
 
                 if variation.normalize:
                     # individual sample variation plots are normalized to corresponding sample nominal already
@@ -254,35 +699,86 @@ def fillPlots(plotConfig, group, plotdefs, sourceDir, outFile, lumi = 0., postsc
                 # add the average variation as systematics
                 uphist.Add(downhist, -1.)
                 uphist.Scale(0.5)
-    
-                for iX in range(1, ghist.GetNbinsX() + 1):
-                    err = math.sqrt(math.pow(ghistSyst.GetBinError(iX), 2.) + math.pow(uphist.GetBinContent(iX), 2.))
-                    if err > ghistSyst.GetBinContent(iX):
-                        err = ghistSyst.GetBinContent(iX)
 
-                    ghistSyst.SetBinError(iX, err)
+                nbins = ghist.GetNbinsX()
+                shift = binArrays(uphist)[0][1:nbins + 1]
+                contents, sumw2 = binArrays(ghistSyst)
+                # error capped at the bin content
+                err = numpy.minimum(numpy.sqrt(sumw2[1:nbins + 1] + shift * shift), contents[1:nbins + 1])
+                sumw2[1:nbins + 1] = err * err
     
             writeHist(ghistSyst)
 
 
+def fillPlots(plotConfig, group, plotdefs, sourceDir, outFile, lumi = 0., postscale = 1., printLevel = 0, altSourceDir = '', numThreads = 1, compileFormulas = False, columnCache = '', numJobs = 1, prevFile = None):
+    fill = bookPlots(plotConfig, group, plotdefs, sourceDir, outFile, lumi = lumi, postscale = postscale, altSourceDir = altSourceDir, prevFile = prevFile)
+
+    # run the Plotter for each source file
+    if numJobs > 1 and len(fill.tasks) > 1:
+        runFillsParallel(fill.tasks, plotConfig, group, lumi, printLevel, numThreads = numThreads, compileFormulas = compileFormulas, columnCache = columnCache, numJobs = numJobs)
+    else:
+        for task in fill.tasks:
+            runFills(task, plotConfig, group, lumi, printLevel, numThreads = numThreads, compileFormulas = compileFormulas, columnCache = columnCache)
+
+    finishPlots(fill)
+
+
+def binArrays(hist):
+    """
+    Return numpy views (contents, sum of squared weights) of the bin arrays of a TH1D / TH2D with Sumw2,
+    indexed by global bin number (including underflow and overflow). Writes go to the histogram directly;
+    call ResetStats() after modifying the contents.
+    """
+
+    size = hist.GetSize()
+
+    buf = hist.GetArray()
+    buf.SetSize(size)
+    contents = numpy.frombuffer(buf, dtype = numpy.float64, count = size)
+
+    buf = hist.GetSumw2().GetArray()
+    buf.SetSize(size)
+    sumw2 = numpy.frombuffer(buf, dtype = numpy.float64, count = size)
+
+    return contents, sumw2
+
+def binEdges(axis):
+    """
+    Return the bin edges of the axis as a numpy array.
+    """
+
+    nbins = axis.GetNbins()
+
+    xbins = axis.GetXbins()
+    if xbins.GetSize() == 0:
+        # fixed bin width
+        return numpy.linspace(axis.GetXmin(), axis.GetXmax(), nbins + 1)
+
+    buf = xbins.GetArray()
+    buf.SetSize(nbins + 1)
+    return numpy.frombuffer(buf, dtype = numpy.float64, count = nbins + 1).copy()
+
 # zero out negative bins (save the original as _orig)
 def cleanHist(hist):
-    horig = None
-    for iX in range(1, hist.GetNbinsX() + 1):
-        if hist.GetBinContent(iX) < 0.:
-            if horig is None:
-                # print '      Adjusting bin contents of', plotdef.name, hist.GetName(), 'to be non-negative'
-                horig = hist.Clone(hist.GetName() + '_original')
+    nbins = hist.GetNbinsX()
+    contents, sumw2 = binArrays(hist)
+    contents = contents[1:nbins + 1]
+    sumw2 = sumw2[1:nbins + 1]
+
+    negative = contents < 0.
+    # bins whose error bars extend below zero
+    overlapping = numpy.logical_and(numpy.logical_not(negative), contents - numpy.sqrt(sumw2) < 0.)
 
-            hist.SetBinContent(iX, 0.)
-            hist.SetBinError(iX, 0.)
+    if not negative.any() and not overlapping.any():
+        return hist, None
 
-        elif hist.GetBinContent(iX) - hist.GetBinError(iX) < 0.:
-            if horig is None:
-                # print '      Adjusting bin errors of', plotdef.name, hist.GetName(), 'to be non-negative'
-                horig = hist.Clone(hist.GetName() + '_original')
+    horig = hist.Clone(hist.GetName() + '_original')
 
-            hist.SetBinError(iX, hist.GetBinContent(iX))
+    contents[negative] = 0.
+    sumw2[negative] = 0.
+    sumw2[overlapping] = numpy.square(contents[overlapping])
+
+    hist.ResetStats()
 
     return hist, horig
 
@@ -312,19 +808,15 @@ def formatHist(hist, plotdef):
 
         nbins = hist.GetNbinsX()
 
-        for iX in range(1, nbins + 1):
-            cont = hist.GetBinContent(iX)
-            err = hist.GetBinError(iX)
-            w = hist.GetXaxis().GetBinWidth(iX)
-            if plotdef.unit:
-                hist.SetBinContent(iX, cont / w)
-                hist.SetBinError(iX, err / w)
-            else:
-                if iX == 1:
-                    wnorm = w
+        widths = numpy.diff(binEdges(hist.GetXaxis()))
+        if not plotdef.unit:
+            widths /= widths[0]
+
+        contents, sumw2 = binArrays(hist)
+        contents[1:nbins + 1] /= widths
+        sumw2[1:nbins + 1] /= numpy.square(widths)
 
-                hist.SetBinContent(iX, cont / (w / wnorm))
-                hist.SetBinError(iX, err / (w / wnorm))
+        hist.ResetStats()
 
     hist.GetXaxis().SetTitle(plotdef.xtitle())
     hist.GetYaxis().SetTitle(plotdef.ytitle(binNorm = True))
@@ -540,12 +1032,196 @@ def printCanvas(canvas, plotdef, plotConfig):
     ROOT.gErrorIgnoreLevel = eil
 
 
+def makeCanvas(plotConfig):
+    canvas = DataMCCanvas()
+
+    nentries = (1 + len(plotConfig.bkgGroups) + len(plotConfig.signalPoints))
+    ncolumns = math.ceil(float(nentries) / 5.) 
+    xmin = 0.35 if ncolumns > 2 else 0.55
+    canvas.legend.setPosition(xmin, SimpleCanvas.YMAX - 0.01 - 0.035 * 5, 0.92, SimpleCanvas.YMAX - 0.01)
+
+    return canvas
+
+
+def drawPlot(canvas, plotdef, plotConfig, inDir, bbb = '', chi2 = '', asimov = None):
+    """
+    Draw and print one plot from the histograms in inDir, or print the counts / bin-by-bin / chi2 tables.
+    """
+
+    fullLumi = plotConfig.fullLumi()
+    effLumi = plotConfig.effLumi()
+
+    if plotdef.name != 'count' and plotdef.name != bbb and plotdef.name != chi2:
+        graphic = True
+    else:
+        graphic = False
+
+    if graphic:
+        if plotdef.ndim() == 1:
+            drawOpt = 'HIST'
+        elif plotdef.ndim() == 2:
+            drawOpt = 'LEGO4 F 0'
+
+        # set up canvas
+        canvas.Clear(full = True)
+
+        isSensitive = plotdef.sensitive
+
+    else:
+        counters = {}
+        isSensitive = True
+
+    if isSensitive:
+        canvas.lumi = effLumi
+        # for data-driven background estimates under presence of prescales
+        # multiply the yields by 1/postscale
+        postscale = fullLumi / effLumi
+    else:
+        canvas.lumi = fullLumi
+        postscale = 1.
+
+    # fetch and format background groups
+    for group in plotConfig.bkgGroups:
+        ghist = inDir.Get(group.name + '_syst')
+
+        if graphic:
+            formatHist(ghist, plotdef)
+            title = group.title
+            if group.scale != 1.:
+                title += (' #times %.1f' % group.scale)
+            canvas.addStacked(ghist, title = title, color = group.color, drawOpt = drawOpt)
+        else:
+            counters[group.name] = ghist
+
+    # background total used for uncertainty display
+    bkgTotal = inDir.Get('bkgtotal_syst')
+    if graphic:
+        formatHist(bkgTotal, plotdef)
+
+    # plot signal distributions for sensitive plots
+    if isSensitive:
+        for sspec in plotConfig.signalPoints:
+            shist = inDir.Get('samples/' + sspec.name + '_' + plotConfig.name)
+
+            if graphic:
+                formatHist(shist, plotdef)
+                title = sspec.title
+                if sspec.group.scale != 1.:
+                    title += (' #times %.1f' % sspec.group.scale)
+                canvas.addSignal(shist, title = title, color = sspec.color, drawOpt = drawOpt)
+            else:
+                counters[sspec.name] = shist
+
+    # observed distributions
+    obshist = inDir.Get('data_obs')
+
+    if obshist:
+        if graphic:
+            formatHist(obshist, plotdef)
+            canvas.addObs(obshist, title = plotConfig.obs.title)
+        else:    
+            counters['data_obs'] = obshist
+
+    if plotdef.name == 'count':
+        printCounts(counters, plotConfig)
+    elif plotdef.name == bbb:
+        printBinByBin(counters, plotdef, plotConfig)
+    elif plotdef.name == chi2:
+        printChi2(counters, plotdef, plotConfig)
+    else:
+        if asimov:
+            plotdef.name += asimov.capitalize()
+
+        printCanvas(canvas, plotdef, plotConfig)
+
+
+# plots and draw arguments shared with the worker processes (inherited at fork)
+_drawTasks = []
+_drawArgs = {}
+
+def _drawPlotTask(iplot):
+    """
+    Worker process function. Draws one plot and returns what it printed to stdout.
+    """
+
+    import StringIO
+
+    plotdef = _drawTasks[iplot]
+    plotConfig = _drawArgs['plotConfig']
+
+    if 'canvas' not in _drawArgs:
+        # first task of this worker; _drawArgs is a per-process copy
+        # the hist file is reopened because the parent file handle cannot be read from multiple processes
+        if _drawArgs['histPath']:
+            _drawArgs['source'] = ROOT.TFile.Open(_drawArgs['histPath'])
+        else:
+            _drawArgs['source'] = _drawArgs['histDir']
+
+        _drawArgs['canvas'] = makeCanvas(plotConfig)
+
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+        print ' ', plotdef.name
+        drawPlot(_drawArgs['canvas'], plotdef, plotConfig, _drawArgs['source'].GetDirectory(plotdef.name), asimov = _drawArgs['asimov'])
+        return sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
+
+def drawPlotsParallel(plotdefs, plotConfig, histPath, histDir, asimov = None, numJobs = 1):
+    """
+    Draw and print the graphic plots in a process pool. Each worker reads the histograms from histPath
+    (or from the in-memory histDir inherited at fork if histPath is empty) and draws on its own canvas.
+    Worker outputs are printed in the order of plotdefs.
+    """
+
+    import multiprocessing
+
+    global _drawTasks
+    global _drawArgs
+
+    _drawTasks = plotdefs
+    _drawArgs = {'plotConfig': plotConfig, 'histPath': histPath, 'histDir': histDir, 'asimov': asimov}
+
+    try:
+        pool = multiprocessing.Pool(min(numJobs, len(plotdefs)))
+        try:
+            for output in pool.imap(_drawPlotTask, range(len(plotdefs))):
+                sys.stdout.write(output)
+                sys.stdout.flush()
+        finally:
+            pool.close()
+            pool.join()
+
+    finally:
+        _drawTasks = []
+        _drawArgs = {}
+
+
+class ConfigJob(object):
+    """
+    One plot config processed in a plot.py invocation, with its plots and output locations.
+    """
+
+    def __init__(self, plotConfig, plotdefs, histPath, plotDir):
+        self.plotConfig = plotConfig
+        self.plotdefs = plotdefs
+        self.plotNames = [p.name for p in plotdefs]
+        self.histPath = histPath
+        self.plotDir = plotDir
+        self.histFile = None
+        self.prevHistPath = ''
+        self.prevHistFile = None
+
+
 if __name__ == '__main__':
 
     from argparse import ArgumentParser
     
     argParser = ArgumentParser(description = 'Plot and count')
-    argParser.add_argument('config', metavar = 'CONFIG', help = 'Plot config name.')
+    argParser.add_argument('config', metavar = 'CONFIG', nargs = '?', default = '', help = 'Plot config name.')
+    argParser.add_argument('--configs', '-c', metavar = 'CONFIG,...', dest = 'configs', default = '', help = 'Comma-separated list of plot configs to process in one pass. Histograms of all configs are filled together, reading each skim file once. --hist-file and --plot-dir must contain {config}.')
     argParser.add_argument('--all-signal', '-S', action = 'store_true', dest = 'allSignal', help = 'Write histogram for all signal points.')
     argParser.add_argument('--asimov', '-v', metavar = '(background|<signal>)', dest = 'asimov', help = 'Plot the total background or signal + background as the observed distribution. For signal + background, give the signal point name.')
     argParser.add_argument('--use-variation', '-z', metavar = 'GROUP:VARIATION', dest = 'asimov_variation', nargs = '+', default = [], help = 'Use with --asimov option to inject variation of the group to the pseudo-data instead of nominal.')
@@ -559,8 +1235,13 @@ if __name__ == '__main__':
     argParser.add_argument('--plot', '-p', metavar = 'NAME', dest = 'plots', nargs = '+', default = [], help = 'Limit plotting to specified set of plots.')
     argParser.add_argument('--plot-dir', '-d', metavar = 'PATH', dest = 'plotDir', default = '', help = 'Specify a directory under {webdir} to save images. Use "-" for no output.')
     argParser.add_argument('--print-level', '-m', metavar = 'LEVEL', dest = 'printLevel', default = 0, help = 'Verbosity of the script.')
+    argParser.add_argument('--incremental', '-I', action = 'store_true', dest = 'incremental', help = 'Refill only the sample histograms whose definition or source changed since the last run and copy the rest from the existing --hist-file.')
     argParser.add_argument('--replot', '-P', action = 'store_true', dest = 'replot', default = '', help = 'Do not fill histograms. Need --hist-file.')
     argParser.add_argument('--skim-dir', '-i', metavar = 'PATH', dest = 'skimDir', help = 'Input skim directory.')
+    argParser.add_argument('--jobs', '-j', metavar = 'N', dest = 'numJobs', type = int, default = 1, help = 'Number of processes to fill the histograms of the samples and to draw the plots in parallel.')
+    argParser.add_argument('--num-threads', '-T', metavar = 'N', dest = 'numThreads', type = int, default = 1, help = 'Number of threads to use in filling the histograms of each sample.')
+    argParser.add_argument('--compile-formulas', '-F', action = 'store_true', dest = 'compileFormulas', help = 'Evaluate the plot expressions and cuts through JIT-compiled functions where possible.')
+    argParser.add_argument('--column-cache', '-C', metavar = 'PATH', dest = 'columnCache', default = '', help = 'Directory to cache the extracted plot columns in. Histograms are refilled from the cache when the skims and the plot expressions are unchanged.')
     
     args = argParser.parse_args()
     sys.argv = []
@@ -576,6 +1257,7 @@ if __name__ == '__main__':
     from main.plotconfig import getConfig
     from main.plotconfig_vbf import getConfigVBF
     from main.plotconfig_ggh import getConfigGGH
+    from main.columncache import ColumnCache
     import config
     import utils
 
@@ -583,115 +1265,164 @@ if __name__ == '__main__':
     ## PARSE COMMAND-LINE ARGUMENTS ##
     ##################################
 
+    if args.configs:
+        configNames = [name.strip() for name in args.configs.split(',') if name.strip()]
+    elif args.config:
+        configNames = [args.config]
+    else:
+        print 'No plot config given.'
+        sys.exit(1)
+
+    # batch mode: multiple configs filled in one pass
+    batch = len(configNames) > 1
+
+    if batch:
+        if args.histFile and '{config}' not in args.histFile:
+            print '--hist-file must contain {config} when multiple configs are given.'
+            sys.exit(1)
+
+        if args.plotDir and args.plotDir != '-' and '{config}' not in args.plotDir:
+            print '--plot-dir must contain {config} when multiple configs are given.'
+            sys.exit(1)
+
     if args.skimDir:
         localSkimDir = ''
     else:
         args.skimDir = config.skimDir
         localSkimDir = config.localSkimDir
 
-    plotConfig = getConfig(args.config)
-    if plotConfig is None:
-        plotConfig = getConfigVBF(args.config)
-    if plotConfig is None:
-        plotConfig = getConfigGGH(args.config)
-    if plotConfig is None:
-        print 'Unknown configuration', args.config
-        sys.exit(1)
+    plotConfigs = []
+    for name in configNames:
+        plotConfig = getConfig(name)
+        if plotConfig is None:
+            plotConfig = getConfigVBF(name)
+        if plotConfig is None:
+            plotConfig = getConfigGGH(name)
+        if plotConfig is None:
+            print 'Unknown configuration', name
+            sys.exit(1)
+
+        plotConfigs.append((name, plotConfig))
 
     if args.listSamples:
-        print 'Obs:', ' '.join('%s_%s' % (s.name, plotConfig.name) for s in plotConfig.obs.samples)
-        bkg = []
-        for group in plotConfig.bkgGroups:
-            if group.region:
-                bkg += ['%s_%s' % (s.name, group.region) for s in group.samples]
-            else:
-                bkg += ['%s_%s' % (s.name, plotConfig.name) for s in group.samples]
-        print 'Bkg:', ' '.join(bkg)
+        for name, plotConfig in plotConfigs:
+            if batch:
+                print name
 
-        if args.allSignal:
-            sig = []
-            for group in plotConfig.sigGroups:
+            print 'Obs:', ' '.join('%s_%s' % (s.name, plotConfig.name) for s in plotConfig.obs.samples)
+            bkg = []
+            for group in plotConfig.bkgGroups:
                 if group.region:
-                    sig += ['%s_%s' % (s.name, group.region) for s in group.samples]
+                    bkg += ['%s_%s' % (s.name, group.region) for s in group.samples]
                 else:
-                    sig += ['%s_%s' % (s.name, plotConfig.name) for s in group.samples]
-        else:
-            sig = ['%s_%s' % (sdef.sample.name, plotConfig.name) for sdef in plotConfig.signalPoints]
-        print 'Sig:', ' '.join(sig)
+                    bkg += ['%s_%s' % (s.name, plotConfig.name) for s in group.samples]
+            print 'Bkg:', ' '.join(bkg)
+
+            if args.allSignal:
+                sig = []
+                for group in plotConfig.sigGroups:
+                    if group.region:
+                        sig += ['%s_%s' % (s.name, group.region) for s in group.samples]
+                    else:
+                        sig += ['%s_%s' % (s.name, plotConfig.name) for s in group.samples]
+            else:
+                sig = ['%s_%s' % (sdef.sample.name, plotConfig.name) for sdef in plotConfig.signalPoints]
+            print 'Sig:', ' '.join(sig)
 
         sys.exit(0)
 
-    if args.bbb:
-        plotdefs = [plotConfig.getPlot(args.bbb)]
-    elif args.chi2:
-        plotdefs = [plotConfig.getPlot(args.chi2)]
-    elif len(args.plots) != 0:
-        plotdefs = set()
-        if 'sensitive' in args.plots:
-            plotdefs.update([plot for plot in plotConfig.getPlots() if plot.sensitive])
-            args.plots.remove('sensitive')
-
-        if 'insensitive' in args.plots:
-            plotdefs.update([plot for plot in plotConfig.getPlots() if not plot.sensitive])
-            plotConfig.getPlot('count').blind = 'full'
-            args.plots.remove('insensitive')
-
-        if len(args.plots) != 0:
-            plotdefs.update(plotConfig.getPlots(args.plots))
-
-        plotdefs = list(plotdefs)
-    else:
-        plotdefs = plotConfig.getPlots()
+    if not args.histFile:
+        if args.allSignal:
+            print '--all-signal set but no output file is given.'
+            sys.exit(1)
 
-    if plotConfig.getPlot('count') not in plotdefs:
-        plotdefs.append(plotConfig.getPlot('count'))
+        if args.replot:
+            print '--replot requires a --hist-file.'
+            sys.exit(1)
 
-    plotNames = [p.name for p in plotdefs]
+        if args.incremental:
+            print '--incremental requires a --hist-file.'
+            sys.exit(1)
 
-    for plotdef in plotdefs:
-        if plotdef.sensitive and plotdef.blind is None:
-            plotdef.blind = 'full'
+    jobs = []
 
-    if args.unblind:
-        for plotdef in plotdefs:
-            plotdef.blind = None
+    for name, plotConfig in plotConfigs:
+        if args.bbb:
+            plotdefs = [plotConfig.getPlot(args.bbb)]
+        elif args.chi2:
+            plotdefs = [plotConfig.getPlot(args.chi2)]
+        elif len(args.plots) != 0:
+            plotNames = list(args.plots)
 
-    if args.blind:
-        for plotdef in plotdefs:
-            plotdef.blind = 'full'
+            plotdefs = set()
+            if 'sensitive' in plotNames:
+                plotdefs.update([plot for plot in plotConfig.getPlots() if plot.sensitive])
+                plotNames.remove('sensitive')
 
-    if args.histFile:
-        if args.replot:
-            histFile = ROOT.TFile.Open(args.histFile)
-        else:
-            histFile = ROOT.TFile.Open(args.histFile, 'recreate')
+            if 'insensitive' in plotNames:
+                plotdefs.update([plot for plot in plotConfig.getPlots() if not plot.sensitive])
+                plotConfig.getPlot('count').blind = 'full'
+                plotNames.remove('insensitive')
 
-    else:
-        if args.allSignal:
-            print '--all-signal set but no output file is given.'
-            sys.exit(1)
+            if len(plotNames) != 0:
+                plotdefs.update(plotConfig.getPlots(plotNames))
 
-        if args.replot:
-            print '--replot requires a --hist-file.'
-            sys.exit(1)
+            plotdefs = list(plotdefs)
+        else:
+            plotdefs = plotConfig.getPlots()
 
-        histFile = ROOT.gROOT
+        if plotConfig.getPlot('count') not in plotdefs:
+            plotdefs.append(plotConfig.getPlot('count'))
 
-    if args.asimov:
-        if args.asimov == 'background':
-            pass
-        elif args.asimov in [s.name for s in plotConfig.signalPoints]:
-            pass
+        for plotdef in plotdefs:
+            if plotdef.sensitive and plotdef.blind is None:
+                plotdef.blind = 'full'
+
+        if args.unblind:
+            for plotdef in plotdefs:
+                plotdef.blind = None
+
+        if args.blind:
+            for plotdef in plotdefs:
+                plotdef.blind = 'full'
+
+        if args.asimov:
+            if args.asimov == 'background':
+                pass
+            elif args.asimov in [s.name for s in plotConfig.signalPoints]:
+                pass
+            else:
+                print 'Invalid value for option --asimov.'
+                sys.exit(1)
+
+        if args.plotDir:
+            if args.plotDir == '-':
+                plotDir = ''
+            else:
+                plotDir = args.plotDir.replace('{config}', name)
         else:
-            print 'Invalid value for option --asimov.'
-            sys.exit(1)
+            plotDir = 'monophoton/' + name
 
-    ############################
-    ## SET UP FROM PLOTCONFIG ##
-    ############################
+        jobs.append(ConfigJob(plotConfig, plotdefs, args.histFile.replace('{config}', name), plotDir))
 
-    fullLumi = plotConfig.fullLumi()
-    effLumi = plotConfig.effLumi()
+    for job in jobs:
+        if job.histPath:
+            if args.replot:
+                job.histFile = ROOT.TFile.Open(job.histPath)
+            else:
+                if args.incremental and os.path.exists(job.histPath):
+                    job.prevHistPath = job.histPath + '.prev'
+                    os.rename(job.histPath, job.prevHistPath)
+                    job.prevHistFile = ROOT.TFile.Open(job.prevHistPath)
+
+                job.histFile = ROOT.TFile.Open(job.histPath, 'recreate')
+
+        elif batch:
+            # keep the in-memory histograms of the configs apart
+            job.histFile = ROOT.gROOT.mkdir(job.plotConfig.name)
+
+        else:
+            job.histFile = ROOT.gROOT
 
     #####################################
     ## FILL HISTOGRAMS FROM SKIM TREES ##
@@ -699,91 +1430,130 @@ if __name__ == '__main__':
 
     if not args.replot:
         ROOT.gROOT.LoadMacro(basedir + '/../common/MultiDraw.cc+')
-    
-        print 'Filling plots for %s..' % plotConfig.name
 
-        # for data-driven background estimates under presence of prescales
-        # multiply the yields by postscale
-        postscale = effLumi / fullLumi
-    
-        groups = list(plotConfig.bkgGroups)
-        if args.allSignal:
-            groups += plotConfig.sigGroups
-        else:
-            for sspec in plotConfig.signalPoints:
-                if sspec.group not in groups:
-                    groups.append(sspec.group)
-                    sspec.group.samples = []
-    
-                sspec.group.samples.append(sspec.sample)
+        # with the column cache, each group is filled separately from the cached columns
+        merged = batch and not args.columnCache
+        fills = []
 
-        if not args.asimov:
-            # if args.asimov, we'll make the data_obs plot below
-            groups.append(plotConfig.obs)
-    
-        for group in groups:
-            print ' ', group.name
+        for job in jobs:
+            plotConfig = job.plotConfig
 
-            fillPlots(plotConfig, group, plotdefs, args.skimDir, histFile, lumi = effLumi, postscale = postscale, printLevel = args.printLevel, altSourceDir = localSkimDir)
-   
-        # Save a background total histogram (for display purpose) for each plotdef
-        for plotdef in plotdefs:
-            outDir = histFile.GetDirectory(plotdef.name)
+            if merged:
+                print 'Booking plots for %s..' % plotConfig.name
+            else:
+                print 'Filling plots for %s..' % plotConfig.name
 
-            bkghist = plotdef.makeHist('bkgtotal', outDir = outDir)
-            bkghistSyst = plotdef.makeHist('bkgtotal_syst', outDir = outDir)
+            fullLumi = plotConfig.fullLumi()
+            effLumi = plotConfig.effLumi()
 
-            for group in plotConfig.bkgGroups:
-                bkghist.Add(outDir.Get(group.name))
-                bkghistSyst.Add(outDir.Get(group.name + '_syst'))
-    
-            writeHist(bkghist)
-            writeHist(bkghistSyst)
-
-            if args.asimov:
-                asimov = bkghist.Clone('asimov')
-
-                # generate the "observed" distribution from background total
-                for varspec in args.asimov_variation:
-                    # example: fakemet:fakemetShapeUp:5
-                    words = varspec.split(':')
-                    gname, varname = words[:2]
-                    if len(words) > 2:
-                        scale = float(words[2])
-                    else:
-                        scale = 1.
+            # for data-driven background estimates under presence of prescales
+            # multiply the yields by postscale
+            postscale = effLumi / fullLumi
+        
+            groups = list(plotConfig.bkgGroups)
+            if args.allSignal:
+                groups += plotConfig.sigGroups
+            else:
+                for sspec in plotConfig.signalPoints:
+                    if sspec.group not in groups:
+                        groups.append(sspec.group)
+                        sspec.group.samples = []
+        
+                    sspec.group.samples.append(sspec.sample)
 
-                    nominal = outDir.Get(gname)
-                    if varname:
-                        varhist = outDir.Get(gname + '_' + varname)
-                    else:
-                        varhist = nominal
-                    
-                    if not nominal or not varhist:
-                        print 'Invalid variation specified for pseudo-data:', varspec
-                        continue
+            if not args.asimov:
+                # if args.asimov, we'll make the data_obs plot below
+                groups.append(plotConfig.obs)
+        
+            for group in groups:
+                print ' ', group.name
+
+                if merged:
+                    fills.append(bookPlots(plotConfig, group, job.plotdefs, args.skimDir, job.histFile, lumi = effLumi, postscale = postscale, altSourceDir = localSkimDir, prevFile = job.prevHistFile))
+                else:
+                    fillPlots(plotConfig, group, job.plotdefs, args.skimDir, job.histFile, lumi = effLumi, postscale = postscale, printLevel = args.printLevel, altSourceDir = localSkimDir, numThreads = args.numThreads, compileFormulas = args.compileFormulas, columnCache = args.columnCache, numJobs = args.numJobs, prevFile = job.prevHistFile)
+
+        if merged:
+            # read each source file once for all configs
+            units = mergeFillTasks(fills)
 
-                    asimov.Add(nominal, -1.)
-                    asimov.Add(varhist, scale)
+            print 'Filling plots from %d source files for %d configs..' % (len(units), len(jobs))
 
-                if args.asimov != 'background':
-                    sighist = outDir.Get('samples/' + args.asimov + '_' + plotConfig.name)
-                    asimov.Add(sighist)
+            if args.numJobs > 1 and len(units) > 1:
+                runMergedFillsParallel(units, args.printLevel, numThreads = args.numThreads, compileFormulas = args.compileFormulas, numJobs = args.numJobs)
+            else:
+                for unit in units:
+                    runMergedFills(unit, args.printLevel, numThreads = args.numThreads, compileFormulas = args.compileFormulas)
 
-                # make data_obs here
-                obshist = plotdef.makeHist('data_obs', outDir = outDir)
+            for fill in fills:
+                finishPlots(fill)
 
-                for iBin in xrange(1, asimov.GetNbinsX() + 1):
-                    x = asimov.GetXaxis().GetBinCenter(iBin)
-                    for _ in xrange(int(round(asimov.GetBinContent(iBin)))):
-                        obshist.Fill(x)
+        for job in jobs:
+            plotConfig = job.plotConfig
+            histFile = job.histFile
 
-                writeHist(obshist)
+            # Save a background total histogram (for display purpose) for each plotdef
+            for plotdef in job.plotdefs:
+                outDir = histFile.GetDirectory(plotdef.name)
 
-        if args.histFile:
-            # close and reopen the output file
-            histFile.Close()
-            histFile = ROOT.TFile.Open(args.histFile)
+                bkghist = plotdef.makeHist('bkgtotal', outDir = outDir)
+                bkghistSyst = plotdef.makeHist('bkgtotal_syst', outDir = outDir)
+
+                for group in plotConfig.bkgGroups:
+                    bkghist.Add(outDir.Get(group.name))
+                    bkghistSyst.Add(outDir.Get(group.name + '_syst'))
+        
+                writeHist(bkghist)
+                writeHist(bkghistSyst)
+
+                if args.asimov:
+                    asimov = bkghist.Clone('asimov')
+
+                    # generate the "observed" distribution from background total
+                    for varspec in args.asimov_variation:
+                        # example: fakemet:fakemetShapeUp:5
+                        words = varspec.split(':')
+                        gname, varname = words[:2]
+                        if len(words) > 2:
+                            scale = float(words[2])
+                        else:
+                            scale = 1.
+
+                        nominal = outDir.Get(gname)
+                        if varname:
+                            varhist = outDir.Get(gname + '_' + varname)
+                        else:
+                            varhist = nominal
+                        
+                        if not nominal or not varhist:
+                            print 'Invalid variation specified for pseudo-data:', varspec
+                            continue
+
+                        asimov.Add(nominal, -1.)
+                        asimov.Add(varhist, scale)
+
+                    if args.asimov != 'background':
+                        sighist = outDir.Get('samples/' + args.asimov + '_' + plotConfig.name)
+                        asimov.Add(sighist)
+
+                    # make data_obs here
+                    obshist = plotdef.makeHist('data_obs', outDir = outDir)
+
+                    for iBin in xrange(1, asimov.GetNbinsX() + 1):
+                        x = asimov.GetXaxis().GetBinCenter(iBin)
+                        for _ in xrange(int(round(asimov.GetBinContent(iBin)))):
+                            obshist.Fill(x)
+
+                    writeHist(obshist)
+
+            if job.histPath:
+                # close and reopen the output file
+                histFile.Close()
+                job.histFile = ROOT.TFile.Open(job.histPath)
+
+            if job.prevHistFile is not None:
+                job.prevHistFile.Close()
+                os.remove(job.prevHistPath)
 
     # closes if not args.replot
 
@@ -792,119 +1562,50 @@ if __name__ == '__main__':
     ## DRAW / ANALYZE ##
     ####################
 
-    if args.plotDir == '-' and not ('count' in plotNames or args.bbb or args.chi2):
-        # nothing to do
-        sys.exit(0)
-
-    print 'Drawing plots..'
-
-    canvas = DataMCCanvas()
-
-    nentries = (1 + len(plotConfig.bkgGroups) + len(plotConfig.signalPoints))
-    ncolumns = math.ceil(float(nentries) / 5.) 
-    xmin = 0.35 if ncolumns > 2 else 0.55
-    canvas.legend.setPosition(xmin, SimpleCanvas.YMAX - 0.01 - 0.035 * 5, 0.92, SimpleCanvas.YMAX - 0.01)
+    for job in jobs:
+        plotConfig = job.plotConfig
+        histFile = job.histFile
 
-    if args.plotDir:
-        if args.plotDir == '-':
-            plotDir = ''
-        else:
-            plotDir = args.plotDir
-    else:
-        plotDir = 'monophoton/' + args.config
-
-    if plotDir and args.clearDir:
-        for plot in os.listdir(WEBDIR + '/' + plotDir):
-            os.remove(WEBDIR + '/' + plotDir + '/' + plot)
-
-    for plotdef in plotdefs:
-        if plotdef.name != 'count' and plotdef.name != args.bbb and plotdef.name != args.chi2:
-            graphic = True
-        else:
-            graphic = False
-
-        if not plotDir and graphic:
+        if not job.plotDir and not ('count' in job.plotNames or args.bbb or args.chi2):
             # nothing to do
             continue
 
-        print ' ', plotdef.name
+        print 'Drawing plots for %s..' % plotConfig.name
 
-        if graphic:
-            if plotdef.ndim() == 1:
-                drawOpt = 'HIST'
-            elif plotdef.ndim() == 2:
-                drawOpt = 'LEGO4 F 0'
+        canvas = makeCanvas(plotConfig)
 
-            # set up canvas
-            canvas.Clear(full = True)
+        # used by printCanvas
+        plotDir = job.plotDir
 
-            isSensitive = plotdef.sensitive
+        if plotDir and args.clearDir:
+            for plot in os.listdir(WEBDIR + '/' + plotDir):
+                os.remove(WEBDIR + '/' + plotDir + '/' + plot)
 
-        else:
-            counters = {}
-            isSensitive = True
-    
-        if isSensitive:
-            canvas.lumi = effLumi
-            # for data-driven background estimates under presence of prescales
-            # multiply the yields by 1/postscale
-            postscale = fullLumi / effLumi
-        else:
-            canvas.lumi = fullLumi
-            postscale = 1.
+        # graphic plots to render in worker processes
+        graphicPlots = []
 
-        inDir = histFile.GetDirectory(plotdef.name)
+        for plotdef in job.plotdefs:
+            if plotdef.name != 'count' and plotdef.name != args.bbb and plotdef.name != args.chi2:
+                graphic = True
+            else:
+                graphic = False
 
-        # fetch and format background groups
-        for group in plotConfig.bkgGroups:
-            ghist = inDir.Get(group.name + '_syst')
+            if not plotDir and graphic:
+                # nothing to do
+                continue
 
-            if graphic:
-                formatHist(ghist, plotdef)
-                title = group.title
-                if group.scale != 1.:
-                    title += (' #times %.1f' % group.scale)
-                canvas.addStacked(ghist, title = title, color = group.color, drawOpt = drawOpt)
-            else:
-                counters[group.name] = ghist
+            if graphic and args.numJobs > 1:
+                graphicPlots.append(plotdef)
+                continue
 
-        # background total used for uncertainty display
-        bkgTotal = inDir.Get('bkgtotal_syst')
-        if graphic:
-            formatHist(bkgTotal, plotdef)
-
-        # plot signal distributions for sensitive plots
-        if isSensitive:
-            for sspec in plotConfig.signalPoints:
-                shist = inDir.Get('samples/' + sspec.name + '_' + plotConfig.name)
-
-                if graphic:
-                    formatHist(shist, plotdef)
-                    title = sspec.title
-                    if sspec.group.scale != 1.:
-                        title += (' #times %.1f' % sspec.group.scale)
-                    canvas.addSignal(shist, title = title, color = sspec.color, drawOpt = drawOpt)
-                else:
-                    counters[sspec.name] = shist
+            print ' ', plotdef.name
 
-        # observed distributions
-        obshist = inDir.Get('data_obs')
+            drawPlot(canvas, plotdef, plotConfig, histFile.GetDirectory(plotdef.name), bbb = args.bbb, chi2 = args.chi2, asimov = args.asimov)
 
-        if obshist:
-            if graphic:
-                formatHist(obshist, plotdef)
-                canvas.addObs(obshist, title = plotConfig.obs.title)
-            else:    
-                counters['data_obs'] = obshist
-
-        if plotdef.name == 'count':
-            printCounts(counters, plotConfig)
-        elif plotdef.name == args.bbb:
-            printBinByBin(counters, plotdef, plotConfig)
-        elif plotdef.name == args.chi2:
-            printChi2(counters, plotdef, plotConfig)
+        if len(graphicPlots) > 1:
+            drawPlotsParallel(graphicPlots, plotConfig, job.histPath, histFile, asimov = args.asimov, numJobs = args.numJobs)
         else:
-            if args.asimov:
-                plotdef.name += args.asimov.capitalize()
+            for plotdef in graphicPlots:
+                print ' ', plotdef.name
 
-            printCanvas(canvas, plotdef, plotConfig)
+                drawPlot(canvas, plotdef, plotConfig, histFile.GetDirectory(plotdef.name), asimov = args.asimov)
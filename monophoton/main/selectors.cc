@@ -3,9 +3,20 @@
 #include "TFile.h"
 #include "TTree.h"
 #include "TSystem.h"
+#include "TBranch.h"
 
 #include <cstring>
 
+//--------------------------------------------------------------------
+// StageTimer
+//--------------------------------------------------------------------
+
+void
+StageTimer::writeJSON(std::ostream& _out) const
+{
+  _out << "{\"wall\": " << wall() << ", \"cpu\": " << cpu() << ", \"calls\": " << calls() << "}";
+}
+
 //--------------------------------------------------------------------
 // EventSelectorBase
 //--------------------------------------------------------------------
@@ -67,16 +78,27 @@ EventSelectorBase::initialize(char const* _outputPath, panda::EventMonophoton& _
   if (printLevel_ > 0)
     *stream_ << "Initializing " << className() << "::" << name() << std::endl;
 
-  auto* outputFile(new TFile(_outputPath, "recreate"));
+  outputPath_ = _outputPath;
+
+  TString writePath(outputPath_);
+  if (atomicOutput_)
+    writePath += ".part";
+
+  auto* outputFile(new TFile(writePath, "recreate"));
+  if (compression_ >= 0)
+    outputFile->SetCompressionSettings(compression_);
 
   skimOut_ = new TTree("events", "Events");
-  cutsOut_ = new TTree("cutflow", "cutflow");
 
   skimOut_->Branch("weight_Input", &inWeight_, "weight_Input/D");
 
-  cutsOut_->Branch("runNumber", &_inEvent.runNumber, "runNumber/i");
-  cutsOut_->Branch("lumiNumber", &_inEvent.lumiNumber, "lumiNumber/i");
-  cutsOut_->Branch("eventNumber", &_inEvent.eventNumber, "eventNumber/i");
+  if (cutflowMode_ == kCutflowTree || cutflowMode_ == kCutflowBoth) {
+    cutsOut_ = new TTree("cutflow", "cutflow");
+
+    cutsOut_->Branch("runNumber", &_inEvent.runNumber, "runNumber/i");
+    cutsOut_->Branch("lumiNumber", &_inEvent.lumiNumber, "lumiNumber/i");
+    cutsOut_->Branch("eventNumber", &_inEvent.eventNumber, "eventNumber/i");
+  }
 
   setupSkim_(_inEvent, _isMC);
 
@@ -90,18 +112,86 @@ EventSelectorBase::initialize(char const* _outputPath, panda::EventMonophoton& _
     *stream_ << std::endl;
   }
 
+  addInputBranch_(_blist, _isMC);
+
   for (auto* op : operators_) {
     op->addInputBranch(_blist);
     op->addBranches(*skimOut_);
     op->initialize(_inEvent);
-    op->registerCut(*cutsOut_);
+    if (cutsOut_)
+      op->registerCut(*cutsOut_);
+  }
+
+  // all output branches are booked at this point
+  if (basketSize_ > 0)
+    skimOut_->SetBasketSize("*", basketSize_);
+  if (autoFlush_ != 0)
+    skimOut_->SetAutoFlush(autoFlush_);
+
+  if (cutflowMode_ == kCutflowSummary || cutflowMode_ == kCutflowBoth) {
+    std::vector<char const*> cutNames;
+    cutResults_.clear();
+    cutMasks_.clear();
+
+    for (auto* op : operators_) {
+      if (op->cutResult()) {
+        cutResults_.push_back(op->cutResult());
+        cutNames.push_back(op->name());
+      }
+    }
+
+    if (cutResults_.size() > 64)
+      throw std::runtime_error(("Too many cuts in " + name_ + " for the cutflow summary").Data());
+
+    unsigned nBins(cutResults_.size() + 1);
+    cutflowCounts_ = new TH1D("cutflowCounts", "Cutflow", nBins, 0., nBins);
+    cutflowCounts_->SetDirectory(0);
+    cutflowWeights_ = new TH1D("cutflowWeights", "Weighted cutflow", nBins, 0., nBins);
+    cutflowWeights_->SetDirectory(0);
+    cutflowWeights_->Sumw2();
+
+    for (auto* hist : {cutflowCounts_, cutflowWeights_}) {
+      hist->GetXaxis()->SetBinLabel(1, "Input");
+      for (unsigned iC(0); iC != cutNames.size(); ++iC)
+        hist->GetXaxis()->SetBinLabel(iC + 2, cutNames[iC]);
+    }
+  }
+
+  // cuts after a failed one must still be evaluated when their results are recorded
+  // (per-event results, cut masks, and cutflows in any order depend on them)
+  skipAfterFail_ = lazyEvaluation_ && !cutsOut_ && !cutflowCounts_;
+  if (lazyEvaluation_ && !skipAfterFail_)
+    std::cerr << "Selector " << name_ << ": lazy evaluation is disabled because cutflow output is booked" << std::endl;
+
+  if (resultCache_) {
+    // Results that depend on the output event are shared among selectors whose operators up to that point
+    // have identical keys. The chain is broken by the first operator without a key, and is not started when
+    // operators can be skipped (the output event state would then depend on the cut decisions).
+    TString chainKey;
+    if (!skipAfterFail_)
+      chainKey = className();
+
+    unsigned nShared(sharedPrefixSize_());
+    for (unsigned iO(0); iO != operators_.size(); ++iO) {
+      if (iO == nShared)
+        chainKey = "";
+
+      chainKey = operators_[iO]->setResultCache(*resultCache_, chainKey);
+    }
+  }
+  else {
+    for (auto* op : operators_)
+      op->unsetResultCache();
   }
 
   if (printLevel_ > 0)
     *stream_ << std::endl;
 
-  if (useTimers_)
-    timers_.resize(operators_.size());
+  if (useTimers_) {
+    timers_.assign(operators_.size(), StageTimer());
+    fillTimer_ = StageTimer();
+    writeTimer_ = StageTimer();
+  }
 }
 
 void
@@ -110,10 +200,25 @@ EventSelectorBase::finalize()
   if (!skimOut_)
     return;
 
+  if (useTimers_)
+    writeTimer_.start();
+
   auto* outputFile(skimOut_->GetCurrentFile());
   outputFile->cd();
   skimOut_->Write();
-  cutsOut_->Write();
+  if (cutsOut_)
+    cutsOut_->Write();
+
+  if (cutflowCounts_)
+    writeCutflowSummary_();
+
+  if (useTimers_) {
+    outputBytes_.clear();
+    for (auto* obj : *skimOut_->GetListOfBranches()) {
+      auto* branch(static_cast<TBranch*>(obj));
+      outputBytes_.emplace_back(branch->GetName(), std::make_pair(long(branch->GetTotBytes("*")), long(branch->GetZipBytes("*"))));
+    }
+  }
 
   // save additional output if there are any
   addOutput_(outputFile);
@@ -122,20 +227,159 @@ EventSelectorBase::finalize()
   skimOut_ = 0;
   cutsOut_ = 0;
 
+  if (atomicOutput_ && gSystem->Rename(outputPath_ + ".part", outputPath_) != 0)
+    throw std::runtime_error(("Failed to rename " + outputPath_ + ".part").Data());
+
+  if (useTimers_)
+    writeTimer_.stop();
+
+  delete cutflowCounts_;
+  delete cutflowWeights_;
+  cutflowCounts_ = 0;
+  cutflowWeights_ = 0;
+
   if (useTimers_) {
-    *stream_ << "Operator runtimes for " << name() << " (CPU seconds):" << std::endl;
+    *stream_ << "Operator runtimes for " << name() << " (wall / CPU seconds):" << std::endl;
+    stream_->flags(std::ios_base::fixed);
     for (unsigned iO(0); iO != operators_.size(); ++iO) {
-      stream_->flags(std::ios_base::fixed);
       stream_->width(5);
-      *stream_ << " " << (std::chrono::duration_cast<std::chrono::nanoseconds>(timers_[iO]).count() * 1.e-9) << " " << operators_[iO]->name() << std::endl;
+      *stream_ << " " << timers_[iO].wall() << " / " << timers_[iO].cpu() << " " << operators_[iO]->name() << std::endl;
+    }
+    *stream_ << " " << fillTimer_.wall() << " / " << fillTimer_.cpu() << " (fill)" << std::endl;
+    *stream_ << " " << writeTimer_.wall() << " / " << writeTimer_.cpu() << " (write)" << std::endl;
+  }
+}
+
+void
+EventSelectorBase::writeProfile(std::ostream& _out) const
+{
+  _out << "{\"name\": \"" << name_ << "\", \"class\": \"" << className() << "\",\n";
+
+  _out << "   \"operators\": [";
+  for (unsigned iO(0); iO != timers_.size(); ++iO) {
+    if (iO != 0)
+      _out << ",";
+    _out << "\n    {\"name\": \"" << operators_[iO]->name() << "\", \"time\": ";
+    timers_[iO].writeJSON(_out);
+    _out << "}";
+  }
+  _out << "],\n";
+
+  _out << "   \"fill\": ";
+  fillTimer_.writeJSON(_out);
+  _out << ",\n   \"write\": ";
+  writeTimer_.writeJSON(_out);
+
+  _out << ",\n   \"branches\": {";
+  for (unsigned iB(0); iB != outputBytes_.size(); ++iB) {
+    if (iB != 0)
+      _out << ",";
+    _out << "\n    \"" << outputBytes_[iB].first << "\": {\"totBytes\": " << outputBytes_[iB].second.first << ", \"zipBytes\": " << outputBytes_[iB].second.second << "}";
+  }
+  _out << "}}";
+}
+
+bool
+EventSelectorBase::execOperators_(panda::EventMonophoton const& _event, panda::EventBase& _outEvent, unsigned _begin, unsigned _end, bool _pass/* = true*/)
+{
+  for (unsigned iO(_begin); iO != _end; ++iO) {
+    auto& op(*operators_[iO]);
+
+    if (skipAfterFail_ && !_pass && op.skippable()) {
+      op.skip();
+      continue;
     }
+
+    if (useTimers_)
+      timers_[iO].start();
+
+    if (!op.exec(_event, _outEvent))
+      _pass = false;
+
+    if (useTimers_)
+      timers_[iO].stop();
   }
+
+  return _pass;
+}
+
+void
+EventSelectorBase::fillCutflow_()
+{
+  StageTimer::Scope timer(fillTimer_, useTimers_);
+
+  if (cutsOut_)
+    cutsOut_->Fill();
+
+  if (!cutflowCounts_)
+    return;
+
+  cutflowCounts_->Fill(0.);
+  cutflowWeights_->Fill(0., inWeight_);
+
+  ULong64_t mask(0);
+  bool passAll(true);
+  for (unsigned iC(0); iC != cutResults_.size(); ++iC) {
+    if (*cutResults_[iC])
+      mask |= (ULong64_t(1) << iC);
+    else
+      passAll = false;
+
+    if (passAll) {
+      cutflowCounts_->Fill(iC + 1.);
+      cutflowWeights_->Fill(iC + 1., inWeight_);
+    }
+  }
+
+  auto& counters(cutMasks_[mask]);
+  counters[0] += 1.;
+  counters[1] += inWeight_;
+  counters[2] += inWeight_ * inWeight_;
+}
+
+void
+EventSelectorBase::writeCutflowSummary_()
+{
+  cutflowCounts_->Write();
+  cutflowWeights_->Write();
+
+  // One entry per observed combination of cut results. Bit i corresponds to bin i + 2 of cutflowCounts.
+  auto* masksOut(new TTree("cutmasks", "Cut result combinations"));
+  ULong64_t mask(0);
+  double count(0.);
+  double sumw(0.);
+  double sumw2(0.);
+  masksOut->Branch("mask", &mask, "mask/l");
+  masksOut->Branch("count", &count, "count/D");
+  masksOut->Branch("sumw", &sumw, "sumw/D");
+  masksOut->Branch("sumw2", &sumw2, "sumw2/D");
+
+  for (auto& entry : cutMasks_) {
+    mask = entry.first;
+    count = entry.second[0];
+    sumw = entry.second[1];
+    sumw2 = entry.second[2];
+    masksOut->Fill();
+  }
+
+  masksOut->Write();
 }
 
 //--------------------------------------------------------------------
 // EventSelector
 //--------------------------------------------------------------------
 
+void
+EventSelector::addInputBranch_(panda::utils::BranchList& _blist, bool _isMC)
+{
+  // inputs of the branches copied in setupSkim_ (pfCandidates are read only if an operator needs them)
+  _blist += {"npv", "rho", "vertices"};
+  if (_isMC)
+    _blist += {"partons", "genVertex"};
+  else
+    _blist += {"metFilters"};
+}
+
 void
 EventSelector::setupSkim_(panda::EventMonophoton& _inEvent, bool _isMC)
 {
@@ -175,32 +419,20 @@ EventSelector::selectEvent(panda::EventMonophoton& _event)
   inWeight_ = _event.weight;
   outEvent_.weight = _event.weight;
 
-  Clock::time_point start;
-
-  bool pass(true);
-  for (unsigned iO(0); iO != operators_.size(); ++iO) {
-    auto& op(*operators_[iO]);
-    
-    if (useTimers_)
-      start = Clock::now();
-
-    if (!op.exec(_event, outEvent_))
-      pass = false;
-
-    if (useTimers_)
-      timers_[iO] += Clock::now() - start;
-  }
+  bool pass(execOperators_(_event, outEvent_, 0, operators_.size()));
 
   if (pass) {
     // IMPORTATNT
     // We link these skimOut branches to the input event. Need to refresh the addresses in case
     // collections are resized.
+    StageTimer::Scope timer(fillTimer_, useTimers_);
+
     prepareFill_(_event);
 
     outEvent_.fill(*skimOut_);
   }
 
-  cutsOut_->Fill();
+  fillCutflow_();
 }
 
 //--------------------------------------------------------------------
@@ -225,24 +457,9 @@ ZeeEventSelector::selectEvent(panda::EventMonophoton& _event)
   inWeight_ = _event.weight;
   outEvent_.weight = _event.weight;
 
-  Clock::time_point start;
+  unsigned iLS(leptonSelection_ - operators_.begin());
 
-  bool passUpToLS(true);
-  unsigned iO(0);
-  for (auto itr(operators_.begin()); itr != leptonSelection_; ++itr) {
-    auto& op(**itr);
-    
-    if (useTimers_)
-      start = Clock::now();
-
-    if (!op.exec(_event, outEvent_))
-      passUpToLS = false;
-
-    if (useTimers_)
-      timers_[iO] += Clock::now() - start;
-
-    ++iO;
-  }
+  bool passUpToLS(execOperators_(_event, outEvent_, 0, iLS));
 
   if (passUpToLS && outEvent_.photons.size() > 1) {
     // Assumption: Photon selector is run
@@ -253,60 +470,33 @@ ZeeEventSelector::selectEvent(panda::EventMonophoton& _event)
       outEvent_.photons.clear();
       outEvent_.photons.push_back(photon);
 
-      bool pass(true);
-
-      unsigned iOPair(iO);
-      for (auto itr(leptonSelection_); itr != operators_.end(); ++itr) {
-        auto& op(**itr);
-
-        if (useTimers_)
-          start = Clock::now();
-
-        if (!op.exec(_event, outEvent_))
-          pass = false;
-
-        if (useTimers_)
-          timers_[iOPair] += Clock::now() - start;
-
-        ++iOPair;
-      }
+      bool pass(execOperators_(_event, outEvent_, iLS, operators_.size()));
 
       if (pass) {
+        StageTimer::Scope timer(fillTimer_, useTimers_);
+
         prepareFill_(_event);
           
         outEvent_.fill(*skimOut_);
       }
 
-      cutsOut_->Fill();
+      fillCutflow_();
     }
   }
   else {
     // just run the remaining operators
 
-    bool pass(passUpToLS);
-
-    for (auto itr(leptonSelection_); itr != operators_.end(); ++itr) {
-      auto& op(**itr);
-
-      if (useTimers_)
-        start = Clock::now();
-
-      if (!op.exec(_event, outEvent_))
-        pass = false;
-
-      if (useTimers_)
-        timers_[iO] += Clock::now() - start;
-
-      ++iO;
-    }
+    bool pass(execOperators_(_event, outEvent_, iLS, operators_.size(), passUpToLS));
 
     if (pass) {
+      StageTimer::Scope timer(fillTimer_, useTimers_);
+
       prepareFill_(_event);
           
       outEvent_.fill(*skimOut_);
     }
 
-    cutsOut_->Fill();
+    fillCutflow_();
   }
 }
 
@@ -356,6 +546,8 @@ NormalizingSelector::addOutput_(TFile*& _outputFile)
   tmpName.ReplaceAll(".root", "_normalizing.root");
 
   auto* trueOutput(TFile::Open(tmpName, "recreate"));
+  if (compression_ >= 0)
+    trueOutput->SetCompressionSettings(compression_);
   auto* trueSkim(skimOut_->CloneTree(0));
   double weight(0.);
   trueSkim->SetBranchAddress("weight", &weight);
@@ -370,8 +562,12 @@ NormalizingSelector::addOutput_(TFile*& _outputFile)
 
   trueOutput->cd();
   trueSkim->Write();
-  auto* trueCuts(cutsOut_->CloneTree(-1, "fast"));
-  trueCuts->Write();
+  if (cutsOut_) {
+    auto* trueCuts(cutsOut_->CloneTree(-1, "fast"));
+    trueCuts->Write();
+  }
+  if (cutflowCounts_)
+    writeCutflowSummary_();
 
   delete trueOutput;
 
@@ -415,6 +611,14 @@ SmearingSelector::selectEvent(panda::EventMonophoton& _event)
 #include "PandaTree/Objects/interface/EventTP2E.h"
 #include "PandaTree/Objects/interface/EventTP2M.h"
 
+void
+TagAndProbeSelector::addInputBranch_(panda::utils::BranchList& _blist, bool _isMC)
+{
+  _blist += {"npv", "rho", "pfMet"};
+  if (_isMC)
+    _blist += {"npvTrue"};
+}
+
 void
 TagAndProbeSelector::setupSkim_(panda::EventMonophoton& _inEvent, bool _isMC)
 {
@@ -474,24 +678,12 @@ TagAndProbeSelector::selectEvent(panda::EventMonophoton& _event)
 
   outEvent_->sample = sampleId_;
 
-  Clock::time_point start;
-
-  bool pass(true);
-  for (unsigned iO(0); iO != operators_.size(); ++iO) {
-    auto& op(*operators_[iO]);
-
-    if (useTimers_)
-      start = Clock::now();
-
-    if (!op.exec(_event, *outEvent_))
-      pass = false;
-
-    if (useTimers_)
-      timers_[iO] += Clock::now() - start;
-  }
+  bool pass(execOperators_(_event, *outEvent_, 0, operators_.size()));
 
-  if (pass)
+  if (pass) {
+    StageTimer::Scope timer(fillTimer_, useTimers_);
     outEvent_->fill(*skimOut_);
+  }
 
-  cutsOut_->Fill();
+  fillCutflow_();
 }
@@ -5,19 +5,62 @@
 #include "TFile.h"
 #include "TString.h"
 #include "TF1.h"
+#include "TH1D.h"
 
 #include "operators.h"
 
 #include <vector>
+#include <map>
+#include <array>
 #include <chrono>
 #include <iostream>
+#include <ctime>
 
 typedef std::chrono::high_resolution_clock Clock;
 
+class StageTimer {
+  // Accumulates wall and CPU (of the calling thread) time over start/stop pairs
+ public:
+  void start() { wallStart_ = Clock::now(); cpuStart_ = cpuNow(); }
+  void stop() { wall_ += Clock::now() - wallStart_; cpu_ += cpuNow() - cpuStart_; ++calls_; }
+
+  double wall() const { return std::chrono::duration_cast<std::chrono::nanoseconds>(wall_).count() * 1.e-9; }
+  double cpu() const { return cpu_; }
+  unsigned long calls() const { return calls_; }
+
+  // JSON object {"wall": .., "cpu": .., "calls": ..}
+  void writeJSON(std::ostream&) const;
+
+  static double cpuNow() { timespec ts; clock_gettime(CLOCK_THREAD_CPUTIME_ID, &ts); return ts.tv_sec + ts.tv_nsec * 1.e-9; }
+
+  class Scope {
+    // Times the lifetime of the object if enabled
+  public:
+    Scope(StageTimer& t, bool enabled) : timer_(enabled ? &t : 0) { if (timer_) timer_->start(); }
+    ~Scope() { if (timer_) timer_->stop(); }
+  private:
+    StageTimer* timer_;
+  };
+
+ private:
+  Clock::time_point wallStart_{};
+  double cpuStart_{0.};
+  Clock::duration wall_{0};
+  double cpu_{0.};
+  unsigned long calls_{0};
+};
+
 class Operator;
 
 class EventSelectorBase {
 public:
+  enum CutflowMode {
+    kCutflowTree, // per-event tree of cut results
+    kCutflowSummary, // counters and cut-combination masks only
+    kCutflowBoth,
+    kCutflowNone // no cutflow output
+  };
+
   EventSelectorBase(char const* name) : name_(name) {}
   virtual ~EventSelectorBase();
 
@@ -30,6 +73,8 @@ public:
 
   void initialize(char const* outputPath, panda::EventMonophoton& inEvent, panda::utils::BranchList& blist, bool isMC);
   void finalize();
+  // Timers and output sizes as a JSON object (requires setUseTimers(true))
+  void writeProfile(std::ostream&) const;
   virtual void selectEvent(panda::EventMonophoton&) = 0;
 
   TString const& name() const { return name_; }
@@ -40,11 +85,34 @@ public:
 
   void setOwnOperators(bool b) { ownOperators_ = b; }
   void setUseTimers(bool b) { useTimers_ = b; }
+  // Skip the remaining operators once a cut fails. Skipped cuts are recorded as false in the cutflow tree.
+  void setLazyEvaluation(bool b) { lazyEvaluation_ = b; }
+  void setCutflowMode(CutflowMode m) { cutflowMode_ = m; }
   void setPrintLevel(unsigned l, std::ostream* st = 0) { printLevel_ = l; if (st) stream_ = st; }
+  // Output file and skim tree layout (must be set before initialize). Negative / zero values keep the ROOT defaults.
+  void setCompression(int algorithm, int level) { compression_ = algorithm * 100 + level; }
+  void setBasketSize(int s) { basketSize_ = s; }
+  // Cluster size of the skim tree in entries (> 0) or bytes (< 0)
+  void setAutoFlush(long n) { autoFlush_ = n; }
+  // Write to <outputPath>.part and rename to outputPath in finalize
+  void setAtomicOutput(bool b) { atomicOutput_ = b; }
+  // Share operator results with other selectors through the cache (must be set before initialize)
+  void setResultCache(OperatorCache* c) { resultCache_ = c; }
 
 protected:
+  // Input branches read by the selector itself (e.g. copied directly to the skim); operators declare their own
+  virtual void addInputBranch_(panda::utils::BranchList&, bool isMC) {}
   virtual void setupSkim_(panda::EventMonophoton& inEvent, bool isMC) {}
   virtual void addOutput_(TFile*& outputFile) {}
+  // Number of leading operators that are executed once per event on a freshly initialized output event.
+  // Only these can take results that depend on the output event from the cache.
+  virtual unsigned sharedPrefixSize_() const { return operators_.size(); }
+  // Execute operators [begin, end) and return the combined decision
+  bool execOperators_(panda::EventMonophoton const&, panda::EventBase&, unsigned begin, unsigned end, bool pass = true);
+  // Record the cut results of the current event (tree entry and/or summary counters)
+  void fillCutflow_();
+  // Write the cutflow summary objects to the current directory
+  void writeCutflowSummary_();
 
   TString name_;
   TTree* skimOut_{0};
@@ -56,12 +124,33 @@ protected:
   double inWeight_{1.};
 
   bool useTimers_{false};
-  std::vector<Clock::duration> timers_;
+  std::vector<StageTimer> timers_;
+  StageTimer fillTimer_;
+  StageTimer writeTimer_;
+  std::vector<std::pair<TString, std::pair<long, long>>> outputBytes_{}; // branch -> (total, compressed)
+
+  bool lazyEvaluation_{false};
+  // lazy evaluation is only applied when no cut results are recorded
+  bool skipAfterFail_{false};
+
+  CutflowMode cutflowMode_{kCutflowTree};
+  std::vector<bool const*> cutResults_{};
+  TH1D* cutflowCounts_{0}; // bin 1: input, bin i+2: passing cuts 0..i in operator order
+  TH1D* cutflowWeights_{0}; // same with input weights
+  std::map<ULong64_t, std::array<double, 3>> cutMasks_{}; // bit i = cut i passed -> {count, sumw, sumw2}
 
   TString preskim_{""};
 
+  TString outputPath_{""};
+  int compression_{-1};
+  int basketSize_{-1};
+  long autoFlush_{0};
+  bool atomicOutput_{true};
+
   unsigned printLevel_{0};
   std::ostream* stream_{&std::cout};
+
+  OperatorCache* resultCache_{0};
 };
 
 class EventSelector : public EventSelectorBase {
@@ -76,6 +165,7 @@ public:
   void setPartialBlinding(unsigned prescale, unsigned minRun = 0) { blindPrescale_ = prescale; blindMinRun_ = minRun; }
 
  protected:
+  void addInputBranch_(panda::utils::BranchList&, bool isMC) override;
   void setupSkim_(panda::EventMonophoton& event, bool isMC) override;
   void prepareFill_(panda::EventMonophoton&);
 
@@ -97,6 +187,8 @@ class ZeeEventSelector : public EventSelector {
 
  protected:
   void setupSkim_(panda::EventMonophoton& event, bool isMC) override;
+  // operators from LeptonSelection on are executed once per photon
+  unsigned sharedPrefixSize_() const override { return leptonSelection_ - operators_.begin(); }
 
   std::vector<Operator*>::iterator leptonSelection_;
 };
@@ -154,6 +246,10 @@ class SmearingSelector : public EventSelector {
   void setFunction(TF1* func) { func_ = func; }
 
  protected:
+  void addInputBranch_(panda::utils::BranchList& blist, bool isMC) override { EventSelector::addInputBranch_(blist, isMC); blist += {"pfMet"}; }
+  // operators are executed nSamples times per event with a modified input MET
+  unsigned sharedPrefixSize_() const override { return 0; }
+
   unsigned nSamples_{1};
   TF1* func_{0};
 };
@@ -171,7 +267,10 @@ public:
   void setSampleId(unsigned id) { sampleId_ = id; }
 
  protected:
+  void addInputBranch_(panda::utils::BranchList&, bool isMC) override;
   void setupSkim_(panda::EventMonophoton& inEvent, bool isMC) override;
+  // the output event is not an EventMonophoton
+  unsigned sharedPrefixSize_() const override { return 0; }
 
   TPEventType outType_{nOutTypes};
   panda::EventTP* outEvent_{0};
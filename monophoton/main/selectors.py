@@ -2885,6 +2885,13 @@ def setSampleId(sample, selector):
     else:
         selector.setSampleId(99)
 
+def lazyEvaluation(sample, selector):
+    """Stop evaluating operators once a cut fails. For selectors with high rejection. Only takes effect
+    when no cutflow output is written (ssw2.py --cutflow none), since recorded cut results require
+    every cut to be evaluated."""
+
+    selector.setLazyEvaluation(True)
+
 def modHfake(selector):
     """Append PhotonPtWeight with hadProxyWeight and set up the photon selections."""
 
@@ -2985,6 +2992,22 @@ def genBosonPtTruncator(minimum = 0., maximum = -1.):
 
     return addGenBosonPtCut
 
+def outputSettings(algorithm = 0, level = -1, basketSize = -1, autoFlush = 0):
+    """
+    Output file layout of the skim. algorithm and level are the ROOT compression settings (level < 0 keeps
+    the default), basketSize is in bytes, autoFlush is the cluster size in entries (> 0) or bytes (< 0).
+    """
+
+    def setOutput(sample, selector):
+        if level >= 0:
+            selector.setCompression(algorithm, level)
+        if basketSize > 0:
+            selector.setBasketSize(basketSize)
+        if autoFlush != 0:
+            selector.setAutoFlush(autoFlush)
+
+    return setOutput
+
 
 if needHelp:
     sys.argv.append('--help')
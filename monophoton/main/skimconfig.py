@@ -120,6 +120,13 @@ allSelectors_byPattern = [
     ('hbb-nlo-125', mc_sig)
 ]
 
+## Output layout per selector name ('*' for all others). Skims are written once and read many times by
+## MultiDraw, which reads a few branches of all entries: zlib decompression speed does not depend on the
+## level, so a higher level only costs at write time, and large clusters mean fewer, larger reads.
+outputSettings = {
+    '*': s.outputSettings(algorithm = 1, level = 4, autoFlush = -64 * 1024 * 1024)
+}
+
 allSelectors = {}
 for pat, sels in allSelectors_byPattern:
     samples = allsamples.getmany(pat)
@@ -136,5 +143,15 @@ for pat, sels in allSelectors_byPattern:
                 sampleSelectors[sel[0]] = sel[1]
             else:
                 sampleSelectors[sel[0]] = sel[1:]
+
+        for rname, selgen in sampleSelectors.items():
+            mod = outputSettings.get(rname, outputSettings.get('*'))
+            if mod is None:
+                continue
+
+            if type(selgen) is tuple:
+                sampleSelectors[rname] = selgen + (mod,)
+            else:
+                sampleSelectors[rname] = (selgen, mod)
             
         allSelectors[sample] = sampleSelectors
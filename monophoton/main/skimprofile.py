@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+#-------------------------------------------------------------------------------
+# skimprofile.py
+#
+# Sum up the profile JSON files written by ssw2.py --timer (one per skim job)
+# and print a stage / operator breakdown of the skim time and the I/O volume.
+# Usage: skimprofile.py '/data/skim/*_profile.json' [-c] [-n 20]
+#
+#-------------------------------------------------------------------------------
+
+import sys
+import os
+import json
+import glob
+import collections
+
+stages = ['open', 'preselection', 'read', 'prepareEvent', 'select', 'write']
+
+def newTimer():
+    return {'wall': 0., 'cpu': 0., 'calls': 0}
+
+def addTimer(target, source):
+    for key in ['wall', 'cpu', 'calls']:
+        target[key] += source[key]
+
+class Profile(object):
+    """
+    Sum of the profiles of multiple skim jobs.
+    """
+
+    def __init__(self):
+        self.njobs = 0
+        self.wall = 0.
+        self.scanned = 0
+        self.read = 0
+        self.stages = collections.OrderedDict((stage, newTimer()) for stage in stages)
+        self.bytesRead = 0
+        self.inputBranches = collections.defaultdict(int)
+        # selector name -> {'operators': OrderedDict(name -> timer), 'fill': timer, 'write': timer, 'branches': {name: [tot, zip]}}
+        self.selectors = collections.OrderedDict()
+
+    def add(self, content):
+        self.njobs += 1
+        self.wall += content['wall']
+        self.scanned += content['events']['scanned']
+        self.read += content['events']['read']
+
+        for stage, timer in content['stages'].iteritems():
+            addTimer(self.stages.setdefault(stage, newTimer()), timer)
+
+        self.bytesRead += content['input']['bytesRead']
+        for name, sizes in content['input']['branches'].iteritems():
+            self.inputBranches[name] += sizes['zipBytes']
+
+        for sel in content['selectors']:
+            try:
+                summary = self.selectors[sel['name']]
+            except KeyError:
+                summary = self.selectors[sel['name']] = {'operators': collections.OrderedDict(), 'fill': newTimer(), 'write': newTimer(), 'branches': collections.defaultdict(lambda: [0, 0])}
+
+            for op in sel['operators']:
+                addTimer(summary['operators'].setdefault(op['name'], newTimer()), op['time'])
+
+            addTimer(summary['fill'], sel['fill'])
+            addTimer(summary['write'], sel['write'])
+
+            for name, sizes in sel['branches'].iteritems():
+                summary['branches'][name][0] += sizes['totBytes']
+                summary['branches'][name][1] += sizes['zipBytes']
+
+def formatBytes(nbytes):
+    for unit in ['B', 'kB', 'MB', 'GB']:
+        if abs(nbytes) < 1024.:
+            return '%.1f %s' % (nbytes, unit)
+        nbytes /= 1024.
+
+    return '%.1f TB' % nbytes
+
+def printFlame(profile, key, minFraction):
+    """
+    Print the time tree total -> stage -> selector -> operator with the fraction of the total time.
+    Operators are timed within the select stage, selector output writing within the write stage.
+    """
+
+    if profile.wall == 0.:
+        return
+
+    def line(depth, name, timer):
+        fraction = timer[key] / profile.wall
+        if fraction < minFraction:
+            return
+
+        bar = '#' * int(round(fraction * 40))
+        print '%-50s %10.2f %6.1f%% %s' % ('  ' * depth + name, timer[key], fraction * 100., bar)
+
+    print '%-50s %10s %7s' % ('', key + ' [s]', '')
+    line(0, 'total', {key: profile.wall})
+
+    for stage, timer in profile.stages.iteritems():
+        line(1, stage, timer)
+
+        if stage == 'select':
+            for selName, summary in profile.selectors.iteritems():
+                selTimer = newTimer()
+                for opTimer in summary['operators'].itervalues():
+                    addTimer(selTimer, opTimer)
+                addTimer(selTimer, summary['fill'])
+
+                line(2, selName, selTimer)
+
+                for opName, opTimer in sorted(summary['operators'].iteritems(), key = lambda (n, t): t[key], reverse = True):
+                    line(3, opName, opTimer)
+
+                line(3, '(fill)', summary['fill'])
+
+        elif stage == 'write':
+            for selName, summary in profile.selectors.iteritems():
+                line(2, selName, summary['write'])
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    argParser = ArgumentParser(description = 'Summarize skim profiles')
+    argParser.add_argument('paths', metavar = 'PATH', nargs = '+', help = 'Profile JSON files (wildcard allowed).')
+    argParser.add_argument('--cpu', '-c', action = 'store_true', dest = 'cpu', help = 'Show CPU time instead of wall-clock time.')
+    argParser.add_argument('--branches', '-n', metavar = 'N', dest = 'nbranches', type = int, default = 20, help = 'Number of largest branches to list.')
+    argParser.add_argument('--min-fraction', '-f', metavar = 'FRAC', dest = 'minFraction', type = float, default = 0.001, help = 'Hide entries below this fraction of the total time.')
+
+    args = argParser.parse_args()
+    sys.argv = []
+
+    paths = []
+    for path in args.paths:
+        if '*' in path:
+            paths.extend(sorted(glob.glob(path)))
+        else:
+            paths.append(path)
+
+    profile = Profile()
+
+    for path in paths:
+        try:
+            with open(path) as source:
+                profile.add(json.loads(source.read()))
+        except (IOError, ValueError, KeyError):
+            print 'Could not read', path
+            continue
+
+    if profile.njobs == 0:
+        print 'No profile read.'
+        sys.exit(1)
+
+    key = 'cpu' if args.cpu else 'wall'
+
+    print 'Jobs:', profile.njobs
+    print 'Events scanned: %d, read: %d' % (profile.scanned, profile.read)
+    if profile.wall > 0.:
+        # summed over jobs, i.e. per-core throughput
+        print 'Events / s: %.1f' % (profile.scanned / profile.wall)
+    print 'Input bytes read:', formatBytes(profile.bytesRead)
+    print ''
+
+    printFlame(profile, key, args.minFraction)
+
+    print ''
+    print 'Largest input branches (compressed size)'
+    for name, size in sorted(profile.inputBranches.iteritems(), key = lambda (n, s): s, reverse = True)[:args.nbranches]:
+        print ' %-50s %12s' % (name, formatBytes(size))
+
+    for selName, summary in profile.selectors.iteritems():
+        branches = summary['branches']
+        if len(branches) == 0:
+            continue
+
+        totals = [sum(s[i] for s in branches.itervalues()) for i in range(2)]
+        print ''
+        print 'Output of %s: %s (%s compressed)' % (selName, formatBytes(totals[0]), formatBytes(totals[1]))
+        for name, (tot, zipped) in sorted(branches.iteritems(), key = lambda (n, s): s[1], reverse = True)[:args.nbranches]:
+            print ' %-50s %12s %12s' % (name, formatBytes(tot), formatBytes(zipped))
@@ -4,6 +4,8 @@ import sys
 import os
 import subprocess
 import collections
+import multiprocessing
+import glob
 
 from batch import BatchManager
 
@@ -15,6 +17,28 @@ logger = None
 
 padd = os.environ['CMSSW_BASE'] + '/bin/' + os.environ['SCRAM_ARCH'] + '/padd'
 
+# SkimSlimWeight object whose skim is being split; set before forking the worker pool
+_skimJob = None
+
+def _skimPart(task):
+    """
+    Worker function for SkimSlimWeight.skimSplit. Runs a fresh Skimmer over a subset of files.
+    """
+
+    skimOutDir, outNameBase, fnames = task
+
+    skimmer, selectors = _skimJob.makeSkimmer()
+    for fname in fnames:
+        skimmer.addPath(fname)
+
+    if SkimSlimWeight.config['timer']:
+        skimmer.setProfile(skimOutDir + '/' + outNameBase + '_profile.json')
+
+    logger.debug('Skimmer.run(%s, %s, %s)', skimOutDir, outNameBase, _skimJob.sample.data)
+    skimmer.run(skimOutDir, outNameBase, _skimJob.sample.data)
+
+    return outNameBase
+
 class SkimSlimWeight(object):
 
     config = {}
@@ -107,9 +131,9 @@ class SkimSlimWeight(object):
     
         return True
 
-    def executeSkim(self):
+    def makeSkimmer(self):
         """
-        Execute the skim.
+        Create a Skimmer with the configured selectors attached. Returns (skimmer, [selectors]).
         """
 
         skimmer = ROOT.Skimmer()
@@ -120,6 +144,14 @@ class SkimSlimWeight(object):
 
         if SkimSlimWeight.config['openTimeout'] is not None:
             ROOT.TIMEOUT = SkimSlimWeight.config['openTimeout']
+
+        if SkimSlimWeight.config['cacheSize'] is not None:
+            skimmer.setCacheSize(SkimSlimWeight.config['cacheSize'] * 1024 * 1024)
+
+        if SkimSlimWeight.config['openThreads'] is not None:
+            skimmer.setNumOpenThreads(SkimSlimWeight.config['openThreads'])
+
+        skimmer.setReadAllBranches(SkimSlimWeight.config['allBranches'])
            
         # temporary - backward compatibility issue 004 -> 005/006/007
         if self.sample.book != 'pandaf/004':
@@ -127,6 +159,7 @@ class SkimSlimWeight(object):
 
         # can eventually think of submitting jobs separately for different preskims
         bypreskim = collections.defaultdict(list)
+        selectors = []
         for rname, selgen in self.selectors.items():
             if type(selgen) is tuple: # has modifiers
                 selector = selgen[0](self.sample, rname)
@@ -136,15 +169,17 @@ class SkimSlimWeight(object):
                 selector = selgen(self.sample, rname)
 
             selector.setUseTimers(SkimSlimWeight.config['timer'])
+            selector.setCutflowMode(getattr(ROOT.EventSelectorBase, 'kCutflow' + SkimSlimWeight.config['cutflowMode'].capitalize()))
             skimmer.addSelector(selector)
+            selectors.append(selector)
 
             bypreskim[selector.getPreskim()].append(selector)
 
         if len(bypreskim) > 1:
             print 'Selectors with different preskims mixed. Aborting.'
-            for preskim, selectors in bypreskim.iteritems():
+            for preskim, sels in bypreskim.iteritems():
                 print preskim
-                print ' ' + ' '.join(str(s.name()) for s in selectors)
+                print ' ' + ' '.join(str(s.name()) for s in sels)
 
             raise RuntimeError('invalid configuration')
 
@@ -152,6 +187,15 @@ class SkimSlimWeight(object):
             logger.info('Good lumi filter: %s', SkimSlimWeight.config['json'])
             skimmer.setGoodLumiFilter(makeGoodLumiFilter(SkimSlimWeight.config['json']))
 
+        return skimmer, selectors
+
+    def executeSkim(self):
+        """
+        Execute the skim.
+        """
+
+        skimmer, selectors = self.makeSkimmer()
+
         paths = {} # {filset: list of paths}
     
         if self.manual:
@@ -171,25 +215,63 @@ class SkimSlimWeight(object):
                     paths[fileset].append(path)
 
         tmpOutDir = self.tmpDir + '/' + self.sample.name
+
+        # Selectors write <name>.root.part files and rename them when complete, so the output can be
+        # written directly to the final destination without a copy.
+        writeDirect = SkimSlimWeight.config['writeDirect'] and not SkimSlimWeight.config['testRun']
+        if writeDirect:
+            skimOutDir = self.outDir
+        else:
+            skimOutDir = tmpOutDir
+
+        nentries = SkimSlimWeight.config['nentries']
+        firstEntry = SkimSlimWeight.config['firstEntry']
+
+        numJobs = SkimSlimWeight.config['numJobs']
+        if numJobs > 1:
+            # entry ranges are defined over the full chain, and the normalization of NormalizingSelector
+            # is computed from its full output -> these cannot be split into file subsets
+            # SmearingSelector (gRandom) and PhotonFakeMet (fixed seed) would replay the same random sequence
+            # in every part -> the output would differ from a serial run and the parts would be correlated
+            if nentries >= 0 or firstEntry != 0:
+                logger.warning('Entry range is set. Skimming serially.')
+                numJobs = 1
+            elif any(isinstance(selector, ROOT.NormalizingSelector) for selector in selectors):
+                logger.warning('NormalizingSelector cannot be run on file subsets. Skimming serially.')
+                numJobs = 1
+            elif any(isinstance(selector, ROOT.SmearingSelector) for selector in selectors):
+                logger.warning('SmearingSelector cannot be run on file subsets. Skimming serially.')
+                numJobs = 1
+            elif any(isinstance(selector.getOperator(iop), ROOT.PhotonFakeMet) for selector in selectors for iop in range(selector.size())):
+                logger.warning('PhotonFakeMet cannot be run on file subsets. Skimming serially.')
+                numJobs = 1
     
         for fileset, fnames in paths.items():
             print 'Fileset', fileset
 
-            skimmer.clearPaths()
-            for fname in fnames:
-                skimmer.addPath(fname)
-
             outNameBase = self.getOutNameBase(fileset)
-            nentries = SkimSlimWeight.config['nentries']
-            firstEntry = SkimSlimWeight.config['firstEntry']
-    
-            logger.debug('Skimmer.run(%s, %s, %s, %d, %d)', tmpOutDir, outNameBase, self.sample.data, nentries, firstEntry)
-            skimmer.run(tmpOutDir, outNameBase, self.sample.data, nentries, firstEntry)
+
+            if numJobs > 1 and len(fnames) > 1:
+                # parts are always written to the local directory; only the merged output goes to skimOutDir
+                self.skimSplit(fnames, tmpOutDir, skimOutDir, outNameBase, numJobs)
+
+            else:
+                skimmer.clearPaths()
+                for fname in fnames:
+                    skimmer.addPath(fname)
+
+                if SkimSlimWeight.config['timer']:
+                    skimmer.setProfile(tmpOutDir + '/' + outNameBase + '_profile.json')
+        
+                logger.debug('Skimmer.run(%s, %s, %s, %d, %d)', skimOutDir, outNameBase, self.sample.data, nentries, firstEntry)
+                skimmer.run(skimOutDir, outNameBase, self.sample.data, nentries, firstEntry)
     
             for rname in self.selectors:
                 outName = outNameBase + '_' + rname + '.root'
         
-                if SkimSlimWeight.config['testRun']:
+                if writeDirect:
+                    logger.info('Output at %s/%s', self.outDir, outName)
+                elif SkimSlimWeight.config['testRun']:
                     logger.info('Output at %s/%s', tmpOutDir, outName)
                 else:
                     logger.info('Copying output to %s/%s', self.outDir, outName)
@@ -197,6 +279,66 @@ class SkimSlimWeight(object):
                     logger.info('Removing %s/%s', tmpOutDir, outName)
                     os.remove(tmpOutDir + '/' + outName)
 
+            if SkimSlimWeight.config['timer']:
+                # profiles of split skims are kept per part; skimprofile.py sums them up
+                profilePaths = glob.glob(tmpOutDir + '/' + outNameBase + '_profile.json') + glob.glob(tmpOutDir + '/' + outNameBase + '_part*_profile.json')
+                for path in profilePaths:
+                    if SkimSlimWeight.config['testRun']:
+                        logger.info('Profile at %s', path)
+                    else:
+                        logger.info('Copying profile to %s/%s', self.outDir, os.path.basename(path))
+                        shutil.copy(path, self.outDir)
+                        os.remove(path)
+
+    def skimSplit(self, fnames, tmpOutDir, mergeOutDir, outNameBase, numJobs):
+        """
+        Run the skim over contiguous subsets of fnames in numJobs worker processes and merge the partial
+        outputs in file order into mergeOutDir, so that the trees and histograms are identical to a serial run.
+        Selectors drawing random numbers are not split (see executeSkim), since every part would start from the same
+        random state.
+        """
+
+        global _skimJob
+
+        nparts = min(numJobs, len(fnames))
+        tasks = []
+        for ipart in range(nparts):
+            begin = len(fnames) * ipart / nparts
+            end = len(fnames) * (ipart + 1) / nparts
+            tasks.append((tmpOutDir, outNameBase + '_part%d' % ipart, fnames[begin:end]))
+
+        logger.info('Skimming %d files in %d parts.', len(fnames), nparts)
+
+        _skimJob = self
+        pool = multiprocessing.Pool(nparts)
+        try:
+            partNames = pool.map(_skimPart, tasks)
+        finally:
+            pool.close()
+            pool.join()
+            _skimJob = None
+
+        for rname in self.selectors:
+            outPath = mergeOutDir + '/' + outNameBase + '_' + rname + '.root'
+            partPaths = [tmpOutDir + '/' + partName + '_' + rname + '.root' for partName in partNames]
+
+            if os.path.exists(outPath + '.part'):
+                os.remove(outPath + '.part')
+
+            logger.debug('%s %s %s', padd, outPath + '.part', ' '.join(partPaths))
+            proc = subprocess.Popen([padd, outPath + '.part'] + partPaths, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+            out, err = proc.communicate()
+            print out.strip()
+            print err.strip()
+
+            if proc.returncode != 0:
+                raise RuntimeError('Failed to merge partial outputs for ' + outPath)
+
+            os.rename(outPath + '.part', outPath)
+
+            for path in partPaths:
+                os.remove(path)
+
     def setupMerge(self):
         if not os.path.exists(self.tmpDir):
             try:
@@ -307,6 +449,24 @@ class SSWBatchManager(BatchManager):
         if args.openTimeout is not None:
             argTemplate += ' -m ' + str(args.openTimeout)
 
+        if args.cacheSize is not None:
+            argTemplate += ' -z ' + str(args.cacheSize)
+
+        if args.openThreads is not None:
+            argTemplate += ' -O ' + str(args.openThreads)
+
+        if args.cutflowMode != 'tree':
+            argTemplate += ' -k ' + args.cutflowMode
+
+        if args.timer:
+            argTemplate += ' -T'
+
+        if args.allBranches:
+            argTemplate += ' -A'
+
+        if args.writeDirect:
+            argTemplate += ' -d'
+
         for ssw in self.ssws:
             for fileset in ssw.filesets:
                 submitter.job_args.append(argTemplate % (ssw.sample.name, fileset) + ' -s ' + ' '.join(ssw.selectors.keys()))
@@ -337,7 +497,7 @@ if __name__ == '__main__':
     argParser.add_argument('snames', metavar = 'SAMPLE', nargs = '*', help = 'Sample names to skim.')
     argParser.add_argument('--list', '-L', action = 'store_true', dest = 'list', help = 'List of samples.')
     argParser.add_argument('--nentries', '-N', metavar = 'N', dest = 'nentries', type = int, default = -1, help = 'Maximum number of entries.')
-    argParser.add_argument('--timer', '-T', action = 'store_true', dest = 'timer', help = 'Turn on timers on Selectors.')
+    argParser.add_argument('--timer', '-T', action = 'store_true', dest = 'timer', help = 'Turn on timers on Selectors and write a profile JSON (<output>_profile.json) next to the skims.')
     argParser.add_argument('--compile-only', '-C', action = 'store_true', dest = 'compileOnly', help = 'Compile and exit.')
     argParser.add_argument('--json', '-j', metavar = 'PATH', dest = 'json', default = '/cvmfs/cvmfs.cmsaf.mit.edu/hidsk0001/cmsprod/cms/json/Cert_271036-284044_13TeV_23Sep2016ReReco_Collisions16_JSON.txt', help = 'Good lumi list to apply.')
     argParser.add_argument('--catalog', '-c', metavar = 'PATH', dest = 'catalog', default = '', help = 'Source file catalog.')
@@ -356,6 +516,12 @@ if __name__ == '__main__':
     argParser.add_argument('--resubmit', '-S', action = 'store_true', dest = 'autoResubmit', help = '(Without no-wait option) Automatically release held jobs.')
     argParser.add_argument('--skip-missing', '-K', action = 'store_true', dest = 'skipMissing', help = 'Skip missing files in skim.')
     argParser.add_argument('--open-timeout', '-m', metavar = 'SECONDS', dest = 'openTimeout', type = int, help = 'Timeout for opening input files. Open is attempted every 30 seconds.')
+    argParser.add_argument('--open-threads', '-O', metavar = 'N', dest = 'openThreads', type = int, help = 'Number of threads opening the input files in the background, which is also the number of files opened ahead of the one being processed (default 8).')
+    argParser.add_argument('--cache-size', '-z', metavar = 'MB', dest = 'cacheSize', type = int, help = 'Input TTreeCache size in MB (0 to disable).')
+    argParser.add_argument('--cutflow', '-k', metavar = 'MODE', dest = 'cutflowMode', choices = ['tree', 'summary', 'both', 'none'], default = 'tree', help = 'Cutflow output: per-event tree, summary counters and cut masks, both, or none (required for the lazyEvaluation modifier to take effect).')
+    argParser.add_argument('--direct', '-d', action = 'store_true', dest = 'writeDirect', help = 'Write the skim output directly to the destination directory (through .part files renamed on completion) instead of copying from the local tmp directory.')
+    argParser.add_argument('--all-branches', '-A', action = 'store_true', dest = 'allBranches', help = 'Read the full standard set of input branches instead of only those declared by the selectors and operators.')
+    argParser.add_argument('--jobs', '-J', metavar = 'N', dest = 'numJobs', type = int, default = 1, help = 'Number of worker processes to split the input files of each fileset into (interactive skims only).')
     argParser.add_argument('--test-run', '-E', action = 'store_true', dest = 'testRun', help = 'Don\'t copy the output files to the production area. Sets --filesets to 0000 by default.')
     
     args = argParser.parse_args()
@@ -4,6 +4,7 @@
 import os
 import sys
 import array
+import collections
 
 import ROOT
 ROOT.gROOT.SetBatch(True)
@@ -35,27 +36,22 @@ outName = 'trigger'
 outDir = config.histDir + '/trigger'
 
 if not REPLOT:
-    ## FILL DISTRIBUTIONS AND GRAPHS
+    ## BOOK HISTOGRAMS
+    # measurements sharing skim files (e.g. tpeg for photon sel, selBCD, and dy) are filled in one pass over each file
+    outputFiles = {} # {omname: output file}
+    sourcePlots = collections.OrderedDict() # {skim path: [(basesel, [(hist, vexpr, cut)])]}
+
     for omname in omnames:
         oname = omname[0]
         mname = omname[1]
-        print oname, mname
 
         snames, region, basesel, colname = measurements[(oname, mname)]
 
         outputFile = ROOT.TFile.Open(outDir + '/trigger_efficiency_%s_%s.root' % (oname, mname), 'recreate')
+        outputFiles[omname] = outputFile
 
-        # fill the histograms
-        plotter = ROOT.MultiDraw()
-        plotter.setWeightBranch('')
-    
-        for sample in allsamples.getmany(snames):
-            plotter.addInputPath(utils.getSkimPath(sample.name, region))
-    
-        plotter.setBaseSelection(basesel)
-    
         # make an empty histogram for each (trigger, variable) combination
-        histograms = []
+        plots = []
 
         for tname, (passdef, commonsel, title, variables) in confs[oname].items():
             if len(omname) > 2 and tname != omname[2]:
@@ -78,7 +74,6 @@ if not REPLOT:
                 trigDir.cd()
                 hpass = template.Clone(vname + '_pass')
                 hbase = template.Clone(vname + '_base')
-                histograms.extend([hpass, hbase])
     
                 sels = []
                 if commonsel:
@@ -86,17 +81,56 @@ if not REPLOT:
                 if denomdef:
                     sels.append(denomdef)
     
-                plotter.addPlot(hbase, vexpr, ' && '.join(sels), True)
+                plots.append((hbase, vexpr, ' && '.join(sels)))
 
                 sels.append(passdef)
 
-                plotter.addPlot(hpass, vexpr, ' && '.join(sels), True)
+                plots.append((hpass, vexpr, ' && '.join(sels)))
     
                 template.Delete()
-    
+
+        for sample in allsamples.getmany(snames):
+            sourcePlots.setdefault(utils.getSkimPath(sample.name, region), []).append((basesel, plots))
+
+    ## FILL DISTRIBUTIONS
+    for path, measPlots in sourcePlots.items():
+        print path
+
+        plotter = ROOT.MultiDraw()
+        plotter.setWeightBranch('')
+        plotter.addInputPath(path)
+
+        # the base selection shared by most plots is applied by the plotter, the others are added to the plot cuts
+        counts = collections.Counter()
+        for basesel, plots in measPlots:
+            counts[basesel] += len(plots)
+
+        commonBase = counts.most_common(1)[0][0]
+        plotter.setBaseSelection(commonBase)
+
+        for basesel, plots in measPlots:
+            for hist, vexpr, cut in plots:
+                if basesel == commonBase:
+                    plotter.addPlot(hist, vexpr, cut, True)
+                else:
+                    sels = []
+                    if basesel:
+                        sels.append('(' + basesel + ')')
+                    if cut:
+                        sels.append('(' + cut + ')')
+
+                    plotter.addPlot(hist, vexpr, ' && '.join(sels), False)
+
         plotter.fillPlots()
-    
-        # make efficiency graphs and save
+
+    ## MAKE EFFICIENCY GRAPHS AND SAVE
+    for omname in omnames:
+        oname = omname[0]
+        mname = omname[1]
+        print oname, mname
+
+        outputFile = outputFiles[omname]
+
         for tname, (_, _, _, variables) in confs[oname].items():
             if len(omname) > 2 and tname != omname[2]:
                 continue